@@ -0,0 +1,205 @@
+"""
+Benchmark of the result and upload parsers on synthetic inputs of growing
+size. Each parser is timed (best of several runs) and its peak memory is
+measured with tracemalloc in a separate run. Results are compared with a
+stored baseline and the command fails when a parser got slower or uses more
+memory than the tolerance allows. Run from the repository root with:
+
+    python -m benchmarks.parsers
+    python -m benchmarks.parsers --sizes 1 100 --parsers parse_tblout_file
+    python -m benchmarks.parsers --update-baseline
+
+Timings depend on the machine, so refresh the baseline with
+--update-baseline when moving the check to a different one.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+import typing as ty
+
+from benchmarks import synthetic
+from rfam_batch import api
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+SIZES = [1, 100, 10_000, 100_000]
+
+# Slack added to the allowed time, so very fast runs are not flagged on noise
+TIME_SLACK = 0.005
+
+
+def tblout_case(size: int) -> ty.Callable[[], ty.Any]:
+    tblout = synthetic.tblout(synthetic.hits(size, max(1, size // 10)))
+    return lambda: api.parse_tblout_file(tblout)
+
+
+def cm_scan_result_case(size: int) -> ty.Callable[[], ty.Any]:
+    # One query sequence with size hits, every hit gets its alignment
+    hits = synthetic.hits(size)
+    out, tblout = synthetic.out(hits), synthetic.tblout(hits)
+    sequence = synthetic.fasta(1)
+    return lambda: api.parse_cm_scan_result(out, sequence, tblout, "job")
+
+
+def cm_scan_result_json_case(size: int) -> ty.Callable[[], ty.Any]:
+    # Same input as cm_scan_result_case, parsed and serialised as /result
+    # does, to compare with building and serialising the models
+    hits = synthetic.hits(size)
+    out, tblout = synthetic.out(hits), synthetic.tblout(hits)
+    sequence = synthetic.fasta(1)
+    return lambda: api.cm_scan_result_json(out, sequence, tblout, "job")
+
+
+def cm_scan_result_model_json_case(size: int) -> ty.Callable[[], ty.Any]:
+    hits = synthetic.hits(size)
+    out, tblout = synthetic.out(hits), synthetic.tblout(hits)
+    sequence = synthetic.fasta(1)
+    return lambda: api.parse_cm_scan_result(
+        out, sequence, tblout, "job"
+    ).model_dump_json()
+
+
+def sequence_page_case(size: int) -> ty.Callable[[], ty.Any]:
+    # size query sequences with one hit each, indexing the job and parsing
+    # its last page as /sequences does for the first page of a job
+    hits = synthetic.hits(size, size)
+    out = synthetic.out(hits, size).encode()
+    tblout = synthetic.tblout(hits).encode()
+    offset = max(0, size - 20)
+    return lambda: api.sequence_page_document(
+        out, tblout, api.index_sequences(out, tblout), "job", offset, 20
+    )
+
+
+def cached_sequence_page_case(size: int) -> ty.Callable[[], ty.Any]:
+    # Same input as sequence_page_case, with the index cached as /sequences
+    # does after the first page of a finished job
+    hits = synthetic.hits(size, size)
+    out = synthetic.out(hits, size).encode()
+    tblout = synthetic.tblout(hits).encode()
+    index = api.index_sequences(out, tblout).dump()
+    offset = max(0, size - 20)
+    return lambda: api.sequence_page_document(
+        out, tblout, api.SequenceIndex.load(index), "job", offset, 20
+    )
+
+
+def fasta_case(size: int) -> ty.Callable[[], ty.Any]:
+    fasta = synthetic.fasta(size)
+    return lambda: api.SubmittedRequest.parse(fasta)
+
+
+PARSERS = {
+    "parse_tblout_file": tblout_case,
+    "parse_cm_scan_result": cm_scan_result_case,
+    "cm_scan_result_json": cm_scan_result_json_case,
+    "CmScanResult.model_dump_json": cm_scan_result_model_json_case,
+    "index_sequences": sequence_page_case,
+    "sequence_page_document": cached_sequence_page_case,
+    "SubmittedRequest.parse": fasta_case,
+}
+
+
+def measure(run: ty.Callable[[], ty.Any], repeat: int) -> ty.Dict[str, float]:
+    """
+    Time and peak memory of one parser call
+    :param run: function calling the parser on prepared input
+    :param repeat: number of timed runs, the fastest is kept
+    :return: seconds and peak bytes allocated during the call
+    """
+    seconds = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        seconds = min(seconds, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": seconds, "peak_bytes": peak}
+
+
+def regressions(
+    results: ty.Dict[str, ty.Dict[str, ty.Dict[str, float]]],
+    baseline: ty.Dict[str, ty.Dict[str, ty.Dict[str, float]]],
+    time_tolerance: float,
+    memory_tolerance: float,
+) -> ty.List[str]:
+    """
+    Compare results with the baseline
+    :param results: measurements by parser and size
+    :param baseline: stored measurements, in the same layout
+    :param time_tolerance: allowed ratio of time to the baseline time
+    :param memory_tolerance: allowed ratio of peak memory to the baseline
+    :return: description of every regression found
+    """
+    found = []
+    for parser, by_size in results.items():
+        for size, result in by_size.items():
+            base = baseline.get(parser, {}).get(size)
+            if base is None:
+                continue
+            allowed = base["seconds"] * time_tolerance + TIME_SLACK
+            if result["seconds"] > allowed:
+                found.append(
+                    f"{parser} size {size}: {result['seconds']:.4f}s, "
+                    f"baseline {base['seconds']:.4f}s"
+                )
+            allowed = base["peak_bytes"] * memory_tolerance
+            if result["peak_bytes"] > allowed:
+                found.append(
+                    f"{parser} size {size}: {result['peak_bytes']} bytes, "
+                    f"baseline {base['peak_bytes']} bytes"
+                )
+    return found
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--parsers", nargs="+", choices=PARSERS, default=PARSERS)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--time-tolerance", type=float, default=1.5)
+    parser.add_argument("--memory-tolerance", type=float, default=1.2)
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'parser':<30}{'size':>8}{'msec':>12}{'peak MiB':>12}")
+    for name in args.parsers:
+        for size in args.sizes:
+            result = measure(PARSERS[name](size), args.repeat)
+            results.setdefault(name, {})[str(size)] = result
+            print(
+                f"{name:<30}{size:>8}{result['seconds'] * 1e3:>12.2f}"
+                f"{result['peak_bytes'] / 1024**2:>12.2f}"
+            )
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    if args.update_baseline:
+        for name, by_size in results.items():
+            baseline.setdefault(name, {}).update(by_size)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    found = regressions(results, baseline, args.time_tolerance, args.memory_tolerance)
+    for regression in found:
+        print(f"REGRESSION {regression}")
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
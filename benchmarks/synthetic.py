@@ -0,0 +1,177 @@
+"""
+Generators of synthetic but well formed cmscan inputs and outputs, so the
+parsers can be measured on files far larger than the examples in the tests.
+The out and tblout files generated from the same hits agree with each other,
+as they would for a real job.
+"""
+import random
+import typing as ty
+
+MODELS = [
+    ("5S_rRNA", "RF00001", "5S ribosomal RNA"),
+    ("5_8S_rRNA", "RF00002", "5.8S ribosomal RNA"),
+    ("U1", "RF00003", "U1 spliceosomal RNA"),
+    ("tRNA", "RF00005", "tRNA"),
+    ("SSU_rRNA_bacteria", "RF00177", "Bacterial small subunit ribosomal RNA"),
+]
+
+ALIGNMENT_LENGTH = 60
+
+OUT_HEADER = """\
+# cmscan :: search sequence(s) against a CM database
+# INFERNAL 1.1.5 (Sep 2023)
+# Copyright (C) 2023 Howard Hughes Medical Institute.
+# Freely distributed under the BSD open source license.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+# query sequence file:                   synthetic.sequence
+# target CM database:                    Rfam.cm
+# tabular output of hits:                synthetic.tblout
+# max ASCII text line length:            unlimited
+# model-specific thresholding:           GA cutoffs
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+"""
+
+TBLOUT_HEADER = """\
+#target name         accession query name           accession mdl mdl from   mdl to seq from   seq to strand trunc pass   gc  bias  score   E-value inc description of target
+#------------------- --------- -------------------- --------- --- -------- -------- -------- -------- ------ ----- ---- ---- ----- ------ --------- --- ---------------------
+"""
+
+TBLOUT_FOOTER = """\
+#
+# Program:         cmscan
+# Version:         1.1.5 (Sep 2023)
+# Pipeline mode:   SCAN
+# Query file:      synthetic.sequence
+# Target file:     Rfam.cm
+# Date:            Wed Apr  3 10:28:27 2024
+# [ok]
+"""
+
+
+class SyntheticHit(ty.NamedTuple):
+    query: str
+    model: str
+    accession: str
+    description: str
+    start: int
+    end: int
+    score: str
+    evalue: str
+    gc: str
+
+
+def query_name(index: int) -> str:
+    return f"seq{index:07d}"
+
+
+def residues(rng: random.Random, length: int) -> str:
+    return "".join(rng.choices("ACGU", k=length))
+
+
+def fasta(num_sequences: int, length: int = 120, seed: int = 0) -> str:
+    """
+    FASTA file with num_sequences RNA sequences, wrapped at 60 characters
+    """
+    rng = random.Random(seed)
+    records = []
+    for i in range(num_sequences):
+        sequence = residues(rng, length)
+        lines = [sequence[j : j + 60] for j in range(0, length, 60)]
+        records.append(f">{query_name(i)}\n" + "\n".join(lines))
+    return "\n".join(records) + "\n"
+
+
+def hits(num_hits: int, num_queries: int = 1, seed: int = 0) -> ty.List[SyntheticHit]:
+    """
+    Hits spread evenly over num_queries query sequences, in query order
+    """
+    rng = random.Random(seed)
+    result = []
+    for i in range(num_hits):
+        model, accession, description = rng.choice(MODELS)
+        start = rng.randint(1, 10000)
+        result.append(
+            SyntheticHit(
+                query=query_name(i * num_queries // num_hits),
+                model=model,
+                accession=accession,
+                description=description,
+                start=start,
+                end=start + ALIGNMENT_LENGTH - 1,
+                score=f"{rng.uniform(20, 200):.1f}",
+                evalue=f"{rng.uniform(1, 9):.1f}e-{rng.randint(5, 60):02d}",
+                gc=f"{rng.uniform(0.3, 0.7):.2f}",
+            )
+        )
+    return result
+
+
+def tblout(synthetic_hits: ty.List[SyntheticHit]) -> str:
+    rows = [
+        f"{hit.model:<20} {hit.accession:<9} {hit.query:<20} -          cm "
+        f"{1:>8} {ALIGNMENT_LENGTH:>8} {hit.start:>8} {hit.end:>8}      +    no"
+        f"    1 {hit.gc}   0.0 {hit.score:>6} {hit.evalue:>9} !   {hit.description}\n"
+        for hit in synthetic_hits
+    ]
+    return TBLOUT_HEADER + "".join(rows) + TBLOUT_FOOTER
+
+
+def out_section(
+    query: str, synthetic_hits: ty.List[SyntheticHit], rng: random.Random
+) -> str:
+    lines = [
+        f"Query:       {query}  [L=10059]",
+        "Hit scores:",
+        " rank     E-value  score  bias  modelname  start    end   mdl trunc   gc  description",
+        " ----   --------- ------ -----  --------- ------ ------   --- ----- ----  -----------",
+    ]
+    for rank, hit in enumerate(synthetic_hits, 1):
+        lines.append(
+            f"  ({rank}) ! {hit.evalue:>9} {hit.score:>6}   0.0  {hit.model:<9} "
+            f"{hit.start:>6} {hit.end:>6} +  cm    no {hit.gc}  {hit.description}"
+        )
+    lines += ["", "", "Hit alignments:"]
+    structure = "((((((,,,,<<<<______>>>>,,,,))))))" + ":" * (ALIGNMENT_LENGTH - 34)
+    for rank, hit in enumerate(synthetic_hits, 1):
+        sequence = residues(rng, ALIGNMENT_LENGTH)
+        lines += [
+            f">> {hit.model}  {hit.description}",
+            " rank     E-value  score  bias mdl mdl from   mdl to       seq from      seq to       acc trunc   gc",
+            " ----   --------- ------ ----- --- -------- --------    ----------- -----------      ---- ----- ----",
+            f"  ({rank}) ! {hit.evalue:>9} {hit.score:>6}   0.0  cm        1 "
+            f"{ALIGNMENT_LENGTH:>8} [] {hit.start:>11} {hit.end:>11} + [] 1.00    no {hit.gc}",
+            "",
+            f"{'':>22}{structure} CS",
+            f"{hit.model:>12} {1:>3} {sequence.lower()} {ALIGNMENT_LENGTH}",
+            f"{'':>16}{sequence}",
+            f"{query:>12} {hit.start:>3} {sequence} {hit.end}",
+            f"{'':>16}{'*' * ALIGNMENT_LENGTH} PP",
+            "",
+        ]
+    lines += [
+        "",
+        f"Total CM hits reported:{len(synthetic_hits):>42}  (3.653e-05); includes 0 truncated hit(s)",
+        "",
+        "# CPU time: 0.50u 0.18s 00:00:00.68 Elapsed: 00:00:00.87",
+        "//",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def out(
+    synthetic_hits: ty.List[SyntheticHit], num_queries: int = 1, seed: int = 0
+) -> str:
+    """
+    cmscan out file with one section per query sequence, including those
+    without hits
+    """
+    rng = random.Random(seed)
+    by_query = {}
+    for hit in synthetic_hits:
+        by_query.setdefault(hit.query, []).append(hit)
+    sections = [
+        out_section(query_name(i), by_query.get(query_name(i), []), rng)
+        for i in range(num_queries)
+    ]
+    return OUT_HEADER + "".join(sections) + "[ok]\n"
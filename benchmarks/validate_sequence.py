@@ -0,0 +1,74 @@
+"""
+Micro-benchmark of sequence validation against the regex based implementation
+it replaced. Run from the repository root with:
+
+    python -m benchmarks.validate_sequence
+"""
+import random
+import re
+import timeit
+
+from rfam_batch.api import SubmittedRequest
+
+
+def legacy_validate_sequence(sequence: str) -> str:
+    sequence_lines = sequence.split("\n")
+    raw_sequence = "".join(sequence_lines).upper()
+
+    # Check sequence length
+    if len(raw_sequence) > 7000:
+        raise ValueError(
+            "Sequence length must be less than or equal to 7,000 nucleotides"
+        )
+
+    # Check for invalid characters
+    invalid_chars = re.findall(r"[^ACGTURYSWMKBDHNV]", raw_sequence.upper())
+    if invalid_chars:
+        raise ValueError(
+            f"Invalid characters in sequence. Please remove the following "
+            f"characters: {', '.join(invalid_chars)}"
+        )
+
+    # Check for gap characters
+    if "." in raw_sequence or "-" in raw_sequence or "*" in raw_sequence:
+        raise ValueError("Gap characters '.', '-' and '*' are not allowed")
+
+    return raw_sequence
+
+
+def validate(validator, sequence: str) -> None:
+    try:
+        validator(sequence)
+    except ValueError:
+        pass
+
+
+def main():
+    random.seed(0)
+    cases = {
+        "valid 7,000 nt": "".join(random.choices("ACGU", k=7000)),
+        "one invalid character": "".join(random.choices("ACGU", k=6999)) + "X",
+        "protein 7,000 aa": "".join(random.choices("EFILPQ", k=7000)),
+    }
+    validators = {
+        "legacy": legacy_validate_sequence,
+        "table": SubmittedRequest.validate_sequence,
+    }
+
+    print(f"{'case':<24}{'validator':<10}{'usec/call':>12}{'error size':>12}")
+    for case, sequence in cases.items():
+        for name, validator in validators.items():
+            number = 2000
+            seconds = timeit.timeit(
+                lambda: validate(validator, sequence), number=number
+            )
+            try:
+                validator(sequence)
+                size = 0
+            except ValueError as e:
+                size = len(str(e))
+            print(f"{case:<24}{name:<10}{seconds / number * 1e6:>12.1f}{size:>12}")
+
+
+if __name__ == "__main__":
+    main()
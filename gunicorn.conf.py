@@ -0,0 +1,27 @@
+# gunicorn settings, read from the working directory on startup
+import os
+import shutil
+
+from prometheus_client import multiprocess
+
+# Workers write their metrics here, so /metrics can sum them. It must be set
+# before the workers import prometheus_client.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/rfam-batch-search/metrics")
+
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.getenv("GUNICORN_WORKERS", "4"))
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+capture_output = True
+accesslog = "-"
+errorlog = "-"
+
+
+def on_starting(server):
+    # Metrics of a previous run would otherwise be added to the new ones
+    directory = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+
+def child_exit(server, worker):
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,287 @@
+"""
+Load driver for the batch search service. By default it starts the fake Job
+Dispatcher and the service itself, under gunicorn with the settings used by
+the Dockerfile, then runs concurrent clients that each submit a job, poll its
+status until it is done and fetch its result. Throughput and p50/p95/p99
+latency of every endpoint are reported at the end. Run from the repository
+root with:
+
+    python -m loadtest.driver --duration 30 --concurrency 50
+    python -m loadtest.driver --jd-latency 0.2 --jd-error-rate 0.01 --jd-job-duration 10
+    python -m loadtest.driver --url http://127.0.0.1:8000
+
+The last form targets a service that is already running, which must be
+configured with JD_BASE_URL pointing at a fake Job Dispatcher.
+"""
+import aiohttp
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import typing as ty
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TERMINAL_STATUSES = {"FINISHED", "FAILURE", "ERROR", "NOT_FOUND"}
+
+
+class Sample(ty.NamedTuple):
+    endpoint: str
+    seconds: float
+    ok: bool
+
+
+def percentile(values: ty.List[float], p: float) -> float:
+    """
+    Nearest-rank percentile
+    :param values: sorted values
+    :param p: percentile, between 0 and 100
+    :return: smallest value with at least p percent of values at or below it
+    """
+    if not values:
+        return float("nan")
+    rank = max(1, math.ceil(p / 100 * len(values)))
+    return values[rank - 1]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def fasta(rng: random.Random, same: bool) -> bytes:
+    # Distinct sequences create a new job each time, identical ones are reused
+    residues = "ACGU" * 30 if same else "".join(rng.choices("ACGU", k=120))
+    return f">loadtest\n{residues}\n".encode()
+
+
+async def timed(
+    samples: ty.List[Sample],
+    endpoint: str,
+    request: ty.Callable[[], ty.Awaitable[aiohttp.ClientResponse]],
+) -> ty.Optional[ty.Tuple[int, bytes]]:
+    start = time.perf_counter()
+    try:
+        async with await request() as response:
+            body = await response.read()
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        samples.append(Sample(endpoint, time.perf_counter() - start, False))
+        return None
+    ok = response.status < 400
+    samples.append(Sample(endpoint, time.perf_counter() - start, ok))
+    return response.status, body
+
+
+async def user(
+    session: aiohttp.ClientSession,
+    url: str,
+    deadline: float,
+    samples: ty.List[Sample],
+    poll_interval: float,
+    same_sequence: bool,
+    seed: int,
+) -> int:
+    """
+    One client submitting jobs until the deadline
+    :return: number of jobs whose result was fetched
+    """
+    rng = random.Random(seed)
+    completed = 0
+    # Each user is a distinct client for the per-client rate limit
+    headers = {"X-Forwarded-For": f"10.0.{seed // 256}.{seed % 256}"}
+    while time.monotonic() < deadline:
+        form = aiohttp.FormData()
+        form.add_field(
+            "sequence_file", fasta(rng, same_sequence), filename="loadtest.fasta"
+        )
+        response = await timed(
+            samples,
+            "submit",
+            lambda: session.post(f"{url}/submit-job", data=form, headers=headers),
+        )
+        if response is None or response[0] != 200:
+            # Rejected with 429 or failed, back off before the next attempt
+            await asyncio.sleep(poll_interval)
+            continue
+        job_id = json.loads(response[1])["jobId"]
+
+        status = ""
+        while time.monotonic() < deadline and status not in TERMINAL_STATUSES:
+            await asyncio.sleep(poll_interval)
+            response = await timed(
+                samples, "status", lambda: session.get(f"{url}/status/{job_id}")
+            )
+            if response is not None and response[0] == 200:
+                status = response[1].decode()
+
+        if status == "FINISHED":
+            response = await timed(
+                samples, "result", lambda: session.get(f"{url}/result/{job_id}")
+            )
+            if response is not None and response[0] == 200:
+                completed += 1
+    return completed
+
+
+async def drive(
+    url: str,
+    duration: float,
+    concurrency: int,
+    poll_interval: float,
+    same_sequence: bool,
+) -> ty.Tuple[ty.List[Sample], int, float]:
+    samples: ty.List[Sample] = []
+    deadline = time.monotonic() + duration
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    start = time.perf_counter()
+    async with aiohttp.ClientSession(connector=connector) as session:
+        completed = await asyncio.gather(
+            *[
+                user(
+                    session,
+                    url,
+                    deadline,
+                    samples,
+                    poll_interval,
+                    same_sequence,
+                    seed,
+                )
+                for seed in range(concurrency)
+            ]
+        )
+    return samples, sum(completed), time.perf_counter() - start
+
+
+def report(samples: ty.List[Sample], completed: int, elapsed: float) -> None:
+    print(
+        f"{'endpoint':<10}{'requests':>10}{'errors':>8}{'req/s':>10}"
+        f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    )
+    endpoints = ["submit", "status", "result"]
+    for endpoint in endpoints + ["total"]:
+        if endpoint == "total":
+            selected = samples
+        else:
+            selected = [s for s in samples if s.endpoint == endpoint]
+        latencies = sorted(s.seconds * 1e3 for s in selected)
+        errors = sum(not s.ok for s in selected)
+        print(
+            f"{endpoint:<10}{len(selected):>10}{errors:>8}"
+            f"{len(selected) / elapsed:>10.1f}"
+            f"{percentile(latencies, 50):>10.1f}{percentile(latencies, 95):>10.1f}"
+            f"{percentile(latencies, 99):>10.1f}"
+        )
+    print(f"{completed} jobs completed in {elapsed:.1f}s, {completed / elapsed:.2f}/s")
+
+
+def wait_until_up(url: str, process: subprocess.Popen, timeout: float = 30) -> None:
+    async def check() -> bool:
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"{url}/cache/stats") as response:
+                    return response.status == 200
+        except aiohttp.ClientError:
+            return False
+
+    deadline = time.monotonic() + timeout
+    while not asyncio.run(check()):
+        if process.poll() is not None or time.monotonic() > deadline:
+            raise RuntimeError(f"Service at {url} did not start")
+        time.sleep(0.2)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", help="service to load, started here if not set")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument(
+        "--same-sequence",
+        action="store_true",
+        help="submit identical sequences, exercising job reuse",
+    )
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers")
+    parser.add_argument("--jd-latency", type=float, default=0.05)
+    parser.add_argument("--jd-error-rate", type=float, default=0.0)
+    parser.add_argument("--jd-job-duration", type=float, default=2.0)
+    args = parser.parse_args()
+
+    processes = []
+    url = args.url
+    try:
+        if url is None:
+            jd_port, port = free_port(), free_port()
+            fake_jd = subprocess.Popen(
+                [
+                    sys.executable,
+                    "-m",
+                    "loadtest.fake_jd",
+                    f"--port={jd_port}",
+                    f"--latency={args.jd_latency}",
+                    f"--error-rate={args.jd_error_rate}",
+                    f"--job-duration={args.jd_job_duration}",
+                ],
+                cwd=ROOT,
+            )
+            processes.append(fake_jd)
+
+            # Caches and indexes go to a fresh directory, so runs do not
+            # reuse each other's jobs
+            state = tempfile.mkdtemp(prefix="rfam-batch-loadtest-")
+            env = dict(
+                os.environ,
+                JD_BASE_URL=f"http://127.0.0.1:{jd_port}",
+                RESULT_CACHE_DIR=os.path.join(state, "results"),
+                JOB_REGISTRY_PATH=os.path.join(state, "registry.sqlite3"),
+                PROMETHEUS_MULTIPROC_DIR=os.path.join(state, "metrics"),
+            )
+            service = subprocess.Popen(
+                [
+                    sys.executable,
+                    "-m",
+                    "gunicorn",
+                    "-c",
+                    "gunicorn.conf.py",
+                    "-w",
+                    str(args.workers),
+                    "-b",
+                    f"127.0.0.1:{port}",
+                    "--log-level",
+                    "warning",
+                    "main:app",
+                ],
+                cwd=ROOT,
+                env=env,
+                stdout=subprocess.DEVNULL,
+            )
+            processes.append(service)
+            url = f"http://127.0.0.1:{port}"
+            wait_until_up(url, service)
+
+        samples, completed, elapsed = asyncio.run(
+            drive(
+                url,
+                args.duration,
+                args.concurrency,
+                args.poll_interval,
+                args.same_sequence,
+            )
+        )
+        report(samples, completed, elapsed)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
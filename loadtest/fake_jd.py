@@ -0,0 +1,158 @@
+"""
+Local stand-in for the Job Dispatcher infernal_cmscan REST service, serving
+the files in tests/example_files as the results of every job. Latency, error
+rate and job duration are configurable. Run it as a separate process with:
+
+    python -m loadtest.fake_jd --port 8082 --latency 0.05 --job-duration 5
+
+and point the service at it with JD_BASE_URL=http://127.0.0.1:8082, or start
+it in-process with start().
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import time
+import typing as ty
+
+from aiohttp import web
+
+EXAMPLE_FILES = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "tests",
+    "example_files",
+)
+ARTIFACTS = ("out", "sequence", "tblout")
+
+
+class FakeJobDispatcher:
+    """
+    Jobs are QUEUED for the first tenth of job_duration, then RUNNING until
+    job_duration seconds after submission, then FINISHED. A fraction
+    error_rate of all requests fails with 503 after the usual latency.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        job_duration: float = 0.0,
+        seed: ty.Optional[int] = None,
+    ) -> None:
+        self.latency = latency
+        self.error_rate = error_rate
+        self.job_duration = job_duration
+        self.random = random.Random(seed)
+        self.jobs: ty.Dict[str, float] = {}
+        self.counter = itertools.count(1)
+        self.requests = 0
+        self.errors = 0
+        self.artifacts = {}
+        for kind in ARTIFACTS:
+            with open(os.path.join(EXAMPLE_FILES, kind)) as f:
+                self.artifacts[kind] = f.read()
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self.simulate])
+        app.router.add_post("/run", self.run)
+        app.router.add_get("/status/{job_id}", self.status)
+        app.router.add_get("/result/{job_id}/{kind}", self.result)
+        app.router.add_get("/stats", self.stats)
+        return app
+
+    @web.middleware
+    async def simulate(self, request: web.Request, handler) -> web.StreamResponse:
+        if request.path == "/stats":
+            return await handler(request)
+        self.requests += 1
+        if self.latency:
+            # Uniform around the mean, so requests do not complete in lockstep
+            await asyncio.sleep(self.random.uniform(0.5, 1.5) * self.latency)
+        if self.random.random() < self.error_rate:
+            self.errors += 1
+            return web.Response(status=503, text="Service unavailable")
+        return await handler(request)
+
+    def job_status(self, job_id: str) -> str:
+        submitted = self.jobs.get(job_id)
+        if submitted is None:
+            return "NOT_FOUND"
+        age = time.monotonic() - submitted
+        if age >= self.job_duration:
+            return "FINISHED"
+        return "QUEUED" if age < self.job_duration / 10 else "RUNNING"
+
+    async def run(self, request: web.Request) -> web.Response:
+        data = await request.post()
+        for field in ("email", "sequence"):
+            if not data.get(field):
+                return web.Response(
+                    status=400,
+                    text=f"<error>\n <description>Missing {field}</description>\n</error>",
+                )
+        job_id = f"infernal_cmscan-R{time.strftime('%Y%m%d-%H%M%S')}-{next(self.counter):08d}-p1m"
+        self.jobs[job_id] = time.monotonic()
+        return web.Response(text=job_id)
+
+    async def status(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.job_status(request.match_info["job_id"]))
+
+    async def result(self, request: web.Request) -> web.Response:
+        job_id, kind = request.match_info["job_id"], request.match_info["kind"]
+        status = self.job_status(job_id)
+        if status == "NOT_FOUND" or kind not in ARTIFACTS:
+            return web.Response(status=404, text="Not found")
+        if status != "FINISHED":
+            return web.Response(status=400, text=f"Job {job_id} is {status}")
+        return web.Response(text=self.artifacts[kind])
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            {"jobs": len(self.jobs), "requests": self.requests, "errors": self.errors}
+        )
+
+
+async def start(
+    host: str = "127.0.0.1", port: int = 8082, **options: ty.Any
+) -> web.AppRunner:
+    """
+    Serve a FakeJobDispatcher from the running event loop
+    :param host: address to listen on
+    :param port: port to listen on
+    :param options: FakeJobDispatcher options
+    :return: runner, call its cleanup() to stop the server
+    """
+    runner = web.AppRunner(FakeJobDispatcher(**options).app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="mean seconds per request"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="fraction of requests failing"
+    )
+    parser.add_argument(
+        "--job-duration", type=float, default=0.0, help="seconds until FINISHED"
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    fake = FakeJobDispatcher(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        job_duration=args.job_duration,
+        seed=args.seed,
+    )
+    web.run_app(fake.app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
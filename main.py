@@ -1,27 +1,47 @@
 #!/usr/bin/env python3
-import aiosmtplib
 import asyncio
-import os
+import json
+import sqlite3
+import time
 import typing as ty
 import uvicorn
 
 from dotenv import load_dotenv
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
 from fastapi import (
-    BackgroundTasks,
     FastAPI,
     File,
     HTTPException,
     Form,
+    Query,
     Request,
     UploadFile,
 )
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import (
+    JSONResponse,
+    PlainTextResponse,
+    Response,
+    StreamingResponse,
+)
+from starlette.routing import Match
 from logger import logger
 from rfam_batch import job_dispatcher as jd
+from rfam_batch import admission
 from rfam_batch import api
+from rfam_batch import backends
+from rfam_batch import batch
+from rfam_batch import bulk
+from rfam_batch import cache
+from rfam_batch import events
+from rfam_batch import export as exports
+from rfam_batch import http_cache
+from rfam_batch import metrics
+from rfam_batch import notify as notifications
+from rfam_batch import poller
+from rfam_batch import registry
+from rfam_batch import scheduler
+from rfam_batch import status_cache
+from rfam_batch import submissions
 
 app = FastAPI(docs_url="/docs")
 
@@ -42,124 +62,637 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Headers added to the plain text and streamed responses
+TEXT_CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET, OPTIONS",
+    "Access-Control-Allow-Headers": "Content-Type",
+}
+
 # Load environment variables from .env file
 load_dotenv()
 
+# Runs the searches, Job Dispatcher unless SEARCH_BACKEND selects local cmscan
+search = backends.backend()
+
+# Parsed results of finished jobs never change, so they are cached
+result_cache = cache.ResultCache.from_env()
+
+# Jobs submitted here, with the child jobs of large submissions and the
+# content hash used to reuse jobs, shared by all workers
+job_registry = registry.JobRegistry.from_env()
+
+# Submissions each client may send and submissions in flight upstream,
+# counted in the registry so the limits hold across workers
+rate_limiter = admission.RateLimiter(job_registry)
+upstream_limiter = admission.UpstreamLimiter(job_registry)
+
+# Status of each job, shared by every client polling it
+job_statuses = status_cache.StatusCache.from_env(search.cmscan_status, job_registry)
+
+# Result emails, sent from a queue over one SMTP connection per worker
+notifier = notifications.Notifier.from_env(registry=job_registry)
+
+
+def route_name(request: Request) -> str:
+    # Label requests by route template, not by URL, to keep one series per
+    # route whatever the job id
+    for route in app.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    route = route_name(request)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        metrics.REQUEST_DURATION.labels(request.method, route).observe(
+            time.perf_counter() - start
+        )
+        metrics.REQUESTS.labels(request.method, route, status).inc()
+
 
 @app.on_event("shutdown")
 async def on_shutdown() -> None:
-    await jd.JobDispatcher.shutdown()
+    await status_poller.stop()
+    await status_watcher.stop()
+    await notifier.stop()
+    await job_scheduler.stop()
+    await search.shutdown()
 
 
 @app.on_event("startup")
 async def on_startup() -> None:
-    await jd.JobDispatcher.startup()
+    await search.startup()
+    await notifier.start()
+    await job_scheduler.start()
+    await status_poller.start()
+
+
+def job_children(job_id: str) -> ty.List[str]:
+    """
+    Job Dispatcher jobs holding the results of a job
+    :param job_id: Job Dispatcher or parent job id
+    :return: the job itself, the child jobs of a parent, or nothing for an
+    unknown parent
+    """
+    if not batch.is_parent(job_id):
+        return [job_id]
+    return job_registry.children(job_id) or []
+
+
+async def job_status(job_id: str) -> str:
+    children = job_children(job_id)
+    if children == [job_id]:
+        return await job_statuses.get(job_id)
+    if not children:
+        # Scheduled submissions have no upstream job until they are sent,
+        # QUEUED until then or ERROR if that failed
+        return job_registry.status(job_id) or "NOT_FOUND"
+    status = job_registry.status(job_id)
+    if status in status_cache.FINAL_STATUSES:
+        return status
+    statuses = await batch.gather_children(job_statuses.get, children)
+    status = batch.aggregate_status(statuses)
+    try:
+        job_registry.record_status(job_id, status)
+    except sqlite3.Error as e:
+        logger.error(f"Error writing status of {job_id}. Error: {e}")
+    return status
+
+
+async def job_artifact(job_id: str, kind: str) -> ty.Tuple[str, bool]:
+    """
+    Artifact of a job, joined from its child jobs for a parent
+    :param job_id: Job Dispatcher or parent job id
+    :param kind: out, sequence or tblout
+    :return: artifact and whether it is complete, artifacts come back empty
+    when the upstream request failed
+    """
+
+    async def fetch(child: str) -> str:
+        return await search.fetch_artifact(child, kind)
+
+    children = job_children(job_id)
+    if children == [job_id]:
+        text = await fetch(job_id)
+        return text, bool(text)
+    return batch.join_artifacts(await batch.gather_children(fetch, children))
+
+
+async def job_artifacts(job_id: str) -> ty.Tuple[str, str, str, bool]:
+    (out, out_ok), (sequence, sequence_ok), (tblout, tblout_ok) = await asyncio.gather(
+        job_artifact(job_id, "out"),
+        job_artifact(job_id, "sequence"),
+        job_artifact(job_id, "tblout"),
+    )
+    return out, sequence, tblout, out_ok and sequence_ok and tblout_ok
+
+
+def incomplete(job_id: str) -> HTTPException:
+    # A finished job missing part of its results must not be cached as final
+    return HTTPException(
+        status_code=502,
+        detail=f"Results of job {job_id} are unavailable, please try again",
+    )
+
+
+async def job_tblout_lines(job_id: str) -> ty.AsyncIterator[str]:
+    children = job_children(job_id)
+    if not children:
+        if job_registry.status(job_id) is None:
+            raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+        # Scheduled submissions have no hits until they are sent upstream
+        return
+    for child in children:
+        async for line in search.stream_tblout(child):
+            yield line
+
+
+async def result_tblout_lines(job_id: str) -> ty.AsyncIterator[str]:
+    """
+    Lines of the tblout file of a job, read from the result cache once the
+    job has finished, only downloaded again if it is not cached
+    :param job_id: Job Dispatcher or parent job id
+    :return: tblout lines, without their line breaks
+    """
+    with result_cache.view(f"{job_id}/tblout") as tblout:
+        if tblout is not None:
+            start = 0
+            while start < len(tblout):
+                end = tblout.find(b"\n", start)
+                end = len(tblout) if end == -1 else end
+                yield bytes(tblout[start:end]).decode()
+                start = end + 1
+            return
+    async for line in job_tblout_lines(job_id):
+        yield line
+
+
+def store_result(job_id: str, kind: str, body: bytes) -> None:
+    key = f"{job_id}/{kind}"
+    result_cache.put(key, body)
+    location = result_cache.location(key)
+    if location is None:
+        return
+    try:
+        job_registry.record_artifact(job_id, kind, location, len(body))
+    except sqlite3.Error as e:
+        logger.error(f"Error recording {key}. Error: {e}")
+
+
+async def finished_artifact(job_id: str, kind: str) -> ty.Tuple[bytes, bool]:
+    """
+    Artifact of a job, cached once the job has finished
+    :param job_id: Job Dispatcher or parent job id
+    :param kind: out, sequence or tblout
+    :return: artifact and whether it is final
+    """
+    key = f"{job_id}/{kind}"
+    cached = result_cache.get(key)
+    if cached is not None:
+        return cached, True
+
+    # Check the status first, so the artifact fetched below is known to be
+    # complete if the job has already finished
+    status = await job_status(job_id)
+    text, complete = await job_artifact(job_id, kind)
+
+    finished = status == "FINISHED"
+    if finished and not complete:
+        raise incomplete(job_id)
+    body = text.encode()
+    if finished:
+        store_result(job_id, kind, body)
+    return body, finished
+
+
+async def fetch_result(job_id: str) -> ty.Tuple[bytes, bool]:
+    # Check the status first, so the artifacts fetched below are known to be
+    # complete if the job has already finished
+    status = await job_status(job_id)
+    out, sequence, tblout, complete = await job_artifacts(job_id)
+    finished = status == "FINISHED"
+    if finished and not complete:
+        raise incomplete(job_id)
+    # Parsed straight to JSON, building the models takes most of the time
+    # for results with many hits
+    with metrics.PARSE_DURATION.labels("parse_cm_scan_result").time():
+        body = api.cm_scan_result_json(out, sequence, tblout, job_id)
+
+    if finished:
+        store_result(job_id, "result", body)
+
+    return body, finished
 
 
 @app.get("/result/{job_id}")
-async def get_result(job_id: str) -> api.CmScanResult | api.MultipleSequences:
+async def get_result(
+    job_id: str, request: Request
+) -> api.CmScanResult | api.MultipleSequences:
+    body = result_cache.get(f"{job_id}/result")
+    finished = body is not None
+    if body is None:
+        try:
+            # Clients opening a shared result link at the same time wait for
+            # a single fetch and parse
+            body, finished = await search.coalesce(
+                f"result:{job_id}", lambda: fetch_result(job_id)
+            )
+        except HTTPException as e:
+            logger.error(f"Error fetching results for {job_id}. Error: {e}")
+            raise e
+
+    return await http_cache.cacheable_response(
+        request, body, "application/json", finished
+    )
+
+
+@app.get("/metrics")
+async def get_metrics() -> Response:
+    content, media_type = metrics.render()
+    return Response(content=content, media_type=media_type)
+
+
+@app.get("/cache/stats")
+async def get_cache_stats() -> ty.Dict[str, int]:
+    status_stats = {f"status_{k}": v for k, v in job_statuses.stats().items()}
+    return {**result_cache.stats(), **status_stats}
+
+
+@app.get("/notify/stats")
+async def get_notify_stats() -> ty.Dict[str, int]:
+    return notifier.stats()
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str) -> ty.Dict:
+    job = job_registry.job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    # Email addresses, content hashes and paths on this server are not shown
+    # to anyone holding the job id
+    del job["content_hash"]
+    job["notifications"] = [n["notify_state"] for n in job["notifications"]]
+    job["artifacts"] = {
+        kind: {k: v for k, v in artifact.items() if k != "location"}
+        for kind, artifact in job["artifacts"].items()
+    }
+    return job
+
+
+@app.get("/upstream/stats")
+async def get_upstream_stats() -> ty.Dict[str, ty.Union[int, float]]:
+    submit_stats = {f"scheduler_{k}": v for k, v in job_scheduler.stats().items()}
+    limit_stats = {f"submit_{k}": v for k, v in upstream_limiter.stats().items()}
+    return {**search.stats(), **submit_stats, **limit_stats}
+
+
+@app.get("/result/{job_id}/tblout", response_class=PlainTextResponse)
+async def get_tblout(job_id: str, request: Request) -> Response:
     try:
-        out = await jd.JobDispatcher().cmscan_result(job_id)
-        sequence = await jd.JobDispatcher().cmscan_sequence(job_id)
-        tblout = await jd.JobDispatcher().cmscan_tblout(job_id)
-        cm_scan_result = api.parse_cm_scan_result(out, sequence, tblout, job_id)
+        tblout, finished = await finished_artifact(job_id, "tblout")
     except HTTPException as e:
-        logger.error(f"Error fetching results for {job_id}. Error: {e}")
+        logger.error(f"Error fetching TBLOUT results for {job_id}. Error: {e}")
         raise e
 
-    return cm_scan_result
+    # Plain text response with CORS headers
+    return await http_cache.cacheable_response(
+        request, tblout, "text/plain", finished, headers=TEXT_CORS_HEADERS
+    )
+
 
+def indexed_sequence_page(job_id: str, offset: int, limit: int) -> ty.Optional[ty.Dict]:
+    # Jobs indexed before only read the part of their artifacts in the page,
+    # mapped from the result cache instead of loaded
+    index = result_cache.get(f"{job_id}/index")
+    if index is None:
+        return None
+    with result_cache.view(f"{job_id}/out") as out, result_cache.view(
+        f"{job_id}/tblout"
+    ) as tblout:
+        if out is None or tblout is None:
+            return None
+        return api.sequence_page_document(
+            out, tblout, api.SequenceIndex.load(index), job_id, offset, limit
+        )
+
+
+@app.get("/result/{job_id}/sequences", response_model=api.SequencePage)
+async def get_sequences(
+    job_id: str,
+    offset: ty.Annotated[int, Query(ge=0)] = 0,
+    limit: ty.Annotated[int, Query(ge=1, le=100)] = 20,
+) -> JSONResponse:
+    # Alignments are only parsed for the sequences in the requested page
+    with metrics.PARSE_DURATION.labels("parse_sequence_page").time():
+        page = indexed_sequence_page(job_id, offset, limit)
+    if page is not None:
+        # Already laid out like SequencePage, so sent without validating and
+        # encoding it again
+        return JSONResponse(page)
 
-@app.get("/result/{job_id}/tblout", response_class=PlainTextResponse)
-async def get_tblout(job_id: str) -> PlainTextResponse:
     try:
-        tblout = await jd.JobDispatcher().cmscan_tblout(job_id)
+        (out, out_finished), (tblout, tblout_finished) = await asyncio.gather(
+            finished_artifact(job_id, "out"), finished_artifact(job_id, "tblout")
+        )
+    except HTTPException as e:
+        logger.error(f"Error fetching results for {job_id}. Error: {e}")
+        raise e
+
+    # Indexed once per finished job, the index is cached with its artifacts
+    with metrics.PARSE_DURATION.labels("index_sequences").time():
+        index = api.index_sequences(out, tblout)
+    if out_finished and tblout_finished:
+        store_result(job_id, "index", index.dump())
+    with metrics.PARSE_DURATION.labels("parse_sequence_page").time():
+        page = api.sequence_page_document(out, tblout, index, job_id, offset, limit)
+    return JSONResponse(page)
+
+
+@app.get("/result/{job_id}/hits.ndjson")
+async def get_hits_ndjson(job_id: str) -> StreamingResponse:
+    # Hits are parsed and sent while the tblout file is being read, from the
+    # result cache or downloaded
+    hits = api.aiter_tblout_hits(result_tblout_lines(job_id))
+    try:
+        # Fetch the first hit now, so upstream errors are reported as such
+        first = await anext(hits, None)
     except HTTPException as e:
         logger.error(f"Error fetching TBLOUT results for {job_id}. Error: {e}")
         raise e
 
-    # Create a PlainTextResponse with CORS headers
-    response = PlainTextResponse(content=tblout)
-    response.headers["Access-Control-Allow-Origin"] = "*"
-    response.headers["Access-Control-Allow-Methods"] = "GET, OPTIONS"
-    response.headers["Access-Control-Allow-Headers"] = "Content-Type"
+    async def ndjson() -> ty.AsyncIterator[str]:
+        if first is None:
+            return
+        try:
+            yield json.dumps(first) + "\n"
+            async for hit in hits:
+                yield json.dumps(hit) + "\n"
+        finally:
+            # Release the upstream connection, if any, when the client goes away
+            await hits.aclose()
+
+    response = StreamingResponse(ndjson(), media_type="application/x-ndjson")
+    response.headers.update(TEXT_CORS_HEADERS)
+    # Stop nginx from buffering the whole response. Never stored, the job may
+    # not have finished
+    response.headers["X-Accel-Buffering"] = "no"
+    response.headers["Cache-Control"] = "no-store"
 
     return response
 
 
-@app.get("/result/{job_id}/out", response_class=PlainTextResponse)
-async def get_out(job_id: str) -> PlainTextResponse:
+@app.get("/result/{job_id}/export")
+async def get_export(job_id: str, format: str = "gff3") -> StreamingResponse:
+    export = exports.export_format(format)
+    # Rows are written and sent while the tblout file is being read, from the
+    # result cache or downloaded
+    hits = exports.aiter_export_hits(result_tblout_lines(job_id))
     try:
-        out = await jd.JobDispatcher().cmscan_result(job_id)
+        # Fetch the first hit now, so upstream errors are reported as such
+        first = await anext(hits, None)
     except HTTPException as e:
-        logger.error(f"Error fetching OUT results for {job_id}. Error: {e}")
+        logger.error(f"Error exporting results of {job_id}. Error: {e}")
         raise e
 
-    # Create a PlainTextResponse with CORS headers
-    response = PlainTextResponse(content=out)
-    response.headers["Access-Control-Allow-Origin"] = "*"
-    response.headers["Access-Control-Allow-Methods"] = "GET, OPTIONS"
-    response.headers["Access-Control-Allow-Headers"] = "Content-Type"
+    async def document() -> ty.AsyncIterator[str]:
+        try:
+            async for chunk in exports.export_chunks(export, first, hits):
+                yield chunk
+        finally:
+            # Release the upstream connection, if any, when the client goes away
+            await hits.aclose()
+
+    response = StreamingResponse(document(), media_type=export.media_type)
+    response.headers[
+        "Content-Disposition"
+    ] = f'attachment; filename="{job_id}.{export.extension}"'
+    response.headers.update(TEXT_CORS_HEADERS)
+    # Stop nginx from buffering the whole response. Never stored, the job may
+    # not have finished
+    response.headers["X-Accel-Buffering"] = "no"
+    response.headers["Cache-Control"] = "no-store"
 
     return response
 
 
+@app.get("/result/{job_id}/out", response_class=PlainTextResponse)
+async def get_out(job_id: str, request: Request) -> Response:
+    try:
+        out, finished = await finished_artifact(job_id, "out")
+    except HTTPException as e:
+        logger.error(f"Error fetching OUT results for {job_id}. Error: {e}")
+        raise e
+
+    # Plain text response with CORS headers, large out files are compressed
+    return await http_cache.cacheable_response(
+        request, out, "text/plain", finished, headers=TEXT_CORS_HEADERS
+    )
+
+
 @app.get("/status/{job_id}", response_class=PlainTextResponse)
 async def fetch_status(job_id: str) -> PlainTextResponse:
     try:
-        status = await jd.JobDispatcher().cmscan_status(job_id)
+        status = await job_status(job_id)
     except HTTPException as e:
         logger.error(f"Error fetching job status for {job_id}. Error: {e}")
         raise e
 
     # Create a PlainTextResponse with CORS headers
     response = PlainTextResponse(content=status)
-    response.headers["Access-Control-Allow-Origin"] = "*"
-    response.headers["Access-Control-Allow-Methods"] = "GET, OPTIONS"
-    response.headers["Access-Control-Allow-Headers"] = "Content-Type"
+    response.headers.update(TEXT_CORS_HEADERS)
 
     return response
 
 
-async def send_email(email_address: str, job_id: str, status: str, tblout: str):
-    sender_email = os.getenv("EMAIL")
-    server = os.getenv("SERVER")
-    port = os.getenv("PORT")
+async def checked_status(job_id: str) -> str:
+    status = await job_status(job_id)
+    # Upstream error pages are not statuses
+    if status not in status_cache.KNOWN_STATUSES:
+        raise HTTPException(
+            status_code=502, detail=f"Status of job {job_id} is unavailable"
+        )
+    return status
 
-    msg = MIMEMultipart()
-    msg["From"] = sender_email
-    msg["To"] = email_address
 
-    if status == "FINISHED":
-        msg["Subject"] = f"Results for batch search job {job_id}"
-        msg.attach(MIMEText(tblout, "plain"))
-    else:
-        msg["Subject"] = f"Error in batch search job {job_id}"
-        body = (
-            "There was a problem while running the search. Please try "
-            "again or send us the job id if the problem persists."
+@app.post("/status")
+async def bulk_status(request: api.BulkRequest) -> api.BulkStatusResponse:
+    job_ids = bulk.unique_job_ids(request.job_ids)
+    statuses, errors = await bulk.gather_isolated(checked_status, job_ids)
+    return api.BulkStatusResponse(statuses=statuses, errors=errors)
+
+
+async def job_summary(job_id: str) -> api.JobSummary:
+    key = f"{job_id}/summary"
+    cached = result_cache.get(key)
+    if cached is not None:
+        return api.JobSummary.model_validate_json(cached)
+
+    status = await checked_status(job_id)
+    if status != "FINISHED":
+        return api.JobSummary(status=status)
+
+    tblout, finished = await finished_artifact(job_id, "tblout")
+    if not finished:
+        raise HTTPException(
+            status_code=502, detail=f"Results of job {job_id} are unavailable"
         )
-        msg.attach(MIMEText(body, "plain"))
+    num_hits, num_sequences = bulk.count_hits(tblout.decode())
+    summary = api.JobSummary(
+        status=status, numHits=num_hits, numSequences=num_sequences
+    )
+    result_cache.put(key, summary.model_dump_json().encode())
+    return summary
+
+
+@app.post("/result/summary")
+async def bulk_summary(request: api.BulkRequest) -> api.BulkSummaryResponse:
+    job_ids = bulk.unique_job_ids(request.job_ids)
+    summaries, errors = await bulk.gather_isolated(job_summary, job_ids)
+    return api.BulkSummaryResponse(summaries=summaries, errors=errors)
+
+
+@app.get("/status/{job_id}/events")
+async def status_events(job_id: str) -> StreamingResponse:
+    # Server-Sent Events: the current status, then every change until the
+    # job reaches a terminal status
+    subscription = status_watcher.subscribe(job_id)
+
+    async def stream() -> ty.AsyncIterator[str]:
+        try:
+            while True:
+                try:
+                    status = await asyncio.wait_for(
+                        subscription.get(), timeout=events.EVENTS_KEEPALIVE
+                    )
+                except asyncio.TimeoutError:
+                    # Comment line keeping proxies from closing the connection
+                    yield ": keepalive\n\n"
+                    continue
+                if status is None:
+                    return
+                yield f"event: status\ndata: {status}\n\n"
+        finally:
+            subscription.close()
+
+    response = StreamingResponse(stream(), media_type="text/event-stream")
+    response.headers["Cache-Control"] = "no-store"
+    response.headers.update(TEXT_CORS_HEADERS)
+    # Stop nginx from buffering the events
+    response.headers["X-Accel-Buffering"] = "no"
+
+    return response
+
+
+async def notify(job: poller.PendingJob, status: str) -> bool:
+    if status not in ("FINISHED", "FAILURE", "ERROR"):
+        # I'm assuming we will never see NOT_FOUND after a POST
+        status_poller.release(job.job_id, job.email_address, "expired")
+        return True
+    tblout = ""
+    if status == "FINISHED":
+        tblout = (await finished_artifact(job.job_id, "tblout"))[0].decode()
+    # Sent by the notifier task, so polling carries on while emails go out. The
+    # notifier records the email as sent, or leaves it pending if it is not.
+    return await notifier.enqueue(job.job_id, job.email_address, status, tblout)
 
-    async with aiosmtplib.SMTP(hostname=server, port=port) as smtp:
-        await smtp.send_message(msg)
 
+# One task per job polling the status pushed to /status/{job_id}/events
+status_watcher = events.StatusWatcher(fetch_status=job_status)
 
-async def check_status(email_address: str, job_id: str):
-    while True:
-        # This function will run as long as the status is 'RUNNING' or 'QUEUED'
-        status = await jd.JobDispatcher().cmscan_status(job_id)
-        if status == "FINISHED":
-            tblout = await jd.JobDispatcher().cmscan_tblout(job_id)
-            await send_email(email_address, job_id, status, tblout)
-            break
-        elif status == "NOT_FOUND":
-            # I'm assuming we will never see this status after a POST
-            break
-        elif status == "FAILURE" or status == "ERROR":
-            await send_email(email_address, job_id, status, "")
-            break
-        await asyncio.sleep(10)
+# Single task polling the status of every job submitted with an email address
+status_poller = poller.StatusPoller(
+    fetch_status=job_status,
+    on_done=notify,
+    registry=job_registry,
+)
+
+
+async def dispatch(submission: scheduler.Submission) -> ty.Optional[ty.List[str]]:
+    # Submit to Job Dispatcher, large batches as parallel child jobs. Each
+    # POST waits for an upstream slot shared by all workers, interactive ones
+    # may also take the slots reserved for them
+    job_id = submission.job_id
+    interactive = submission.priority == scheduler.INTERACTIVE
+    submit = upstream_limiter.bound(search.submit_cmscan_job, interactive)
+
+    def submitted(position: int, upstream_id: str) -> None:
+        # Kept with the queued submission, so a worker taking it over after
+        # this one stopped does not send the same chunk again
+        submission.submitted[position] = upstream_id
+        try:
+            job_registry.record_submitted(job_id, position, upstream_id)
+        except sqlite3.Error as e:
+            logger.error(f"Error recording {upstream_id} of {job_id}. Error: {e}")
+
+    try:
+        children = await batch.submit_chunks(
+            submit,
+            submission.query,
+            submission.sequences,
+            submitted=submission.submitted,
+            on_submitted=submitted,
+        )
+    except Exception as e:
+        logger.error(f"Error submitting job {job_id}. Error: {e}")
+        # Job Dispatcher's reason, e.g. an invalid email address, is shown
+        # by /jobs/{job_id}, anything else stays in the logs
+        error = e.detail if isinstance(e, HTTPException) else "Error submitting the job"
+        job_registry.record_status(job_id, "ERROR", error)
+        return None
+
+    # The scheduler maps the local job id to the upstream jobs from now on
+    logger.info(f"Job {job_id} submitted as {len(children)} jobs: {children}")
+    return children
+
+
+# Tasks sending the submissions upstream, interactive ones first
+job_scheduler = scheduler.SubmissionScheduler(dispatch=dispatch, registry=job_registry)
+
+
+async def submit_query(
+    query: jd.Query, sequences: ty.List[str], key: str, priority: str
+) -> str:
+    # Queue the search and return a local job id straight away, it maps to
+    # the upstream jobs once they are submitted
+    job_scheduler.check(priority)
+    job_id = batch.new_parent_id()
+    try:
+        job_registry.register(job_id, key)
+        job_registry.record_status(job_id, "QUEUED")
+    except sqlite3.Error as e:
+        logger.error(f"Error registering job {job_id}. Error: {e}")
+        raise HTTPException(status_code=500, detail="Error registering the job")
+    job_scheduler.submit(scheduler.Submission(job_id, priority, query, sequences))
+    return job_id
+
+
+async def reusable_job(key: str) -> ty.Optional[str]:
+    try:
+        job_id = job_registry.reusable(key, submissions.SUBMISSION_REUSE_TTL)
+    except sqlite3.Error as e:
+        logger.error(f"Error looking up reusable job. Error: {e}")
+        return None
+    if job_id is None:
+        return None
+    try:
+        status = await job_status(job_id)
+    except HTTPException as e:
+        logger.error(f"Error checking reusable job {job_id}. Error: {e}")
+        return None
+    if status in ("FAILURE", "ERROR", "NOT_FOUND"):
+        job_registry.forget_content(key)
+        return None
+    return job_id
 
 
 @app.post("/submit-job")
@@ -168,35 +701,64 @@ async def submit_job(
     email_address: ty.Annotated[ty.Optional[str], Form()] = None,
     sequence_file: UploadFile = File(None),
     id: ty.Optional[str] = Form(None),
+    reuse: ty.Annotated[bool, Form()] = True,
     request: Request,
-    background_tasks: BackgroundTasks,
 ) -> api.SubmissionResponse:
     url = request.url
 
+    # Checked before reading the upload, so rejected clients cost little
+    rate_limiter.check(admission.client_address(request))
+
     if sequence_file is None or sequence_file.filename == "":
         raise HTTPException(
             status_code=400, detail="Please upload a file in FASTA format"
         )
 
-    # Validate the FASTA file
+    # Validate the FASTA file while reading it, rejecting it on the first
+    # invalid record without reading the rest
     try:
-        content = await sequence_file.read()
-        parsed = api.SubmittedRequest.parse(content.decode())
+        parser = api.FastaParser()
+        upload_bytes = 0
+        while chunk := await sequence_file.read(api.UPLOAD_CHUNK_SIZE):
+            upload_bytes += len(chunk)
+            parser.feed(chunk)
+        parsed = parser.close()
+    except api.UploadTooLarge as e:
+        logger.error(f"Sequence file too large. Error: {e}")
+        raise HTTPException(status_code=413, detail=str(e))
     except ValueError as e:
         logger.error(f"Error parsing sequence. Error: {e}")
         raise HTTPException(status_code=400, detail=str(e))
 
+    metrics.UPLOAD_BYTES.observe(upload_bytes)
+    metrics.UPLOAD_SEQUENCES.observe(len(parsed.sequences))
+
     query = jd.Query()
     query.id = id
     query.sequences = "\n".join(parsed.sequences)
     query.email_address = email_address if email_address else "dummy@email.com"
 
-    # Submit to Job Dispatcher
-    job_id = await jd.JobDispatcher().submit_cmscan_job(query)
+    # Single sequences someone is waiting for go ahead of batches
+    priority = scheduler.priority_class(len(parsed.sequences), email_address)
+
+    # Identical searches submitted recently, or at the same time, share a job
+    # unless the client opts out
+    key = submissions.submission_key(parsed.sequences, query.threshold_model)
+    job_id = await reusable_job(key) if reuse else None
+    if job_id is not None:
+        logger.info(f"Job reused: {job_id}")
+    else:
+        if reuse:
+            job_id = await search.coalesce(
+                f"submit:{key}",
+                lambda: submit_query(query, parsed.sequences, key, priority),
+            )
+        else:
+            job_id = await submit_query(query, parsed.sequences, key, priority)
 
     if email_address:
-        # Background task to check status
-        background_tasks.add_task(check_status, email_address, job_id)
+        # Poll the status and send the results once the job is done
+        status_poller.add(job_id, email_address)
         logger.info(f"Job submitted: {job_id}")
     else:
         logger.info(f"Job submitted programmatically: {job_id}")
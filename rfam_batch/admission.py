@@ -0,0 +1,220 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import math
+import os
+import random
+import sqlite3
+import typing as ty
+import uuid
+
+from fastapi import HTTPException, Request
+from logger import logger
+from rfam_batch import metrics
+from rfam_batch.registry import JobRegistry, lease_owner
+
+SUBMIT_RATE = float(os.getenv("SUBMIT_RATE", "1"))
+SUBMIT_BURST = float(os.getenv("SUBMIT_BURST", "30"))
+# POSTs to Job Dispatcher in flight at once across all workers, 0 disables it
+SUBMIT_UPSTREAM_LIMIT = int(os.getenv("SUBMIT_UPSTREAM_LIMIT", "16"))
+# Slots bulk POSTs leave free for interactive ones
+SUBMIT_UPSTREAM_INTERACTIVE_SLOTS = int(
+    os.getenv("SUBMIT_UPSTREAM_INTERACTIVE_SLOTS", "4")
+)
+SUBMIT_UPSTREAM_LEASE = float(os.getenv("SUBMIT_UPSTREAM_LEASE", "300"))
+SUBMIT_UPSTREAM_POLL_INTERVAL = float(os.getenv("SUBMIT_UPSTREAM_POLL_INTERVAL", "0.2"))
+# Addresses at the end of X-Forwarded-For appended by our own proxies: 1 for
+# nginx alone, 2 with a load balancer in front of it
+FORWARDED_HOPS = int(os.getenv("FORWARDED_HOPS", "1"))
+
+T = ty.TypeVar("T")
+R = ty.TypeVar("R")
+
+
+def client_address(request: Request, hops: int = FORWARDED_HOPS) -> str:
+    """
+    Address of the client sending a request
+    :param request: request being answered
+    :param hops: proxies trusted to append to X-Forwarded-For
+    :return: address added by the outermost trusted proxy, entries before it
+    can be forged by the client
+    """
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded and hops > 0:
+        addresses = [a.strip() for a in forwarded.split(",") if a.strip()]
+        if addresses:
+            return addresses[-min(hops, len(addresses))]
+    return request.client.host if request.client else "unknown"
+
+
+def too_many_requests(detail: str, retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+class RateLimiter:
+    """
+    Token bucket per client: each client may send burst requests at once and
+    then rate requests per second. The buckets are kept in the JobRegistry,
+    so the limit holds whichever worker answers the client.
+    """
+
+    def __init__(
+        self,
+        registry: JobRegistry,
+        rate: float = SUBMIT_RATE,
+        burst: float = SUBMIT_BURST,
+    ) -> None:
+        self.registry = registry
+        self.rate = rate
+        self.burst = burst
+
+    def check(self, client: str, now: ty.Optional[float] = None) -> None:
+        """
+        Count a request of a client
+        :param client: key of the client, e.g. its address
+        :param now: current time, defaults to time.time()
+        :raises HTTPException: 429 with Retry-After if the client has no
+        token left
+        """
+        if self.rate <= 0:
+            return
+        try:
+            wait = self.registry.take_token(client, self.rate, self.burst, now)
+        except sqlite3.Error as e:
+            # Better to let the client through than to fail its submission
+            logger.error(f"Error checking the rate of {client}. Error: {e}")
+            return
+        if wait > 0:
+            metrics.REJECTED_SUBMISSIONS.labels("rate_limited").inc()
+            raise too_many_requests("Too many submissions, please slow down", wait)
+
+
+class UpstreamLimiter:
+    """
+    Bound on the submissions in flight upstream across all workers. Every
+    POST to Job Dispatcher, each chunk of a split submission included, holds
+    a slot in the JobRegistry while it is sent, waiting for one if they are
+    all taken. Slots of a worker that went away are freed after lease. The
+    last interactive_slots slots are only taken by interactive submissions,
+    so a bulk backlog cannot hold them all.
+
+    Waiting POSTs of a worker take turns, so only one of each class checks
+    for a free slot at a time. It reads the number of slots taken, which does not
+    wait for other workers' writes, and only takes the write lock once a slot
+    is free.
+    """
+
+    def __init__(
+        self,
+        registry: JobRegistry,
+        limit: int = SUBMIT_UPSTREAM_LIMIT,
+        interactive_slots: int = SUBMIT_UPSTREAM_INTERACTIVE_SLOTS,
+        lease: float = SUBMIT_UPSTREAM_LEASE,
+        poll_interval: float = SUBMIT_UPSTREAM_POLL_INTERVAL,
+    ) -> None:
+        self.registry = registry
+        self.limit = limit
+        # Bulk POSTs still get one slot however many are reserved
+        self.bulk_limit = max(1, limit - interactive_slots)
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.waiting = 0
+        self.in_flight = 0
+        self.turns = {True: asyncio.Lock(), False: asyncio.Lock()}
+        # Set when this worker frees a slot, so its next POST need not wait
+        # for the poll interval
+        self.released = asyncio.Event()
+        self.instance = uuid.uuid4().hex[:8]
+
+    @property
+    def owner(self) -> str:
+        return lease_owner(self.instance)
+
+    def try_acquire(self, interactive: bool) -> ty.Optional[str]:
+        limit = self.limit if interactive else self.bulk_limit
+        try:
+            if self.registry.slots_taken() >= limit:
+                return None
+            return self.registry.acquire_slot(self.owner, limit, self.lease)
+        except sqlite3.Error as e:
+            logger.error(f"Error taking an upstream slot. Error: {e}")
+            return None
+
+    async def acquire(self, interactive: bool = False) -> ty.Optional[str]:
+        """
+        Wait for a free slot
+        :param interactive: whether the POST is for an interactive submission,
+        which may take the slots left free by bulk ones
+        :return: ID of the slot, or None if the bound is disabled
+        """
+        if self.limit <= 0:
+            return None
+        self.waiting += 1
+        try:
+            async with self.turns[interactive]:
+                while True:
+                    slot_id = self.try_acquire(interactive)
+                    if slot_id is not None:
+                        return slot_id
+                    self.released.clear()
+                    # Jittered, so waiting workers do not all ask at once
+                    interval = self.poll_interval * random.uniform(0.5, 1.5)
+                    try:
+                        await asyncio.wait_for(self.released.wait(), interval)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            self.waiting -= 1
+
+    def release(self, slot_id: ty.Optional[str]) -> None:
+        if slot_id is None:
+            return
+        try:
+            self.registry.release_slot(slot_id)
+        except sqlite3.Error as e:
+            # Freed once its lease expires
+            logger.error(f"Error releasing upstream slot {slot_id}. Error: {e}")
+        self.released.set()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, interactive: bool = False) -> ty.AsyncIterator[None]:
+        slot_id = await self.acquire(interactive)
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self.release(slot_id)
+
+    def bound(
+        self, submit: ty.Callable[[T], ty.Awaitable[R]], interactive: bool = False
+    ) -> ty.Callable[[T], ty.Awaitable[R]]:
+        """
+        Wrap a function sending one submission upstream
+        :param submit: function sending the submission
+        :param interactive: whether the submission is interactive
+        :return: the same function, sending once it holds a slot
+        """
+
+        async def bounded(query: T) -> R:
+            async with self.slot(interactive):
+                return await submit(query)
+
+        return bounded
+
+    def stats(self) -> ty.Dict[str, int]:
+        try:
+            total = self.registry.slots_taken()
+        except sqlite3.Error:
+            total = -1
+        return {
+            "limit": self.limit,
+            "waiting": self.waiting,
+            "in_flight": self.in_flight,
+            "in_flight_total": total,
+        }
@@ -1,5 +1,9 @@
 from __future__ import annotations
-import re
+import array
+import codecs
+import json
+import mmap
+import os
 import typing as ty
 
 from datetime import datetime
@@ -9,6 +13,23 @@ TIMESTAMP_FORMAT = ""
 
 SEARCH_MULTIPLIER = 0
 
+UPLOAD_CHUNK_SIZE = 64 * 1024
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(50 * 1024**2)))
+UPLOAD_MAX_SEQUENCES = int(os.getenv("UPLOAD_MAX_SEQUENCES", "10000"))
+MAX_SEQUENCE_LENGTH = 7000
+MAX_REPORTED_CHARACTERS = 10
+
+# IUPAC nucleotide codes accepted in sequences, deleting them from a sequence
+# with bytes.translate leaves only the invalid characters
+VALID_RESIDUES = frozenset("ACGTURYSWMKBDHNV")
+VALID_RESIDUE_BYTES = "".join(sorted(VALID_RESIDUES)).encode()
+VALID_RESIDUE_TABLE = str.maketrans("", "", "".join(sorted(VALID_RESIDUES)))
+GAP_CHARACTERS = frozenset(".-*")
+
+
+class UploadTooLarge(ValueError):
+    pass
+
 
 class SubmissionResponse(BaseModel):
     result_url: str = Field(alias="resultURL")
@@ -39,57 +60,145 @@ class SubmittedRequest(BaseModel):
             )
         return header
 
+    @classmethod
+    def validate_residues(cls, residues: str, record: ty.Optional[int] = None) -> str:
+        """
+        Check an uppercase sequence only contains IUPAC nucleotide codes
+        :param residues: uppercase sequence
+        :param record: number of the sequence in the file, used in errors
+        :return: the sequence
+        """
+        if residues.isascii():
+            invalid = residues.encode().translate(None, VALID_RESIDUE_BYTES).decode()
+        else:
+            invalid = residues.translate(VALID_RESIDUE_TABLE)
+        if not invalid:
+            return residues
+
+        # Report the first position of each invalid character
+        positions = sorted((residues.index(char) + 1, char) for char in set(invalid))
+        where = f"sequence {record}, " if record is not None else ""
+        reported = [
+            f"{char} ({where}position {position})"
+            for position, char in positions[:MAX_REPORTED_CHARACTERS]
+        ]
+        if len(positions) > MAX_REPORTED_CHARACTERS:
+            reported.append("...")
+        message = (
+            f"Invalid characters in sequence. Please remove the following "
+            f"characters: {', '.join(reported)}"
+        )
+        if GAP_CHARACTERS.intersection(invalid):
+            message += ". Gap characters '.', '-' and '*' are not allowed"
+        raise ValueError(message)
+
     @classmethod
     def validate_sequence(cls, sequence: str) -> str:
         sequence_lines = sequence.split("\n")
         raw_sequence = "".join(sequence_lines).upper()
 
         # Check sequence length
-        if len(raw_sequence) > 7000:
+        if len(raw_sequence) > MAX_SEQUENCE_LENGTH:
             raise ValueError(
                 "Sequence length must be less than or equal to 7,000 nucleotides"
             )
 
-        # Check for invalid characters
-        invalid_chars = re.findall(r"[^ACGTURYSWMKBDHNV]", raw_sequence.upper())
-        if invalid_chars:
-            raise ValueError(
-                f"Invalid characters in sequence. Please remove the following "
-                f"characters: {', '.join(invalid_chars)}"
-            )
-
-        # Check for gap characters
-        if "." in raw_sequence or "-" in raw_sequence or "*" in raw_sequence:
-            raise ValueError("Gap characters '.', '-' and '*' are not allowed")
-
-        return raw_sequence
+        return cls.validate_residues(raw_sequence)
 
     @classmethod
     def parse(cls, raw: str) -> SubmittedRequest:
-        sequences = []
-        current_sequence = ""
-        header = ""
-        lines = raw.strip().split("\n")
+        parser = FastaParser(max_bytes=None, max_sequences=None)
+        parser.feed(raw.encode())
+        return parser.close()
 
-        for line in lines:
-            line = line.strip()
 
-            # Check if the line starts with ">"
-            if line.startswith(">"):
-                if current_sequence:
-                    raw_sequence = cls.validate_sequence(current_sequence)
-                    sequences.append(header + "\n" + raw_sequence)
-                header = cls.validate_header(line)
-                current_sequence = ""
-            else:
-                current_sequence += line
+class FastaParser:
+    """
+    Incremental FASTA parser for uploads. Chunks are fed as they are read,
+    headers and sequences are validated as each record ends and the upload is
+    rejected on the first invalid record or as soon as it goes over the size
+    or sequence count limits. Only the current line and record are buffered
+    besides the accepted sequences.
+    """
+
+    def __init__(
+        self,
+        max_bytes: ty.Optional[int] = UPLOAD_MAX_BYTES,
+        max_sequences: ty.Optional[int] = UPLOAD_MAX_SEQUENCES,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.max_sequences = max_sequences
+        self.size = 0
+        self.sequences: ty.List[str] = []
+        self.header = ""
+        self.residues: ty.List[str] = []
+        self.length = 0
+        self.partial_line = ""
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+
+    def feed(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            raise UploadTooLarge(
+                f"File size must be less than or equal to {self.max_bytes:,} bytes"
+            )
+
+        lines = (self.partial_line + self.decoder.decode(chunk)).split("\n")
+        self.partial_line = lines.pop()
+        for line in lines:
+            self.parse_line(line)
+
+    def close(self) -> SubmittedRequest:
+        self.parse_line(self.partial_line + self.decoder.decode(b"", final=True))
+        self.partial_line = ""
+        self.end_record()
+        return SubmittedRequest(sequences=self.sequences)
+
+    def parse_line(self, line: str) -> None:
+        line = line.strip()
+        if line.startswith(">"):
+            self.end_record()
+            self.header = SubmittedRequest.validate_header(line)
+        elif line:
+            self.length += len(line)
+            if self.length > MAX_SEQUENCE_LENGTH:
+                raise ValueError(
+                    "Sequence length must be less than or equal to 7,000 nucleotides"
+                )
+            self.residues.append(line.upper())
+
+    def end_record(self) -> None:
+        # Headers without a sequence are dropped
+        if self.residues:
+            if (
+                self.max_sequences is not None
+                and len(self.sequences) >= self.max_sequences
+            ):
+                raise UploadTooLarge(
+                    f"The number of sequences must be less than or equal to "
+                    f"{self.max_sequences:,}"
+                )
+            # Records are at most 7,000 residues long, so they are validated
+            # as a whole to report every invalid character
+            residues = SubmittedRequest.validate_residues(
+                "".join(self.residues), record=len(self.sequences) + 1
+            )
+            self.sequences.append(self.header + "\n" + residues)
+        self.residues = []
+        self.length = 0
 
-        # Add the last sequence to the list after the loop
-        if current_sequence:
-            raw_sequence = cls.validate_sequence(current_sequence)
-            sequences.append(header + "\n" + raw_sequence)
 
-        return cls(sequences=sequences)
+def dump_json(content: ty.Any) -> bytes:
+    """
+    Serialise plain dicts, lists, strings and numbers to compact JSON, the
+    same bytes as FastAPI's JSONResponse sends for the matching model, e.g.
+    1.9e-05 where model_dump_json would write 0.000019
+    :param content: content to serialise
+    :return: UTF-8 encoded JSON
+    """
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode()
 
 
 class Alignment(BaseModel):
@@ -123,58 +232,478 @@ class CmScanResult(BaseModel):
     hits: ty.Dict[str, ty.List[Hit]]
 
 
+HitKey = ty.Tuple[int, int, float, float]
+
+
 class MultipleSequences(BaseModel):
     opened: str
     hits: ty.List
 
 
+class SequenceResult(BaseModel):
+    sequence: str
+    length: int
+    numHits: int
+    hits: ty.Dict[str, ty.List[Hit]]
+
+
+class SequencePage(BaseModel):
+    jobId: str
+    opened: str
+    total: int
+    offset: int
+    limit: int
+    sequences: ty.List[SequenceResult]
+
+
+class BulkRequest(BaseModel):
+    job_ids: ty.List[str] = Field(alias="jobIds")
+
+
+class BulkStatusResponse(BaseModel):
+    statuses: ty.Dict[str, str]
+    errors: ty.Dict[str, str]
+
+
+class JobSummary(BaseModel):
+    status: str
+    # Only known once the job has finished
+    numHits: ty.Optional[int] = None
+    numSequences: ty.Optional[int] = None
+
+
+class BulkSummaryResponse(BaseModel):
+    summaries: ty.Dict[str, JobSummary]
+    errors: ty.Dict[str, str]
+
+
+class AlignmentRecord(ty.NamedTuple):
+    nc: str
+    ss: str
+    hit_seq: str
+    match: str
+    user_seq: str
+    pp: str
+
+
+class HitRecord:
+    """
+    Hit of a tblout row, with the alignment found in the out file. Results
+    can have 100k hits, so they are kept in slotted records and only turned
+    into the layout of Hit when serialised.
+    """
+
+    __slots__ = ("id", "acc", "start", "end", "strand", "GC", "score", "E", "alignment")
+
+    def __init__(
+        self,
+        id: str,
+        acc: str,
+        start: int,
+        end: int,
+        strand: str,
+        GC: float,
+        score: float,
+        E: float,
+        alignment: ty.Optional[AlignmentRecord] = None,
+    ) -> None:
+        self.id = id
+        self.acc = acc
+        self.start = start
+        self.end = end
+        self.strand = strand
+        self.GC = GC
+        self.score = score
+        self.E = E
+        self.alignment = alignment
+
+    @property
+    def key(self) -> HitKey:
+        return self.start, self.end, self.score, self.E
+
+    def tblout_dict(self) -> ty.Dict:
+        # Columns of the tblout row, as listed for several query sequences
+        return {
+            "id": self.id,
+            "acc": self.acc,
+            "start": self.start,
+            "end": self.end,
+            "strand": self.strand,
+            "GC": self.GC,
+            "score": self.score,
+            "E": self.E,
+        }
+
+    def as_dict(self) -> ty.Dict:
+        alignment = self.alignment
+        if alignment is None:
+            # Required by the Hit model
+            raise ValueError(f"No alignment found for hit {self.id} {self.key}")
+        hit = self.tblout_dict()
+        hit["alignment"] = {
+            "nc": alignment.nc,
+            "ss": alignment.ss,
+            "hit_seq": alignment.hit_seq,
+            "match": alignment.match,
+            "user_seq": alignment.user_seq,
+            "pp": alignment.pp,
+        }
+        return hit
+
+
+class OutSection(ty.NamedTuple):
+    query: str
+    length: int
+    start: int
+    end: int
+
+
+def split_tblout_line(line: str) -> ty.Optional[ty.List[str]]:
+    """
+    Split one row of a tblout file into its columns
+    :param line: tblout line
+    :return: columns, or None for comments and blank lines
+    """
+    if line.startswith("#"):
+        return None
+    # The description of the target is the only column with spaces
+    return line.split(maxsplit=17) or None
+
+
+def tblout_record(fields: ty.List[str]) -> HitRecord:
+    return HitRecord(
+        fields[0],
+        fields[1],
+        int(fields[7]),
+        int(fields[8]),
+        fields[9],
+        float(fields[12]),
+        float(fields[14]),
+        float(fields[15]),
+    )
+
+
+def parse_tblout_record(line: str) -> ty.Optional[HitRecord]:
+    """
+    Parse one row of a tblout file
+    :param line: tblout line
+    :return: hit record, or None for comments and blank lines
+    """
+    fields = split_tblout_line(line)
+    return tblout_record(fields) if fields else None
+
+
+def parse_tblout_line(line: str) -> ty.Optional[ty.Dict]:
+    """
+    Parse one row of a tblout file
+    :param line: tblout line
+    :return: hit, or None for comments and blank lines
+    """
+    record = parse_tblout_record(line)
+    return record.tblout_dict() if record is not None else None
+
+
+def parse_tblout_date(line: str) -> str:
+    date_str = line.split("# Date:")[1].strip()
+    date_obj = datetime.strptime(date_str, "%a %b %d %H:%M:%S %Y")
+    return date_obj.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def tblout_date(tblout_text: str) -> str:
+    """
+    Date a tblout file was written, from the last "# Date:" line of its
+    footer
+    :param tblout_text: tblout file contents
+    :return: formatted date, or an empty string if there is none
+    """
+    start = tblout_text.rfind("\n# Date:") + 1
+    if not start and not tblout_text.startswith("# Date:"):
+        return ""
+    end = tblout_text.find("\n", start)
+    return parse_tblout_date(tblout_text[start : end if end != -1 else None])
+
+
+def iter_tblout_records(lines: ty.Iterable[str]) -> ty.Iterator[HitRecord]:
+    """
+    Generator over the hit records of a tblout file
+    :param lines: tblout lines
+    :return: hit records, in file order
+    """
+    for line in lines:
+        record = parse_tblout_record(line)
+        if record is not None:
+            yield record
+
+
+def iter_tblout_hits(lines: ty.Iterable[str]) -> ty.Iterator[ty.Dict]:
+    """
+    Generator over the hits of a tblout file
+    :param lines: tblout lines
+    :return: hits, in file order
+    """
+    for record in iter_tblout_records(lines):
+        yield record.tblout_dict()
+
+
+async def aiter_tblout_hits(lines: ty.AsyncIterable[str]) -> ty.AsyncIterator[ty.Dict]:
+    """
+    Asynchronous generator over the hits of a tblout file, used to parse a
+    response body as it arrives
+    :param lines: tblout lines
+    :return: hits, in file order
+    """
+    async for line in lines:
+        record = parse_tblout_record(line)
+        if record is not None:
+            yield record.tblout_dict()
+
+
 def parse_tblout_file(tblout_text: str) -> ty.Tuple[str, ty.List]:
     """
     This function parses the tblout file and extracts the necessary data
     :param tblout_text: tblout file contents
     :return: date and hit list
     """
-    date = ""
-    hit_list = []
-
-    for line in tblout_text.split("\n"):
-        if not line.startswith("#") and not line == "":
-            line = re.sub(" +", " ", line).strip().split(" ")
-            hit_list.append(
-                {
-                    "id": line[0],
-                    "acc": line[1],
-                    "start": int(line[7]),
-                    "end": int(line[8]),
-                    "strand": line[9],
-                    "GC": float(line[12]),
-                    "score": float(line[14]),
-                    "E": float(line[15]),
-                }
+    return tblout_date(tblout_text), list(iter_tblout_hits(tblout_text.splitlines()))
+
+
+def parse_tblout_records(tblout_text: str) -> ty.Tuple[str, ty.List[HitRecord]]:
+    """
+    Parse the tblout file of a job into hit records
+    :param tblout_text: tblout file contents
+    :return: date and hit records, in file order
+    """
+    records = list(iter_tblout_records(tblout_text.splitlines()))
+    return tblout_date(tblout_text), records
+
+
+def index_out_file(out_text: ty.AnyStr) -> ty.List[OutSection]:
+    """
+    Find the section of each query sequence in a cmscan out file without
+    parsing it. A section starts at its "Query:" line and ends with "//".
+    :param out_text: out file contents, offsets are in bytes if given bytes
+    :return: name, length and offsets of each section
+    """
+    if isinstance(out_text, bytes):
+        query, newline, query_line, end_line = b"Query:", b"\n", b"\nQuery:", b"\n//"
+    else:
+        query, newline, query_line, end_line = "Query:", "\n", "\nQuery:", "\n//"
+    sections = []
+    # Offset of the first "Query:" line, -1 when there is none
+    start = 0 if out_text.startswith(query) else out_text.find(query_line)
+    if start > 0:
+        start += 1
+    while start != -1:
+        line_end = out_text.find(newline, start)
+        if line_end == -1:
+            line_end = len(out_text)
+        # Query:       EMBOSS_001  [L=119]
+        fields = out_text[start:line_end].split()
+        name = fields[1] if isinstance(fields[1], str) else fields[1].decode()
+        length = int(fields[2][3:-1]) if len(fields) > 2 else 0
+        end = out_text.find(end_line, line_end)
+        end = len(out_text) if end == -1 else end + 3
+        sections.append(OutSection(name, length, start, end))
+        start = out_text.find(query_line, end)
+        if start != -1:
+            start += 1
+    return sections
+
+
+class SequenceIndex:
+    """
+    Byte offsets of the section of each query sequence in the out file of a
+    job and of its rows in the tblout file, so a page of results only reads
+    and parses its own queries. Kept in flat arrays, stored as bytes and read
+    back without parsing, so a cached index costs nothing to load.
+    """
+
+    def __init__(
+        self,
+        opened: str,
+        names: bytes,
+        name_ends: ty.Sequence[int],
+        sections: ty.Sequence[int],
+        row_ends: ty.Sequence[int],
+        rows: ty.Sequence[int],
+    ) -> None:
+        self.opened = opened
+        # Names of the query sequences joined, each ends at name_ends[i]
+        self.names = names
+        self.name_ends = name_ends
+        # Start, end and length of each section of the out file
+        self.sections = sections
+        # Start and end of each tblout row, the rows of query i run from
+        # row_ends[i - 1] to row_ends[i]
+        self.row_ends = row_ends
+        self.rows = rows
+
+    def __len__(self) -> int:
+        return len(self.name_ends)
+
+    def section(self, i: int) -> OutSection:
+        start = self.name_ends[i - 1] if i else 0
+        name = self.names[start : self.name_ends[i]].decode()
+        out_start, out_end, length = self.sections[3 * i : 3 * i + 3]
+        return OutSection(name, length, out_start, out_end)
+
+    def row_spans(self, i: int) -> ty.Iterator[ty.Tuple[int, int]]:
+        first = self.row_ends[i - 1] if i else 0
+        for row in range(first, self.row_ends[i]):
+            yield self.rows[2 * row], self.rows[2 * row + 1]
+
+    def dump(self) -> bytes:
+        arrays = [self.name_ends, self.sections, self.row_ends, self.rows]
+        header = {"opened": self.opened, "sizes": [len(a) for a in arrays]}
+        parts = [json.dumps(header).encode(), b"\n"]
+        parts += [array.array("q", a).tobytes() for a in arrays]
+        parts.append(self.names)
+        return b"".join(parts)
+
+    @classmethod
+    def load(cls, data: bytes) -> SequenceIndex:
+        header_end = data.index(b"\n") + 1
+        header = json.loads(data[:header_end])
+        view = memoryview(data)
+        arrays = []
+        start = header_end
+        for size in header["sizes"]:
+            end = start + 8 * size
+            arrays.append(view[start:end].cast("q"))
+            start = end
+        return cls(header["opened"], data[start:], *arrays)
+
+
+def index_sequences(out: bytes, tblout: bytes) -> SequenceIndex:
+    """
+    Index the query sequences of a job with the sections of its out file and
+    the rows of its tblout file
+    :param out: out file contents
+    :param tblout: tblout file contents
+    :return: index, in the order of the out file
+    """
+    opened = ""
+    spans: ty.Dict[bytes, ty.List[int]] = {}
+    start = 0
+    while start < len(tblout):
+        end = tblout.find(b"\n", start)
+        end = len(tblout) if end == -1 else end + 1
+        if tblout.startswith(b"#", start):
+            if tblout.startswith(b"# Date:", start):
+                opened = parse_tblout_date(tblout[start:end].decode())
+        else:
+            fields = tblout[start:end].split(maxsplit=3)
+            if len(fields) > 2:
+                spans.setdefault(fields[2], []).extend((start, end))
+        start = end
+
+    names = []
+    name_ends = array.array("q")
+    sections = array.array("q")
+    row_ends = array.array("q")
+    rows = array.array("q")
+    size = 0
+    for section in index_out_file(out):
+        name = section.query.encode()
+        names.append(name)
+        size += len(name)
+        name_ends.append(size)
+        sections.extend((section.start, section.end, section.length))
+        # Headers can be repeated, every section of a query gets its rows
+        rows.extend(spans.get(name, ()))
+        row_ends.append(len(rows) // 2)
+    return SequenceIndex(opened, b"".join(names), name_ends, sections, row_ends, rows)
+
+
+def parse_out_file(
+    out_text: str,
+) -> ty.Tuple[int, ty.List[ty.Tuple[HitKey, AlignmentRecord]]]:
+    """
+    Single pass parser for the cmscan out format, a state machine reading
+    the alignment of each hit after its ">>" header
+    :param out_text: out file contents
+    :return: number of CM hits reported and the alignments, each keyed by
+    the start, end, score and E-value of its hit
+    """
+    num_hits = None
+    alignments = []
+    state = "seek"
+    key = None
+    annotation = {}
+    rows = []
+
+    for line in out_text.splitlines():
+        if state == "hit":
+            # Table with the rank, scores and coordinates of the hit, e.g.:
+            #  (1) !   4.5e-24  104.9   0.0  cm        1      119 []  1  119 + ...
+            fields = line.split()
+            if fields and fields[0].startswith("("):
+                key = (
+                    int(fields[9]),
+                    int(fields[10]),
+                    float(fields[3]),
+                    float(fields[2]),
+                )
+                annotation = {}
+                rows = []
+                state = "alignment"
+            continue
+
+        if state == "alignment":
+            stripped = line.rstrip()
+            if "CS" not in annotation:
+                # Optional NC line, then the consensus structure
+                if stripped.endswith(" NC"):
+                    annotation["NC"] = line[: line.rindex("NC")]
+                elif stripped.endswith(" CS"):
+                    annotation["CS"] = line[: line.rindex("CS")]
+                continue
+            if len(rows) < 3:
+                # Model, match and sequence lines, the match line can be blank
+                rows.append(line)
+                continue
+            pp = line[: line.rindex("PP")] if stripped.endswith(" PP") else ""
+            alignments.append(
+                (
+                    key,
+                    AlignmentRecord(
+                        "#NC " + annotation.get("NC", ""),
+                        "#SS " + annotation["CS"],
+                        "#CM " + " ".join(rows[0].split()[1:]),
+                        "#MATCH " + rows[1],
+                        "#SEQ " + " ".join(rows[2].split()[1:]),
+                        "#PP " + pp,
+                    ),
+                )
             )
-        elif line.startswith("# Date:"):
-            date_str = line.split("# Date:")[1].strip()
-            date_obj = datetime.strptime(date_str, "%a %b %d %H:%M:%S %Y")
-            date = date_obj.strftime("%Y-%m-%d %H:%M:%S")
+            state = "seek"
+            if pp:
+                continue
 
-    return date, hit_list
+        if line.startswith(">>"):
+            state = "hit"
+        elif line.startswith("Total CM hits reported:") and num_hits is None:
+            num_hits = int(line.split()[4])
 
+    return num_hits or 0, alignments
 
-def parse_cm_scan_result(
+
+def cm_scan_result_document(
     out_text: str, sequence: str, tblout_text: str, job_id: str
-) -> CmScanResult | MultipleSequences:
+) -> ty.Dict:
     """
-    Function to parse the CmScanResult/MultipleSequences format into the models
+    Parse the results of a job into plain dicts and lists, laid out like
+    CmScanResult, or MultipleSequences for several query sequences
     :param out_text: out file contents
     :param sequence: sequence file contents
     :param tblout_text: tblout file contents
     :param job_id: ID created by Infernal cmscan
-    :return: CmScanResult or MultipleSequences
+    :return: result document
     """
-    if sequence.count(">") > 1:
+    if is_multiple_sequences(sequence):
         # Show only tblout file results
         date, hit_list = parse_tblout_file(tblout_text)
-        return MultipleSequences(opened=date, hits=hit_list)
+        return {"opened": date, "hits": hit_list}
 
     # Get sequence
     search_sequence = sequence.split("\n")
@@ -184,69 +713,167 @@ def parse_cm_scan_result(
         search_sequence = "".join(search_sequence)
 
     # Get data from tblout_text
-    date, hit_list = parse_tblout_file(tblout_text)
+    date, records = parse_tblout_records(tblout_text)
     closed = datetime.now().strftime("%Y-%m-%d %H:%M:%S") if date != "" else ""
 
-    # Get number of CM hits reported
-    num_hits = re.search(r"Total CM hits reported:\s+(\d+)\s", out_text)
-    num_hits = int(num_hits.group(1)) if num_hits else 0
-
-    # Iterate through lines to extract alignment from out_text
-    lines = out_text.split("\n")
-    line_index = 16  # Start of hit scores
-    while line_index < len(lines):
-        if lines[line_index].startswith(">>"):
-            line_index += 3  # Skip unnecessary lines
-            fields = lines[line_index].strip().split()
-            start = int(fields[9])
-            end = int(fields[10])
-            score = float(fields[3])
-            e_value = float(fields[2])
-
-            line_index += 2  # Start of alignment
-            # Alignments have a fixed number of lines, 6 in total
-            alignment = Alignment(
-                nc="#NC " + lines[line_index].split("NC")[0],
-                ss="#SS " + lines[line_index + 1].split("CS")[0],
-                hit_seq="#CM " + " ".join(lines[line_index + 2].split()[1:]),
-                match="#MATCH " + lines[line_index + 3],
-                user_seq="#SEQ " + " ".join(lines[line_index + 4].split()[1:]),
-                pp="#PP " + lines[line_index + 5].split("PP")[0],
-            )
-            line_index += 6  # End of alignment
-
-            for item in hit_list:
-                if (
-                    item["start"] == start
-                    and item["end"] == end
-                    and item["score"] == score
-                    and item["E"] == e_value
-                ):
-                    item["alignment"] = alignment
-                    break
-
-        elif lines[line_index] == "Internal CM pipeline statistics summary:":
-            # No more alignments to check
-            break
+    num_hits = attach_alignments(out_text, records)
+
+    return {
+        "searchSequence": search_sequence,
+        "numHits": num_hits,
+        "jobId": job_id,
+        "opened": date,
+        "started": date,
+        "closed": closed,
+        "hits": group_hits(records),
+    }
+
+
+def is_multiple_sequences(sequence: str) -> bool:
+    return sequence.count(">") > 1
 
-        else:
-            line_index += 1
 
+def parse_cm_scan_result(
+    out_text: str, sequence: str, tblout_text: str, job_id: str
+) -> CmScanResult | MultipleSequences:
+    """
+    Function to parse the CmScanResult/MultipleSequences format into the models
+    :param out_text: out file contents
+    :param sequence: sequence file contents
+    :param tblout_text: tblout file contents
+    :param job_id: ID created by Infernal cmscan
+    :return: CmScanResult or MultipleSequences
+    """
+    document = cm_scan_result_document(out_text, sequence, tblout_text, job_id)
+    if is_multiple_sequences(sequence):
+        return MultipleSequences.model_validate(document)
+    return CmScanResult.model_validate(document)
+
+
+def cm_scan_result_json(
+    out_text: str, sequence: str, tblout_text: str, job_id: str
+) -> bytes:
+    """
+    Parse the results of a job straight to the JSON of CmScanResult or
+    MultipleSequences, without building the models
+    :param out_text: out file contents
+    :param sequence: sequence file contents
+    :param tblout_text: tblout file contents
+    :param job_id: ID created by Infernal cmscan
+    :return: UTF-8 encoded JSON
+    """
+    return dump_json(cm_scan_result_document(out_text, sequence, tblout_text, job_id))
+
+
+def attach_alignments(out_text: str, records: ty.List[HitRecord]) -> int:
+    """
+    Add the alignments found in out_text to the matching tblout hits
+    :param out_text: out file contents, or the section of one query
+    :param records: tblout hits of the same query sequence(s)
+    :return: number of CM hits reported
+    """
+    # Join alignments to their tblout rows through the hit coordinates
+    num_hits, alignments = parse_out_file(out_text)
+    index = {}
+    for record in records:
+        index.setdefault(record.key, []).append(record)
+    for key, alignment in alignments:
+        matches = index.get(key)
+        if matches:
+            matches.pop(0).alignment = alignment
+    return num_hits
+
+
+def group_hits(records: ty.Iterable[HitRecord]) -> ty.Dict[str, ty.List[ty.Dict]]:
     # Rearrange hits according to the pattern expected by the user
     hits = {}
-    for item in hit_list:
-        id_value = item["id"]
+    for record in records:
+        id_value = record.id
         if id_value not in hits:
             hits[id_value] = []
 
-        hits[id_value].append(Hit(**item))
+        hits[id_value].append(record.as_dict())
+    return hits
+
 
-    return CmScanResult(
-        searchSequence=search_sequence,
-        numHits=num_hits,
-        jobId=job_id,
-        opened=date,
-        started=date,
-        closed=closed,
-        hits=hits,
+def sequence_page_document(
+    out: ty.Union[bytes, mmap.mmap],
+    tblout: ty.Union[bytes, mmap.mmap],
+    index: SequenceIndex,
+    job_id: str,
+    offset: int,
+    limit: int,
+) -> ty.Dict:
+    """
+    Parse the hits and alignments of a page of the query sequences of a job
+    into plain dicts and lists, laid out like SequencePage. Only the sections
+    of the out file and the tblout rows belonging to the page are read.
+    :param out: out file contents, or a memory map of the file
+    :param tblout: tblout file contents, or a memory map of the file
+    :param index: offsets of the query sequences in out and tblout
+    :param job_id: ID created by Infernal cmscan
+    :param offset: index of the first query sequence of the page
+    :param limit: maximum number of query sequences in the page
+    :return: page document
+    """
+    sequences = []
+    # Rows of a query repeated in the page are only matched once
+    indexes: ty.Dict[str, ty.Dict[HitKey, ty.List[HitRecord]]] = {}
+    for i in range(offset, min(offset + limit, len(index))):
+        section = index.section(i)
+        # The hits of a section are the tblout rows of its query matching one
+        # of its alignments
+        if section.query not in indexes:
+            records = indexes[section.query] = {}
+            lines = (
+                bytes(tblout[start:end]).decode() for start, end in index.row_spans(i)
+            )
+            for record in iter_tblout_records(lines):
+                records.setdefault(record.key, []).append(record)
+        records_by_key = indexes[section.query]
+        num_hits, alignments = parse_out_file(
+            bytes(out[section.start : section.end]).decode()
+        )
+        records = []
+        for key, alignment in alignments:
+            matches = records_by_key.get(key)
+            if matches:
+                record = matches.pop(0)
+                record.alignment = alignment
+                records.append(record)
+        sequences.append(
+            {
+                "sequence": section.query,
+                "length": section.length,
+                "numHits": num_hits,
+                "hits": group_hits(records),
+            }
+        )
+
+    return {
+        "jobId": job_id,
+        "opened": index.opened,
+        "total": len(index),
+        "offset": offset,
+        "limit": limit,
+        "sequences": sequences,
+    }
+
+
+def parse_sequence_page(
+    out_text: str, tblout_text: str, job_id: str, offset: int, limit: int
+) -> SequencePage:
+    """
+    Parse the hits and alignments of a page of the query sequences of a job
+    :param out_text: out file contents
+    :param tblout_text: tblout file contents
+    :param job_id: ID created by Infernal cmscan
+    :param offset: index of the first query sequence of the page
+    :param limit: maximum number of query sequences in the page
+    :return: SequencePage
+    """
+    out, tblout = out_text.encode(), tblout_text.encode()
+    index = index_sequences(out, tblout)
+    return SequencePage.model_validate(
+        sequence_page_document(out, tblout, index, job_id, offset, limit)
     )
@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+import os
+import typing as ty
+
+from rfam_batch.job_dispatcher import JobDispatcher, SearchBackend
+from rfam_batch.local_cmscan import LocalCmscan
+
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "ebi")
+
+BACKENDS: ty.Dict[str, ty.Type[SearchBackend]] = {
+    "ebi": JobDispatcher,
+    "local": LocalCmscan,
+}
+
+
+def backend(name: str = SEARCH_BACKEND) -> SearchBackend:
+    """
+    Search backend selected with the SEARCH_BACKEND environment variable
+    :param name: ebi to use Job Dispatcher, local to run cmscan here
+    :return: the backend, sharing its state with every other instance
+    """
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError(
+            f"Unknown search backend {name!r}, use one of {list(BACKENDS)}"
+        )
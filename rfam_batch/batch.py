@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import typing as ty
+import uuid
+
+from logger import logger
+from rfam_batch.job_dispatcher import Query
+
+SUBMIT_CHUNK_SIZE = int(os.getenv("SUBMIT_CHUNK_SIZE", "100"))
+SUBMIT_CHUNK_CONCURRENCY = int(os.getenv("SUBMIT_CHUNK_CONCURRENCY", "4"))
+CHILD_FETCH_CONCURRENCY = int(os.getenv("CHILD_FETCH_CONCURRENCY", "10"))
+
+# Parent jobs are created here rather than by Job Dispatcher
+PARENT_PREFIX = "rfam_batch-"
+
+
+def is_parent(job_id: str) -> bool:
+    return job_id.startswith(PARENT_PREFIX)
+
+
+def new_parent_id() -> str:
+    return f"{PARENT_PREFIX}{uuid.uuid4().hex}"
+
+
+def chunk(sequences: ty.List[str], size: int) -> ty.List[ty.List[str]]:
+    return [sequences[i : i + size] for i in range(0, len(sequences), size)]
+
+
+def aggregate_status(statuses: ty.List[str]) -> str:
+    """
+    Status of a parent job from the status of its child jobs
+    :param statuses: status of each child job
+    :return: FINISHED once every child has finished, the first problem found,
+    otherwise RUNNING or QUEUED
+    """
+    for problem in ("ERROR", "FAILURE", "NOT_FOUND"):
+        if problem in statuses:
+            return problem
+    if all(status == "FINISHED" for status in statuses):
+        return "FINISHED"
+    if all(status == "QUEUED" for status in statuses):
+        return "QUEUED"
+    return "RUNNING"
+
+
+async def submit_chunks(
+    submit: ty.Callable[[Query], ty.Awaitable[str]],
+    query: Query,
+    sequences: ty.List[str],
+    chunk_size: int = SUBMIT_CHUNK_SIZE,
+    concurrency: int = SUBMIT_CHUNK_CONCURRENCY,
+    submitted: ty.Optional[ty.Dict[int, str]] = None,
+    on_submitted: ty.Optional[ty.Callable[[int, str], None]] = None,
+) -> ty.List[str]:
+    """
+    Split the sequences into chunks and submit one job per chunk, with at
+    most concurrency submissions in flight
+    :param submit: function submitting a job and returning its id
+    :param query: search parameters shared by every chunk
+    :param sequences: sequences in FASTA format
+    :param chunk_size: maximum number of sequences in a job
+    :param concurrency: maximum number of submissions in flight
+    :param submitted: ids of the chunks already submitted by position, these
+    are not submitted again
+    :param on_submitted: called with the position and id of each chunk once
+    it is submitted
+    :return: ids of the child jobs, in the order of the sequences
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    submitted = submitted or {}
+
+    async def submit_chunk(position: int, chunk_sequences: ty.List[str]) -> str:
+        if position in submitted:
+            return submitted[position]
+        chunk_query = Query()
+        chunk_query.id = query.id
+        chunk_query.email_address = query.email_address
+        chunk_query.threshold_model = query.threshold_model
+        chunk_query.sequences = "\n".join(chunk_sequences)
+        async with semaphore:
+            job_id = await submit(chunk_query)
+        if on_submitted is not None:
+            on_submitted(position, job_id)
+        return job_id
+
+    results = await asyncio.gather(
+        *[
+            submit_chunk(position, chunk_sequences)
+            for position, chunk_sequences in enumerate(chunk(sequences, chunk_size))
+        ],
+        return_exceptions=True,
+    )
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        submitted = [result for result in results if isinstance(result, str)]
+        logger.error(f"Failed chunked submission, submitted jobs: {submitted}")
+        raise errors[0]
+    return results
+
+
+def join_artifacts(texts: ty.List[str]) -> ty.Tuple[str, bool]:
+    """
+    Concatenate the same artifact of every child job, e.g. their tblout files
+    :param texts: artifact of each child job, empty if it could not be fetched
+    :return: artifact of the parent job and whether every child job's artifact
+    is in it, a parent missing one must not be cached as final
+    """
+    text = "".join(t if t.endswith("\n") else t + "\n" for t in texts if t)
+    return text, all(texts)
+
+
+async def gather_children(
+    fetch: ty.Callable[[str], ty.Awaitable[str]],
+    children: ty.List[str],
+    concurrency: int = CHILD_FETCH_CONCURRENCY,
+) -> ty.List[str]:
+    """
+    Call fetch for every child job with bounded concurrency
+    :param fetch: function fetching a status or artifact of a job
+    :param children: ids of the child jobs
+    :param concurrency: maximum number of calls in flight
+    :return: results, in the order of the child jobs
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch_child(child: str) -> str:
+        async with semaphore:
+            return await fetch(child)
+
+    return await asyncio.gather(*[fetch_child(child) for child in children])
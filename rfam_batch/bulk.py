@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import typing as ty
+
+from fastapi import HTTPException
+from logger import logger
+
+BULK_MAX_JOBS = int(os.getenv("BULK_MAX_JOBS", "1000"))
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "20"))
+
+T = ty.TypeVar("T")
+
+
+def unique_job_ids(
+    job_ids: ty.List[str], max_jobs: int = BULK_MAX_JOBS
+) -> ty.List[str]:
+    """
+    Job ids of a bulk request, without duplicates
+    :param job_ids: job ids sent by the client
+    :param max_jobs: most distinct job ids accepted in one request
+    :return: distinct job ids, in the order they were sent
+    """
+    unique = list(dict.fromkeys(job_ids))
+    if not unique:
+        raise HTTPException(status_code=400, detail="Please send at least one job id")
+    if len(unique) > max_jobs:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {max_jobs} job ids can be sent in one request",
+        )
+    return unique
+
+
+def error_message(error: Exception) -> str:
+    if isinstance(error, HTTPException):
+        return str(error.detail)
+    return str(error) or type(error).__name__
+
+
+async def gather_isolated(
+    fetch: ty.Callable[[str], ty.Awaitable[T]],
+    job_ids: ty.List[str],
+    concurrency: int = BULK_CONCURRENCY,
+) -> ty.Tuple[ty.Dict[str, T], ty.Dict[str, str]]:
+    """
+    Call fetch for every job with bounded concurrency, a job failing does not
+    fail the others
+    :param fetch: function fetching something about a job
+    :param job_ids: ids of the jobs
+    :param concurrency: maximum number of calls in flight
+    :return: result of each job that succeeded and error message of each job
+    that failed
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    results: ty.Dict[str, T] = {}
+    errors: ty.Dict[str, str] = {}
+
+    async def fetch_job(job_id: str) -> None:
+        async with semaphore:
+            try:
+                results[job_id] = await fetch(job_id)
+            except Exception as e:
+                logger.error(f"Error in bulk request for {job_id}. Error: {e}")
+                errors[job_id] = error_message(e)
+
+    await asyncio.gather(*[fetch_job(job_id) for job_id in job_ids])
+    # Keep the order of the request rather than the order of completion
+    return (
+        {job_id: results[job_id] for job_id in job_ids if job_id in results},
+        {job_id: errors[job_id] for job_id in job_ids if job_id in errors},
+    )
+
+
+def count_hits(tblout_text: str) -> ty.Tuple[int, int]:
+    """
+    Count the hits of a tblout file without parsing them
+    :param tblout_text: tblout file contents
+    :return: number of hits and of query sequences with at least one hit
+    """
+    hits = 0
+    queries = set()
+    for line in tblout_text.splitlines():
+        if line.startswith("#"):
+            continue
+        # Only the query name is needed, in the third column
+        fields = line.split(maxsplit=3)
+        if len(fields) > 2:
+            hits += 1
+            queries.add(fields[2])
+    return hits, len(queries)
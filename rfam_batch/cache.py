@@ -0,0 +1,286 @@
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+import typing as ty
+
+from collections import OrderedDict
+from logger import logger
+
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", "/tmp/rfam-batch-search/results")
+RESULT_CACHE_MAX_ITEMS = int(os.getenv("RESULT_CACHE_MAX_ITEMS", "256"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024**2)))
+RESULT_CACHE_MAX_DISK_BYTES = int(
+    os.getenv("RESULT_CACHE_MAX_DISK_BYTES", str(2 * 1024**3))
+)
+
+
+class LRUCache:
+    """
+    In-memory least recently used cache bounded by the number of entries and
+    by the total size of the stored values
+    """
+
+    def __init__(self, max_items: int, max_bytes: int) -> None:
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.evictions = 0
+        self._data: OrderedDict[str, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> ty.Optional[bytes]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            # Never let a single entry flush the whole cache
+            return
+        with self._lock:
+            previous = self._data.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._data[key] = value
+            self.size += len(value)
+            while len(self._data) > self.max_items or self.size > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+
+class DiskStore:
+    """
+    Key/value store kept as one file per key in a directory, so it is shared
+    by every gunicorn worker and survives restarts. Writes are atomic and the
+    least recently used files are removed once the directory grows beyond
+    max_bytes, down to prune_to of it.
+
+    The size of the directory is counted as values are written, and only
+    scanned, in a thread, when the count goes over max_bytes. The count
+    includes the writes of other workers up to the last scan, so the
+    directory may grow past max_bytes by what they wrote since.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, prune_to: float = 0.9) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.prune_to = prune_to
+        self.evictions = 0
+        # Unknown until the directory is first scanned
+        self.size: ty.Optional[int] = None
+        self.pruner: ty.Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def get(self, key: str) -> ty.Optional[bytes]:
+        path = self.path(key)
+        try:
+            with open(path, "rb") as file:
+                value = file.read()
+            # Refresh the access time used to pick files for eviction
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return value
+
+    @contextlib.contextmanager
+    def view(self, key: str) -> ty.Iterator[ty.Optional[ty.Union[bytes, mmap.mmap]]]:
+        """
+        Map a stored value into memory instead of reading it, so reading a
+        few parts of a large value only loads those
+        :param key: key of the value
+        :return: read-only memory map of the value, or None
+        """
+        path = self.path(key)
+        try:
+            file = open(path, "rb")
+        except FileNotFoundError:
+            yield None
+            return
+        with file:
+            os.utime(path)
+            if os.fstat(file.fileno()).st_size == 0:
+                # Empty files cannot be mapped
+                yield b""
+                return
+            # Still readable if the file is replaced or evicted meanwhile
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield mapped
+
+    def put(self, key: str, value: bytes) -> None:
+        path = self.path(key)
+        previous = self.file_size(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(value)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.count(len(value) - previous)
+
+    def delete(self, key: str) -> None:
+        path = self.path(key)
+        size = self.file_size(path)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            return
+        self.count(-size)
+
+    @staticmethod
+    def file_size(path: str) -> int:
+        try:
+            return os.stat(path).st_size
+        except FileNotFoundError:
+            return 0
+
+    def count(self, change: int) -> None:
+        with self._lock:
+            if self.size is not None:
+                self.size += change
+            due = self.size is None or self.size > self.max_bytes
+            if not due or (self.pruner is not None and self.pruner.is_alive()):
+                return
+            # Scanning the directory would stall the event loop of the worker
+            self.pruner = threading.Thread(target=self.prune, daemon=True)
+            self.pruner.start()
+
+    def prune(self) -> None:
+        """
+        Scan the directory and, if it is larger than max_bytes, remove the
+        least recently used files until it is down to prune_to of it
+        """
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    # Removed by another worker
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        if total > self.max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes * self.prune_to:
+                    break
+                try:
+                    os.unlink(path)
+                    self.evictions += 1
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+        with self._lock:
+            self.size = total
+
+
+class ResultCache:
+    """
+    Two level cache for results of finished jobs: a per-worker LRU in front
+    of a DiskStore shared by all workers
+    """
+
+    def __init__(self, memory: LRUCache, disk: ty.Optional[DiskStore]) -> None:
+        self.memory = memory
+        self.disk = disk
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> ResultCache:
+        memory = LRUCache(RESULT_CACHE_MAX_ITEMS, RESULT_CACHE_MAX_BYTES)
+        try:
+            disk = DiskStore(RESULT_CACHE_DIR, RESULT_CACHE_MAX_DISK_BYTES)
+        except OSError as e:
+            logger.error(f"Result cache directory unavailable, memory only: {e}")
+            disk = None
+        return cls(memory, disk)
+
+    def get(self, key: str) -> ty.Optional[bytes]:
+        value = self.memory.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.disk_hits += 1
+                self.memory.put(key, value)
+                return value
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value: bytes) -> None:
+        self.memory.put(key, value)
+        if self.disk is not None:
+            try:
+                self.disk.put(key, value)
+            except OSError as e:
+                logger.error(f"Error writing {key} to the result cache. Error: {e}")
+
+    @contextlib.contextmanager
+    def view(self, key: str) -> ty.Iterator[ty.Optional[ty.Union[bytes, mmap.mmap]]]:
+        """
+        Value of a key without copying it into this worker's memory
+        :param key: key of the value
+        :return: the value if held in memory, otherwise a memory map of the
+        shared copy, or None
+        """
+        value = self.memory.get(key)
+        if value is not None:
+            self.hits += 1
+            yield value
+            return
+        if self.disk is None:
+            self.misses += 1
+            yield None
+            return
+        with self.disk.view(key) as value:
+            if value is None:
+                self.misses += 1
+            else:
+                self.disk_hits += 1
+            yield value
+
+    def location(self, key: str) -> ty.Optional[str]:
+        # Path of the shared copy, None if results are only kept in memory
+        return self.disk.path(key) if self.disk is not None else None
+
+    def stats(self) -> ty.Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "entries": len(self.memory),
+            "bytes": self.memory.size,
+            "evictions": self.memory.evictions,
+            "disk_evictions": self.disk.evictions if self.disk else 0,
+        }
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import typing as ty
+
+from logger import logger
+from rfam_batch.poller import TERMINAL_STATUSES
+from rfam_batch.status_cache import KNOWN_STATUSES
+
+EVENTS_POLL_INTERVAL = float(os.getenv("EVENTS_POLL_INTERVAL", "2"))
+EVENTS_KEEPALIVE = float(os.getenv("EVENTS_KEEPALIVE", "15"))
+
+
+class Watch:
+    def __init__(self, job_id: str) -> None:
+        self.job_id = job_id
+        self.status: ty.Optional[str] = None
+        self.subscribers: ty.Set[asyncio.Queue] = set()
+        self.task: ty.Optional[asyncio.Task] = None
+
+
+class Subscription:
+    """
+    Status changes of one job for one client, ending with its terminal status
+    """
+
+    def __init__(self, watcher: StatusWatcher, watch: Watch) -> None:
+        self.watcher = watcher
+        self.watch = watch
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    async def get(self) -> ty.Optional[str]:
+        """
+        Wait for the next status
+        :return: status, or None once the terminal status has been sent
+        """
+        return await self.queue.get()
+
+    def close(self) -> None:
+        self.watcher.unsubscribe(self)
+
+
+class StatusWatcher:
+    """
+    Polls the status of the jobs clients are subscribed to, with one task per
+    job whatever the number of its subscribers. Every subscriber gets the
+    current status straight away and then each change. A job stops being
+    polled when it reaches a terminal status or loses its last subscriber.
+    """
+
+    def __init__(
+        self,
+        fetch_status: ty.Callable[[str], ty.Awaitable[str]],
+        interval: float = EVENTS_POLL_INTERVAL,
+    ) -> None:
+        self.fetch_status = fetch_status
+        self.interval = interval
+        self.watches: ty.Dict[str, Watch] = {}
+
+    def subscribe(self, job_id: str) -> Subscription:
+        watch = self.watches.get(job_id)
+        if watch is None:
+            watch = Watch(job_id)
+            self.watches[job_id] = watch
+            watch.task = asyncio.create_task(self.poll(watch))
+        subscription = Subscription(self, watch)
+        watch.subscribers.add(subscription.queue)
+        if watch.status is not None:
+            subscription.queue.put_nowait(watch.status)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        watch = subscription.watch
+        watch.subscribers.discard(subscription.queue)
+        if not watch.subscribers and self.watches.get(watch.job_id) is watch:
+            del self.watches[watch.job_id]
+            watch.task.cancel()
+
+    def publish(self, watch: Watch, status: ty.Optional[str]) -> None:
+        for queue in watch.subscribers:
+            queue.put_nowait(status)
+
+    async def poll(self, watch: Watch) -> None:
+        while True:
+            try:
+                status = await self.fetch_status(watch.job_id)
+            except Exception as e:
+                logger.error(f"Error watching status of {watch.job_id}. Error: {e}")
+                status = None
+
+            # Upstream error pages are not statuses, the next poll may succeed
+            if status in KNOWN_STATUSES and status != watch.status:
+                watch.status = status
+                self.publish(watch, status)
+            if status in TERMINAL_STATUSES:
+                # Later subscribers start a new watch, served by the cache
+                if self.watches.get(watch.job_id) is watch:
+                    del self.watches[watch.job_id]
+                self.publish(watch, None)
+                return
+            await asyncio.sleep(self.interval)
+
+    async def stop(self) -> None:
+        watches = list(self.watches.values())
+        self.watches.clear()
+        for watch in watches:
+            watch.task.cancel()
+        await asyncio.gather(*[w.task for w in watches], return_exceptions=True)
@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import csv
+import io
+import json
+import os
+import typing as ty
+
+from urllib.parse import quote
+from fastapi import HTTPException
+from rfam_batch.api import HitRecord, split_tblout_line, tblout_record
+
+# Rows are sent in chunks of about this many bytes, not one write per hit
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", str(64 * 1024)))
+
+# Columns of the CSV and JSON Lines exports
+COLUMNS = [
+    "query",
+    "id",
+    "acc",
+    "start",
+    "end",
+    "strand",
+    "GC",
+    "score",
+    "E",
+    "description",
+]
+
+# Characters left as they are in GFF3 columns, the others are percent encoded
+GFF3_SEQID_SAFE = ".:^*$@!+_?-|"
+GFF3_ATTRIBUTE_SAFE = " !\"#$'()*+-./:<>?@[\\]^_`{|}~"
+
+
+class ExportHit(ty.NamedTuple):
+    query: str
+    record: HitRecord
+    description: str
+
+
+class ExportFormat(ty.NamedTuple):
+    media_type: str
+    extension: str
+    header: ty.Callable[[], str]
+    row: ty.Callable[[ExportHit], str]
+
+
+def tblout_export_hit(line: str) -> ty.Optional[ExportHit]:
+    """
+    Parse one row of a tblout file for an export
+    :param line: tblout line
+    :return: hit with its query sequence, or None for comments and blank lines
+    """
+    fields = split_tblout_line(line)
+    if not fields:
+        return None
+    description = fields[17].strip() if len(fields) > 17 else ""
+    return ExportHit(fields[2], tblout_record(fields), description)
+
+
+async def aiter_export_hits(
+    lines: ty.AsyncIterable[str],
+) -> ty.AsyncIterator[ExportHit]:
+    """
+    Asynchronous generator over the hits of a tblout file and their query
+    sequences, used to export a response body as it arrives
+    :param lines: tblout lines
+    :return: hits, in file order
+    """
+    async for line in lines:
+        hit = tblout_export_hit(line)
+        if hit is not None:
+            yield hit
+
+
+def bounds(record: HitRecord) -> ty.Tuple[int, int]:
+    # cmscan reports hits on the reverse strand from their end to their start
+    return min(record.start, record.end), max(record.start, record.end)
+
+
+def gff3_header() -> str:
+    return "##gff-version 3\n"
+
+
+def gff3_row(hit: ExportHit) -> str:
+    record = hit.record
+    start, end = bounds(record)
+    attributes = {
+        "Name": record.id,
+        "Alias": record.acc,
+        "evalue": repr(record.E),
+        "gc": repr(record.GC),
+        "Note": hit.description,
+    }
+    encoded = ";".join(
+        f"{key}={quote(value, safe=GFF3_ATTRIBUTE_SAFE)}"
+        for key, value in attributes.items()
+        if value
+    )
+    columns = [
+        quote(hit.query, safe=GFF3_SEQID_SAFE),
+        "cmscan",
+        "ncRNA",
+        str(start),
+        str(end),
+        repr(record.score),
+        record.strand,
+        ".",
+        encoded,
+    ]
+    return "\t".join(columns) + "\n"
+
+
+def bed_header() -> str:
+    return ""
+
+
+def bed_row(hit: ExportHit) -> str:
+    record = hit.record
+    start, end = bounds(record)
+    # BED coordinates start at 0 and scores range from 0 to 1000
+    score = min(1000, max(0, round(record.score)))
+    columns = [hit.query, str(start - 1), str(end), record.id, str(score)]
+    return "\t".join(columns + [record.strand]) + "\n"
+
+
+def hit_values(hit: ExportHit) -> ty.List:
+    record = hit.record
+    return [
+        hit.query,
+        record.id,
+        record.acc,
+        record.start,
+        record.end,
+        record.strand,
+        record.GC,
+        record.score,
+        record.E,
+        hit.description,
+    ]
+
+
+def csv_line(values: ty.List) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerow(values)
+    return buffer.getvalue()
+
+
+def csv_header() -> str:
+    return csv_line(COLUMNS)
+
+
+def csv_row(hit: ExportHit) -> str:
+    return csv_line(hit_values(hit))
+
+
+def jsonl_header() -> str:
+    return ""
+
+
+def jsonl_row(hit: ExportHit) -> str:
+    return json.dumps(dict(zip(COLUMNS, hit_values(hit)))) + "\n"
+
+
+FORMATS = {
+    "gff3": ExportFormat("text/x-gff3", "gff3", gff3_header, gff3_row),
+    "bed": ExportFormat("text/x-bed", "bed", bed_header, bed_row),
+    "csv": ExportFormat("text/csv", "csv", csv_header, csv_row),
+    "jsonl": ExportFormat("application/x-ndjson", "jsonl", jsonl_header, jsonl_row),
+}
+
+
+def export_format(name: str) -> ExportFormat:
+    """
+    Look up an export format
+    :param name: gff3, bed, csv or jsonl
+    :return: the format
+    """
+    try:
+        return FORMATS[name]
+    except KeyError:
+        choices = ", ".join(FORMATS)
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown export format {name}, please use one of {choices}",
+        )
+
+
+async def export_chunks(
+    export: ExportFormat,
+    first: ty.Optional[ExportHit],
+    hits: ty.AsyncIterator[ExportHit],
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+) -> ty.AsyncIterator[str]:
+    """
+    Asynchronous generator over an export document, written as the hits come
+    in without keeping more than a chunk in memory
+    :param export: format of the document
+    :param first: first hit, already read to report upstream errors, if any
+    :param hits: remaining hits
+    :param chunk_size: bytes of rows gathered before sending them
+    :return: parts of the document
+    """
+    buffer = [export.header()]
+    size = len(buffer[0])
+    if first is not None:
+        buffer.append(export.row(first))
+        size += len(buffer[-1])
+        async for hit in hits:
+            row = export.row(hit)
+            buffer.append(row)
+            size += len(row)
+            if size >= chunk_size:
+                yield "".join(buffer)
+                buffer, size = [], 0
+    if size:
+        yield "".join(buffer)
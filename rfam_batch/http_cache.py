@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import asyncio
+import gzip
+import hashlib
+import os
+import typing as ty
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:
+    # Optional, responses are only gzip compressed without it
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+FINISHED_MAX_AGE = int(os.getenv("FINISHED_MAX_AGE", str(365 * 24 * 3600)))
+
+# Bodies larger than this are hashed and compressed off the event loop
+THREAD_MIN_BYTES = 1024**2
+
+
+def etag(body: bytes) -> str:
+    """
+    Strong validator of a response body
+    :param body: uncompressed body
+    :return: quoted entity tag
+    """
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def variant_etag(tag: str, encoding: ty.Optional[str]) -> str:
+    # Each encoding is a different representation, so it needs its own tag
+    return f'{tag[:-1]}-{encoding}"' if encoding else tag
+
+
+def if_none_match(header: ty.Optional[str], tag: str) -> bool:
+    """
+    Whether the client already has a representation of the body
+    :param header: value of the If-None-Match request header
+    :param tag: entity tag of the uncompressed body
+    :return: True if the response can be 304 Not Modified
+    """
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    base = tag[1:-1]
+    for candidate in header.split(","):
+        # Weak comparison, as required for If-None-Match
+        candidate = candidate.strip().removeprefix("W/").strip('"')
+        if candidate == base or candidate.startswith(f"{base}-"):
+            return True
+    return False
+
+
+def accepted_encoding(header: ty.Optional[str]) -> ty.Optional[str]:
+    """
+    Preferred content coding supported by both sides
+    :param header: value of the Accept-Encoding request header
+    :return: br, gzip or None
+    """
+    accepted = set()
+    for item in (header or "").split(","):
+        coding, _, params = item.partition(";")
+        params = params.replace(" ", "")
+        try:
+            quality = float(params[2:]) if params.startswith("q=") else 1.0
+        except ValueError:
+            quality = 0.0
+        if quality > 0:
+            accepted.add(coding.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+def cache_control(finished: bool) -> str:
+    # Results of finished jobs never change, anything else may change soon
+    if finished:
+        return f"public, max-age={FINISHED_MAX_AGE}, immutable"
+    return "no-store"
+
+
+async def cacheable_response(
+    request: Request,
+    body: bytes,
+    media_type: str,
+    finished: bool,
+    headers: ty.Optional[ty.Dict[str, str]] = None,
+) -> Response:
+    """
+    Response with an ETag and Cache-Control, answering 304 Not Modified when
+    the client already has the body and compressing large bodies
+    :param request: request being answered
+    :param body: uncompressed response body
+    :param media_type: content type of the body
+    :param finished: whether the job has finished, so the body is final
+    :param headers: further response headers
+    :return: Response
+    """
+    large = len(body) >= THREAD_MIN_BYTES
+    tag = await asyncio.to_thread(etag, body) if large else etag(body)
+    response_headers = dict(headers or {})
+    response_headers["Cache-Control"] = cache_control(finished)
+    response_headers["Vary"] = "Accept-Encoding"
+
+    encoding = None
+    if len(body) >= COMPRESS_MIN_BYTES:
+        encoding = accepted_encoding(request.headers.get("accept-encoding"))
+    response_headers["ETag"] = variant_etag(tag, encoding)
+
+    if if_none_match(request.headers.get("if-none-match"), tag):
+        return Response(status_code=304, headers=response_headers)
+
+    if encoding:
+        if large:
+            body = await asyncio.to_thread(compress, body, encoding)
+        else:
+            body = compress(body, encoding)
+        response_headers["Content-Encoding"] = encoding
+
+    return Response(content=body, media_type=media_type, headers=response_headers)
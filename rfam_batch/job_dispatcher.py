@@ -1,25 +1,40 @@
 from __future__ import annotations
 
-import aiohttp
-import httpx
+import abc
+import asyncio
+import os
 import re
 import typing as ty
 
 from fastapi import HTTPException
 from logger import logger
+from rfam_batch import metrics
+from rfam_batch.upstream import UpstreamClient
 
-INFERNAL_CMSCAN_BASE_URL = "https://www.ebi.ac.uk/Tools/services/rest/infernal_cmscan"
+INFERNAL_CMSCAN_BASE_URL = os.getenv(
+    "JD_BASE_URL", "https://www.ebi.ac.uk/Tools/services/rest/infernal_cmscan"
+)
+
+T = ty.TypeVar("T")
+
+# Call names reported in the upstream metrics for each artifact
+ARTIFACT_CALLS = {
+    "out": "cmscan_result",
+    "sequence": "cmscan_sequence",
+    "tblout": "cmscan_tblout",
+}
 
 
 class Query:
     sequences: ty.List[str]
     email_address: str
     id: ty.Optional[str]
+    threshold_model: str = "cut_ga"
 
     def payload(self) -> ty.Dict[str, str]:
         payload = {
             "email": self.email_address,
-            "threshold_model": "cut_ga",
+            "threshold_model": self.threshold_model,
             "sequence": self.sequences,
         }
         if self.id:
@@ -31,13 +46,117 @@ class JobSubmitResult:
     job_id: str
 
 
-class JobDispatcher:
-    client: ty.Optional[aiohttp.ClientSession] = None
+class SearchBackend(abc.ABC):
+    """
+    Runs cmscan searches. Implementations submit jobs, report their status
+    using the Job Dispatcher status names and return the out, sequence and
+    tblout artifacts of a job.
+    """
+
+    inflight: ty.Dict[str, asyncio.Future] = {}
+
+    @classmethod
+    async def coalesce(cls, key: str, fetch: ty.Callable[[], ty.Awaitable[T]]) -> T:
+        """
+        Single-flight: concurrent callers using the same key share one call to
+        fetch and all receive its result or exception
+        :param key: identifies the work, e.g. the URL being fetched
+        :param fetch: coroutine function doing the work
+        :return: result of fetch
+        """
+        future = cls.inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fetch())
+            cls.inflight[key] = future
+
+            def done(f: asyncio.Future) -> None:
+                cls.inflight.pop(key, None)
+                if not f.cancelled():
+                    # Mark the exception as retrieved if every waiter has gone
+                    f.exception()
+
+            future.add_done_callback(done)
+
+        # A waiter going away, e.g. a closed connection, must not cancel the
+        # shared call
+        return await asyncio.shield(future)
+
+    @classmethod
+    async def startup(cls) -> SearchBackend:
+        return cls()
+
+    @classmethod
+    async def shutdown(cls) -> None:
+        pass
+
+    @classmethod
+    def stats(cls) -> ty.Dict[str, ty.Union[int, float]]:
+        return {}
+
+    @abc.abstractmethod
+    async def submit_cmscan_job(self, data: Query) -> str:
+        """
+        Submit a search
+        :param data: search parameters and sequences
+        :return: ID of the job
+        """
+
+    @abc.abstractmethod
+    async def cmscan_status(self, job_id: str) -> str:
+        """
+        Status of a job
+        :param job_id: ID of the job
+        :return: Job Dispatcher status name, e.g. RUNNING or FINISHED
+        """
+
+    @abc.abstractmethod
+    async def fetch_artifact(self, job_id: str, kind: str) -> str:
+        """
+        Fetch one artifact of a job
+        :param job_id: ID of the job
+        :param kind: out, sequence or tblout
+        :return: file contents, empty if unavailable
+        """
+
+    async def cmscan_result(self, job_id: str) -> str:
+        return await self.fetch_artifact(job_id, "out")
+
+    async def cmscan_sequence(self, job_id: str) -> str:
+        return await self.fetch_artifact(job_id, "sequence")
+
+    async def cmscan_tblout(self, job_id: str) -> str:
+        return await self.fetch_artifact(job_id, "tblout")
+
+    async def stream_tblout(self, job_id: str) -> ty.AsyncIterator[str]:
+        for line in (await self.cmscan_tblout(job_id)).splitlines():
+            yield line
+
+    async def cmscan_artifacts(self, job_id: str) -> ty.Tuple[str, str, str]:
+        """
+        Fetch the out, sequence and tblout files of a job concurrently
+        :param job_id: ID of the job
+        :return: out, sequence and tblout file contents
+        """
+        out, sequence, tblout = await asyncio.gather(
+            self.cmscan_result(job_id),
+            self.cmscan_sequence(job_id),
+            self.cmscan_tblout(job_id),
+        )
+        return out, sequence, tblout
+
+
+class JobDispatcher(SearchBackend):
+    """
+    Searches using the EBI Job Dispatcher REST service
+    """
+
+    client: ty.Optional[UpstreamClient] = None
 
     @classmethod
     async def startup(cls) -> JobDispatcher:
         if cls.client is None:
-            cls.client = aiohttp.ClientSession()
+            cls.client = UpstreamClient()
+            await cls.client.start()
         return cls()
 
     @classmethod
@@ -46,70 +165,62 @@ class JobDispatcher:
             await cls.client.close()
         cls.client = None
 
+    @classmethod
+    def stats(cls) -> ty.Dict[str, ty.Union[int, float]]:
+        return cls.client.stats() if cls.client else {}
+
     async def submit_cmscan_job(self, data: Query) -> str:
-        try:
-            query = data.payload()
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{INFERNAL_CMSCAN_BASE_URL}/run", data=query
-                )
-                response.raise_for_status()
-                return response.text
-        except httpx.RequestError as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"An error occurred while requesting {e.request.url!r}: {str(e)}",
-            )
-        except httpx.HTTPStatusError as e:
-            if e.response.status_code == 400 and "<description>" in response.text:
-                # Extract and display the Job Dispatcher error message, e.g.:
-                # <error>
-                #  <description>Please enter a valid email address</description>
-                # </error>
-                text = re.search(
-                    r"<description>(.*?)</description>", response.text, re.DOTALL
-                )
-                logger.error(f"JD error message: {text.group(1)}")
-                raise HTTPException(status_code=400, detail=text.group(1))
-            else:
-                raise HTTPException(
-                    status_code=e.response.status_code,
-                    detail=f"Error {e.response.status_code} while requesting "
-                    f"{e.request.url!r}: {e.response.text}",
-                )
-        except httpx.TimeoutException as e:
+        # Submissions are not idempotent, so they are never retried
+        url = f"{INFERNAL_CMSCAN_BASE_URL}/run"
+        with metrics.upstream_call("submit_cmscan_job"):
+            status, text = await self.client.post(url, data=data.payload())
+        if status >= 400:
+            metrics.upstream_error("submit_cmscan_job")
+        if status == 400 and "<description>" in text:
+            # Extract and display the Job Dispatcher error message, e.g.:
+            # <error>
+            #  <description>Please enter a valid email address</description>
+            # </error>
+            message = re.search(r"<description>(.*?)</description>", text, re.DOTALL)
+            logger.error(f"JD error message: {message.group(1)}")
+            raise HTTPException(status_code=400, detail=message.group(1))
+        elif status >= 400:
             raise HTTPException(
-                status_code=504, detail=f"Request to {e.request.url!r} timed out."
+                status_code=status,
+                detail=f"Error {status} while requesting {url!r}: {text}",
             )
-        except Exception as e:
-            raise HTTPException(
-                status_code=500, detail=f"An unexpected error occurred: {str(e)}"
-            )
-
-    async def cmscan_result(self, job_id: str) -> str:
-        async with self.client.get(
-            f"{INFERNAL_CMSCAN_BASE_URL}/result/{job_id}/out"
-        ) as r:
-            if r.status != 200:
+        return text
+
+    async def fetch_text(self, url: str, call: str = "fetch_text") -> str:
+        async def fetch() -> str:
+            with metrics.upstream_call(call):
+                status, text = await self.client.get(url)
+            if status != 200:
+                metrics.upstream_error(call)
                 return ""
-            return await r.text()
+            return text
 
-    async def cmscan_sequence(self, job_id: str) -> str:
-        async with self.client.get(
-            f"{INFERNAL_CMSCAN_BASE_URL}/result/{job_id}/sequence"
-        ) as r:
-            if r.status != 200:
-                return ""
-            return await r.text()
+        return await self.coalesce(url, fetch)
 
-    async def cmscan_tblout(self, job_id: str) -> str:
-        async with self.client.get(
+    async def fetch_artifact(self, job_id: str, kind: str) -> str:
+        return await self.fetch_text(
+            f"{INFERNAL_CMSCAN_BASE_URL}/result/{job_id}/{kind}",
+            call=ARTIFACT_CALLS.get(kind, "fetch_artifact"),
+        )
+
+    def stream_tblout(self, job_id: str) -> ty.AsyncIterator[str]:
+        return self.client.stream_lines(
             f"{INFERNAL_CMSCAN_BASE_URL}/result/{job_id}/tblout"
-        ) as r:
-            if r.status != 200:
-                return ""
-            return await r.text()
+        )
 
     async def cmscan_status(self, job_id: str) -> str:
-        async with self.client.get(f"{INFERNAL_CMSCAN_BASE_URL}/status/{job_id}") as r:
-            return await r.text()
+        async def fetch() -> str:
+            with metrics.upstream_call("cmscan_status"):
+                status, text = await self.client.get(
+                    f"{INFERNAL_CMSCAN_BASE_URL}/status/{job_id}"
+                )
+            if status >= 400:
+                metrics.upstream_error("cmscan_status")
+            return text
+
+        return await self.coalesce(f"status:{job_id}", fetch)
@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import re
+import shlex
+import shutil
+import tempfile
+import time
+import typing as ty
+import uuid
+
+from fastapi import HTTPException
+from logger import logger
+from rfam_batch.job_dispatcher import Query, SearchBackend
+
+LOCAL_CMSCAN_BIN = os.getenv("LOCAL_CMSCAN_BIN", "cmscan")
+LOCAL_CMSCAN_DB = os.getenv("LOCAL_CMSCAN_DB", "/rfam/Rfam.cm")
+LOCAL_CMSCAN_OPTIONS = os.getenv("LOCAL_CMSCAN_OPTIONS", "--notextw --FZ 5 --nohmmonly")
+LOCAL_CMSCAN_CPU = int(os.getenv("LOCAL_CMSCAN_CPU", "1"))
+LOCAL_CMSCAN_WORKERS = int(os.getenv("LOCAL_CMSCAN_WORKERS", "2"))
+LOCAL_CMSCAN_QUEUE_SIZE = int(os.getenv("LOCAL_CMSCAN_QUEUE_SIZE", "1000"))
+LOCAL_CMSCAN_WORKDIR = os.getenv(
+    "LOCAL_CMSCAN_WORKDIR", "/tmp/rfam-batch-search/cmscan"
+)
+LOCAL_CMSCAN_RETENTION = float(os.getenv("LOCAL_CMSCAN_RETENTION", str(7 * 24 * 3600)))
+
+ARTIFACTS = ("out", "sequence", "tblout")
+
+# Ids are used as directory names, anything else is not a local job
+JOB_ID_PATTERN = re.compile(r"local_cmscan-[0-9A-Za-z-]+")
+
+
+class LocalCmscan(SearchBackend):
+    """
+    Runs cmscan on this machine. Submitted jobs wait in a bounded queue for
+    one of a fixed number of worker tasks, each running one cmscan process at
+    a time. Every job has a working directory holding its sequence, out,
+    tblout and status files, so any gunicorn worker sharing the directory can
+    report on it.
+    """
+
+    binary: str = LOCAL_CMSCAN_BIN
+    database: str = LOCAL_CMSCAN_DB
+    options: ty.List[str] = shlex.split(LOCAL_CMSCAN_OPTIONS)
+    cpu: int = LOCAL_CMSCAN_CPU
+    concurrency: int = LOCAL_CMSCAN_WORKERS
+    queue_size: int = LOCAL_CMSCAN_QUEUE_SIZE
+    workdir: str = LOCAL_CMSCAN_WORKDIR
+    retention: float = LOCAL_CMSCAN_RETENTION
+
+    queue: ty.Optional[asyncio.Queue] = None
+    workers: ty.List[asyncio.Task] = []
+    running: int = 0
+    finished: int = 0
+    failed: int = 0
+
+    @classmethod
+    async def startup(cls) -> LocalCmscan:
+        if cls.queue is None:
+            os.makedirs(cls.workdir, exist_ok=True)
+            await asyncio.to_thread(cls.prune)
+            cls.queue = asyncio.Queue(maxsize=cls.queue_size)
+            cls.workers = [
+                asyncio.create_task(cls.work()) for _ in range(cls.concurrency)
+            ]
+        return cls()
+
+    @classmethod
+    async def shutdown(cls) -> None:
+        for worker in cls.workers:
+            worker.cancel()
+        await asyncio.gather(*cls.workers, return_exceptions=True)
+        cls.workers = []
+        # Queued jobs are lost with the queue, do not leave clients waiting
+        while cls.queue is not None and not cls.queue.empty():
+            job_id, _ = cls.queue.get_nowait()
+            cls.write_status(job_id, "ERROR")
+        cls.queue = None
+
+    @classmethod
+    def stats(cls) -> ty.Dict[str, ty.Union[int, float]]:
+        return {
+            "workers": len(cls.workers),
+            "queued": cls.queue.qsize() if cls.queue else 0,
+            "queue_size": cls.queue_size,
+            "running": cls.running,
+            "finished": cls.finished,
+            "failed": cls.failed,
+        }
+
+    @classmethod
+    def job_dir(cls, job_id: str) -> ty.Optional[str]:
+        if not JOB_ID_PATTERN.fullmatch(job_id):
+            return None
+        return os.path.join(cls.workdir, job_id)
+
+    @classmethod
+    def write_status(cls, job_id: str, status: str) -> None:
+        # Written atomically, readers never see a partial status
+        directory = cls.job_dir(job_id)
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, "w") as f:
+            f.write(status)
+        os.replace(tmp, os.path.join(directory, "status"))
+
+    @classmethod
+    def prune(cls) -> None:
+        """
+        Remove the working directories of jobs older than the retention time
+        """
+        cutoff = time.time() - cls.retention
+        for entry in os.scandir(cls.workdir):
+            if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    @classmethod
+    async def work(cls) -> None:
+        while True:
+            job_id, threshold_model = await cls.queue.get()
+            cls.running += 1
+            try:
+                await cls.run_job(job_id, threshold_model)
+            except Exception as e:
+                logger.error(f"Error running cmscan job {job_id}. Error: {e}")
+            finally:
+                cls.running -= 1
+                cls.queue.task_done()
+
+    @classmethod
+    async def run_job(cls, job_id: str, threshold_model: str) -> None:
+        directory = cls.job_dir(job_id)
+        command = [
+            cls.binary,
+            "--tblout",
+            os.path.join(directory, "tblout"),
+            f"--{threshold_model}",
+            *cls.options,
+            "--cpu",
+            str(cls.cpu),
+            cls.database,
+            os.path.join(directory, "sequence"),
+        ]
+        cls.write_status(job_id, "RUNNING")
+        process = None
+        try:
+            with open(os.path.join(directory, "out"), "wb") as out, open(
+                os.path.join(directory, "stderr"), "wb"
+            ) as stderr:
+                process = await asyncio.create_subprocess_exec(
+                    *command, stdout=out, stderr=stderr
+                )
+                returncode = await process.wait()
+        except asyncio.CancelledError:
+            # Shutting down, the job will not complete
+            if process is not None and process.returncode is None:
+                process.kill()
+            cls.write_status(job_id, "ERROR")
+            raise
+        except OSError as e:
+            logger.error(f"Could not run {cls.binary} for {job_id}. Error: {e}")
+            cls.failed += 1
+            cls.write_status(job_id, "ERROR")
+            return
+
+        if returncode == 0:
+            cls.finished += 1
+            cls.write_status(job_id, "FINISHED")
+        else:
+            logger.error(f"cmscan exited with {returncode} for job {job_id}")
+            cls.failed += 1
+            cls.write_status(job_id, "FAILURE")
+
+    async def submit_cmscan_job(self, data: Query) -> str:
+        if self.queue is None or self.queue.full():
+            raise HTTPException(
+                status_code=503, detail="Too many searches queued, try again later"
+            )
+        job_id = f"local_cmscan-{time.strftime('R%Y%m%d-%H%M%S')}-{uuid.uuid4().hex}"
+        directory = self.job_dir(job_id)
+        os.makedirs(directory)
+        with open(os.path.join(directory, "sequence"), "w") as f:
+            f.write(data.sequences + "\n")
+        self.write_status(job_id, "QUEUED")
+        self.queue.put_nowait((job_id, data.threshold_model))
+        return job_id
+
+    async def cmscan_status(self, job_id: str) -> str:
+        directory = self.job_dir(job_id)
+        if directory is None:
+            return "NOT_FOUND"
+        try:
+            with open(os.path.join(directory, "status")) as f:
+                return f.read()
+        except OSError:
+            return "NOT_FOUND"
+
+    async def fetch_artifact(self, job_id: str, kind: str) -> str:
+        directory = self.job_dir(job_id)
+        if directory is None or kind not in ARTIFACTS:
+            return ""
+
+        def read() -> str:
+            try:
+                with open(os.path.join(directory, kind)) as f:
+                    return f.read()
+            except OSError:
+                return ""
+
+        # Large out files are read without blocking the event loop
+        return await asyncio.to_thread(read)
@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import contextlib
+import os
+import time
+import typing as ty
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+
+# Set by gunicorn.conf.py, each worker then writes its metrics to this
+# directory and /metrics reports the sum over all workers
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+REQUESTS = Counter(
+    "rfam_batch_requests_total",
+    "HTTP requests handled",
+    ["method", "route", "status"],
+)
+REQUEST_DURATION = Histogram(
+    "rfam_batch_request_duration_seconds",
+    "Time spent handling HTTP requests",
+    ["method", "route"],
+)
+UPSTREAM_DURATION = Histogram(
+    "rfam_batch_upstream_duration_seconds",
+    "Duration of Job Dispatcher calls",
+    ["call"],
+)
+UPSTREAM_ERRORS = Counter(
+    "rfam_batch_upstream_errors_total",
+    "Job Dispatcher calls that failed or returned an error status",
+    ["call"],
+)
+PARSE_DURATION = Histogram(
+    "rfam_batch_parse_duration_seconds",
+    "Time spent parsing cmscan results",
+    ["parser"],
+)
+REJECTED_SUBMISSIONS = Counter(
+    "rfam_batch_rejected_submissions_total",
+    "Submissions rejected with 429 by reason",
+    ["reason"],
+)
+SCHEDULED = Gauge(
+    "rfam_batch_scheduled_submissions",
+    "Submissions waiting to be sent upstream by priority class",
+    ["priority"],
+    multiprocess_mode="livesum",
+)
+SCHEDULER_WAIT = Histogram(
+    "rfam_batch_scheduler_wait_seconds",
+    "Time submissions wait before being sent upstream by priority class",
+    ["priority"],
+)
+UPLOAD_BYTES = Histogram(
+    "rfam_batch_upload_bytes",
+    "Size of accepted FASTA uploads",
+    buckets=[2**i for i in range(8, 27, 2)],
+)
+UPLOAD_SEQUENCES = Histogram(
+    "rfam_batch_upload_sequences",
+    "Number of sequences in accepted FASTA uploads",
+    buckets=[1, 10, 100, 1000, 10000],
+)
+POLLED_JOBS = Gauge(
+    "rfam_batch_polled_jobs",
+    "Jobs whose status is polled to send an email",
+    multiprocess_mode="livesum",
+)
+EMAIL_QUEUE = Gauge(
+    "rfam_batch_email_queue",
+    "Result emails waiting to be sent",
+    multiprocess_mode="livesum",
+)
+EMAILS = Counter(
+    "rfam_batch_emails_total",
+    "Result emails by outcome",
+    ["outcome"],
+)
+
+
+@contextlib.contextmanager
+def upstream_call(call: str) -> ty.Iterator[None]:
+    """
+    Time a Job Dispatcher call, counting it as an error if it raises
+    :param call: name of the call, e.g. cmscan_status
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        UPSTREAM_ERRORS.labels(call).inc()
+        raise
+    finally:
+        UPSTREAM_DURATION.labels(call).observe(time.perf_counter() - start)
+
+
+def upstream_error(call: str) -> None:
+    UPSTREAM_ERRORS.labels(call).inc()
+
+
+def render() -> ty.Tuple[bytes, str]:
+    """
+    Current metrics in the Prometheus text format, summed over all gunicorn
+    workers when running in multiprocess mode
+    :return: response body and content type
+    """
+    registry = REGISTRY
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
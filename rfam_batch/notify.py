@@ -0,0 +1,327 @@
+from __future__ import annotations
+
+import aiosmtplib
+import asyncio
+import gzip
+import json
+import os
+import random
+import sqlite3
+import time
+import typing as ty
+
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from logger import logger
+from rfam_batch import metrics
+from rfam_batch.registry import JobRegistry
+
+NOTIFY_QUEUE_SIZE = int(os.getenv("NOTIFY_QUEUE_SIZE", "10000"))
+NOTIFY_RETRIES = int(os.getenv("NOTIFY_RETRIES", "5"))
+NOTIFY_RETRY_BACKOFF = float(os.getenv("NOTIFY_RETRY_BACKOFF", "2"))
+NOTIFY_IDLE_TIMEOUT = float(os.getenv("NOTIFY_IDLE_TIMEOUT", "30"))
+NOTIFY_INLINE_MAX_BYTES = int(os.getenv("NOTIFY_INLINE_MAX_BYTES", str(1024**2)))
+NOTIFY_ATTACHMENT_MAX_BYTES = int(
+    os.getenv("NOTIFY_ATTACHMENT_MAX_BYTES", str(10 * 1024**2))
+)
+NOTIFY_DEAD_LETTER_FILE = os.getenv(
+    "NOTIFY_DEAD_LETTER_FILE", "/tmp/rfam-batch-search/notify/dead_letter.jsonl"
+)
+RESULT_BASE_URL = os.getenv("RESULT_BASE_URL", "https://batch.rfam.org")
+
+ERROR_BODY = (
+    "There was a problem while running the search. Please try "
+    "again or send us the job id if the problem persists."
+)
+
+
+class Notification:
+    def __init__(
+        self, job_id: str, email_address: str, status: str, message: MIMEMultipart
+    ) -> None:
+        self.job_id = job_id
+        self.email_address = email_address
+        self.status = status
+        self.message = message
+
+
+def is_permanent(error: Exception) -> bool:
+    """
+    Whether sending a message again cannot succeed, e.g. an unknown recipient
+    :param error: error raised while sending the message
+    :return: True for 5xx SMTP replies
+    """
+    if isinstance(error, aiosmtplib.SMTPRecipientsRefused):
+        return all(500 <= r.code < 600 for r in error.recipients)
+    if isinstance(error, aiosmtplib.SMTPResponseException):
+        return 500 <= error.code < 600
+    return False
+
+
+class Notifier:
+    """
+    Sends the result emails from one task per worker, over a single SMTP
+    connection reused while messages keep coming and closed once idle, so a
+    burst of finished jobs does not open a burst of connections. Messages
+    wait in a bounded queue, failed sends are retried with a jittered
+    exponential backoff and messages that cannot be sent are appended to a
+    dead-letter log.
+
+    With a registry, an email is recorded as sent only once the SMTP server
+    accepted it. Emails that could not be sent yet, because the queue was
+    full, the server kept failing or the worker stopped, are left pending for
+    any worker to send again instead of being dead-lettered.
+    """
+
+    def __init__(
+        self,
+        sender: ty.Optional[str],
+        hostname: ty.Optional[str],
+        port: ty.Optional[int],
+        queue_size: int = NOTIFY_QUEUE_SIZE,
+        retries: int = NOTIFY_RETRIES,
+        retry_backoff: float = NOTIFY_RETRY_BACKOFF,
+        idle_timeout: float = NOTIFY_IDLE_TIMEOUT,
+        inline_max_bytes: int = NOTIFY_INLINE_MAX_BYTES,
+        attachment_max_bytes: int = NOTIFY_ATTACHMENT_MAX_BYTES,
+        dead_letter_file: str = NOTIFY_DEAD_LETTER_FILE,
+        result_base_url: str = RESULT_BASE_URL,
+        registry: ty.Optional[JobRegistry] = None,
+    ) -> None:
+        self.sender = sender
+        self.hostname = hostname
+        self.port = port
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.idle_timeout = idle_timeout
+        self.inline_max_bytes = inline_max_bytes
+        self.attachment_max_bytes = attachment_max_bytes
+        self.dead_letter_file = dead_letter_file
+        self.result_base_url = result_base_url.rstrip("/")
+        self.registry = registry
+        self.queue: asyncio.Queue[Notification] = asyncio.Queue(maxsize=queue_size)
+        self.smtp: ty.Optional[aiosmtplib.SMTP] = None
+        self.task: ty.Optional[asyncio.Task] = None
+        self.sent = 0
+        self.failed = 0
+        self.deferred = 0
+        self.connections = 0
+
+    @classmethod
+    def from_env(cls, registry: ty.Optional[JobRegistry] = None) -> Notifier:
+        # Read when the app is created, after the .env file has been loaded
+        port = os.getenv("PORT")
+        return cls(
+            sender=os.getenv("EMAIL"),
+            hostname=os.getenv("SERVER"),
+            port=int(port) if port else None,
+            registry=registry,
+        )
+
+    def message(
+        self, job_id: str, email_address: str, status: str, tblout: str
+    ) -> MIMEMultipart:
+        """
+        Email sent once a job is done, with its tblout file
+        :param job_id: ID of the job
+        :param email_address: recipient
+        :param status: terminal status of the job
+        :param tblout: tblout file of a finished job
+        :return: message, the tblout is inline if small, otherwise attached
+        compressed or, if still too large, linked
+        """
+        msg = MIMEMultipart()
+        msg["From"] = self.sender
+        msg["To"] = email_address
+
+        if status != "FINISHED":
+            msg["Subject"] = f"Error in batch search job {job_id}"
+            msg.attach(MIMEText(ERROR_BODY, "plain"))
+            return msg
+
+        msg["Subject"] = f"Results for batch search job {job_id}"
+        data = tblout.encode()
+        if len(data) <= self.inline_max_bytes:
+            msg.attach(MIMEText(tblout, "plain"))
+            return msg
+
+        compressed = gzip.compress(data, compresslevel=6)
+        if len(compressed) <= self.attachment_max_bytes:
+            msg.attach(MIMEText("The results of the search are attached.", "plain"))
+            attachment = MIMEApplication(compressed, "gzip")
+            attachment.add_header(
+                "Content-Disposition", "attachment", filename=f"{job_id}.tblout.gz"
+            )
+            msg.attach(attachment)
+        else:
+            url = f"{self.result_base_url}/result/{job_id}/tblout"
+            msg.attach(
+                MIMEText(f"The results of the search are available at {url}", "plain")
+            )
+        return msg
+
+    async def enqueue(
+        self, job_id: str, email_address: str, status: str, tblout: str = ""
+    ) -> bool:
+        """
+        Queue the email of a job
+        :return: False if the queue is full and the email was not queued
+        """
+        # Compressing a large tblout would stall the event loop
+        if len(tblout) > self.inline_max_bytes:
+            msg = await asyncio.to_thread(
+                self.message, job_id, email_address, status, tblout
+            )
+        else:
+            msg = self.message(job_id, email_address, status, tblout)
+        notification = Notification(job_id, email_address, status, msg)
+        try:
+            self.queue.put_nowait(notification)
+        except asyncio.QueueFull:
+            self.defer(notification, "queue full")
+            return False
+        metrics.EMAIL_QUEUE.set(self.queue.qsize())
+        return True
+
+    async def connection(self) -> aiosmtplib.SMTP:
+        if self.smtp is None or not self.smtp.is_connected:
+            smtp = aiosmtplib.SMTP(hostname=self.hostname, port=self.port)
+            await smtp.connect()
+            self.smtp = smtp
+            self.connections += 1
+        return self.smtp
+
+    async def disconnect(self) -> None:
+        smtp, self.smtp = self.smtp, None
+        if smtp is None or not smtp.is_connected:
+            return
+        try:
+            await smtp.quit()
+        except (aiosmtplib.SMTPException, OSError):
+            smtp.close()
+
+    async def send(self, notification: Notification) -> None:
+        for attempt in range(self.retries + 1):
+            try:
+                smtp = await self.connection()
+                await smtp.send_message(notification.message)
+            except (aiosmtplib.SMTPException, OSError, asyncio.TimeoutError) as e:
+                logger.error(
+                    f"Error sending email for {notification.job_id}, "
+                    f"attempt {attempt + 1}. Error: {e}"
+                )
+                if is_permanent(e):
+                    self.dead_letter(notification, str(e))
+                    self.release(notification, "failed")
+                    return
+                if attempt == self.retries:
+                    self.defer(notification, str(e))
+                    return
+                # The connection may be broken, open a new one for the retry
+                await self.disconnect()
+                await asyncio.sleep(
+                    random.uniform(0, self.retry_backoff * 2**attempt)
+                )
+            else:
+                self.sent += 1
+                metrics.EMAILS.labels("sent").inc()
+                self.release(notification, "sent")
+                return
+
+    def release(self, notification: Notification, notify_state: str) -> None:
+        if self.registry is not None:
+            job_id = notification.job_id
+            try:
+                self.registry.release(job_id, notification.email_address, notify_state)
+            except sqlite3.Error as e:
+                logger.error(f"Error releasing {job_id}. Error: {e}")
+
+    def defer(self, notification: Notification, reason: str) -> None:
+        """
+        Give up sending an email for now, it is sent again later if the
+        registry keeps it pending, otherwise it is dead-lettered
+        :param notification: email not sent
+        :param reason: why it was not sent
+        """
+        if self.registry is None:
+            self.dead_letter(notification, reason)
+            return
+        try:
+            self.registry.requeue(notification.job_id, notification.email_address)
+        except sqlite3.Error as e:
+            logger.error(f"Error requeueing {notification.job_id}. Error: {e}")
+            self.dead_letter(notification, reason)
+            return
+        self.deferred += 1
+        metrics.EMAILS.labels("deferred").inc()
+        logger.warning(
+            f"Email for {notification.job_id} not sent yet, left pending: {reason}"
+        )
+
+    def dead_letter(self, notification: Notification, reason: str) -> None:
+        self.failed += 1
+        metrics.EMAILS.labels("failed").inc()
+        logger.error(
+            f"Email for {notification.job_id} to {notification.email_address} "
+            f"not sent: {reason}"
+        )
+        record = {
+            "time": time.time(),
+            "job_id": notification.job_id,
+            "email_address": notification.email_address,
+            "status": notification.status,
+            "reason": reason,
+        }
+        try:
+            os.makedirs(os.path.dirname(self.dead_letter_file), exist_ok=True)
+            # Lines appended in one write do not interleave between workers
+            with open(self.dead_letter_file, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError as e:
+            logger.error(f"Error writing dead-letter log. Error: {e}")
+
+    async def run(self) -> None:
+        while True:
+            try:
+                notification = await asyncio.wait_for(
+                    self.queue.get(), timeout=self.idle_timeout
+                )
+            except asyncio.TimeoutError:
+                await self.disconnect()
+                continue
+            try:
+                await self.send(notification)
+            except asyncio.CancelledError:
+                self.defer(notification, "shutdown")
+                raise
+            except Exception as e:
+                logger.error(f"Error in notifier. Error: {e}")
+            metrics.EMAIL_QUEUE.set(self.queue.qsize())
+
+    async def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.task = None
+        await self.disconnect()
+        # Emails still queued would otherwise be lost without a trace
+        while not self.queue.empty():
+            self.defer(self.queue.get_nowait(), "shutdown")
+        metrics.EMAIL_QUEUE.set(0)
+
+    def stats(self) -> ty.Dict[str, int]:
+        return {
+            "queued": self.queue.qsize(),
+            "sent": self.sent,
+            "failed": self.failed,
+            "deferred": self.deferred,
+            "connections": self.connections,
+        }
@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import sqlite3
+import time
+import typing as ty
+import uuid
+
+from logger import logger
+from rfam_batch import metrics
+from rfam_batch.registry import JobRegistry, lease_owner
+
+POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", "10"))
+POLL_MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL", "300"))
+POLL_BACKOFF = float(os.getenv("POLL_BACKOFF", "0.1"))
+POLL_MAX_LIFETIME = float(os.getenv("POLL_MAX_LIFETIME", str(7 * 24 * 3600)))
+POLL_CONCURRENCY = int(os.getenv("POLL_CONCURRENCY", "10"))
+POLL_BATCH_SIZE = int(os.getenv("POLL_BATCH_SIZE", "100"))
+POLL_LEASE = float(os.getenv("POLL_LEASE", "60"))
+
+TERMINAL_STATUSES = {"FINISHED", "FAILURE", "ERROR", "NOT_FOUND"}
+
+
+class PendingJob:
+    def __init__(
+        self, job_id: str, email_address: str, submitted_at: float, next_poll: float
+    ) -> None:
+        self.job_id = job_id
+        self.email_address = email_address
+        self.submitted_at = submitted_at
+        self.next_poll = next_poll
+
+
+class StatusPoller:
+    """
+    Polls the status of all pending jobs from a single task, once for each
+    address their results are sent to. Due jobs are polled in batches with
+    bounded concurrency, the polling interval grows with the age of the job,
+    and jobs are dropped after a maximum lifetime. Jobs reaching a terminal
+    status are handed to on_done, which releases them in the registry once
+    their email is sent and returns whether it took the job over.
+
+    With a registry, each pending email is leased to the worker polling its
+    job and the lease is renewed while the worker runs. Emails whose lease
+    expired, because their worker stopped, are taken over by another worker,
+    so they are still sent after a restart.
+    """
+
+    def __init__(
+        self,
+        fetch_status: ty.Callable[[str], ty.Awaitable[str]],
+        on_done: ty.Callable[[PendingJob, str], ty.Awaitable[bool]],
+        interval: float = POLL_INTERVAL,
+        max_interval: float = POLL_MAX_INTERVAL,
+        backoff: float = POLL_BACKOFF,
+        max_lifetime: float = POLL_MAX_LIFETIME,
+        concurrency: int = POLL_CONCURRENCY,
+        batch_size: int = POLL_BATCH_SIZE,
+        registry: ty.Optional[JobRegistry] = None,
+        lease: float = POLL_LEASE,
+    ) -> None:
+        self.fetch_status = fetch_status
+        self.on_done = on_done
+        self.interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.max_lifetime = max_lifetime
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.registry = registry
+        self.lease = lease
+        self.next_resume = 0.0
+        self.instance = uuid.uuid4().hex[:8]
+        # (job id, email address) -> job
+        self.jobs: ty.Dict[ty.Tuple[str, str], PendingJob] = {}
+        self.task: ty.Optional[asyncio.Task] = None
+        self.wakeup = asyncio.Event()
+
+    @property
+    def owner(self) -> str:
+        return lease_owner(self.instance)
+
+    def add(self, job_id: str, email_address: str) -> None:
+        now = time.time()
+        job = PendingJob(job_id, email_address, now, now + self.interval)
+        self.jobs[job_id, email_address] = job
+        metrics.POLLED_JOBS.set(len(self.jobs))
+        if self.registry is not None:
+            try:
+                self.registry.watch(job_id, email_address, self.owner, self.lease)
+            except sqlite3.Error as e:
+                logger.error(f"Error registering email for {job_id}. Error: {e}")
+        self.wakeup.set()
+
+    def release(self, job_id: str, email_address: str, notify_state: str) -> None:
+        if self.registry is not None:
+            try:
+                self.registry.release(job_id, email_address, notify_state)
+            except sqlite3.Error as e:
+                logger.error(f"Error releasing {job_id}. Error: {e}")
+
+    def requeue(self, job_id: str, email_address: str) -> None:
+        if self.registry is not None:
+            try:
+                self.registry.requeue(job_id, email_address)
+            except sqlite3.Error as e:
+                logger.error(f"Error requeueing {job_id}. Error: {e}")
+
+    def resume(self, now: ty.Optional[float] = None) -> int:
+        """
+        Renew the leases of the jobs polled here and take over the jobs of
+        workers that went away
+        :param now: current time, defaults to time.time()
+        :return: number of jobs taken over
+        """
+        now = time.time() if now is None else now
+        self.next_resume = now + self.lease / 3
+        if self.registry is None:
+            return 0
+        try:
+            self.registry.renew(self.owner, self.lease)
+            claimed = self.registry.claim(self.owner, self.lease, self.batch_size)
+        except sqlite3.Error as e:
+            logger.error(f"Error resuming pending jobs. Error: {e}")
+            return 0
+        for job in claimed:
+            logger.info(f"Resumed polling {job.job_id}")
+            self.jobs[job.job_id, job.email_address] = PendingJob(
+                job.job_id, job.email_address, job.submitted_at, now
+            )
+        metrics.POLLED_JOBS.set(len(self.jobs))
+        return len(claimed)
+
+    def interval_for(self, age: float) -> float:
+        """
+        Young jobs are polled every interval seconds, older ones less often
+        :param age: seconds since the job was submitted
+        :return: seconds until the next poll
+        """
+        return min(self.max_interval, max(self.interval, age * self.backoff))
+
+    async def poll_job(self, job: PendingJob, semaphore: asyncio.Semaphore) -> None:
+        async with semaphore:
+            try:
+                status = await self.fetch_status(job.job_id)
+            except Exception as e:
+                logger.error(f"Error polling status of {job.job_id}. Error: {e}")
+                status = ""
+
+        now = time.time()
+        # Checked first, so a job whose email keeps failing is not resumed
+        # forever
+        expired = now - job.submitted_at > self.max_lifetime
+        if status in TERMINAL_STATUSES and not expired:
+            self.jobs.pop((job.job_id, job.email_address), None)
+            try:
+                taken = await self.on_done(job, status)
+            except Exception as e:
+                logger.error(f"Error handling {status} job {job.job_id}. Error: {e}")
+                taken = False
+            if not taken:
+                # Left pending, any worker tries again once it resumes jobs
+                logger.warning(f"Email for {job.job_id} not queued, left pending")
+                self.requeue(job.job_id, job.email_address)
+        elif expired:
+            self.jobs.pop((job.job_id, job.email_address), None)
+            logger.warning(f"Stopped polling {job.job_id}, last status: {status}")
+            self.release(job.job_id, job.email_address, "expired")
+        else:
+            job.next_poll = now + self.interval_for(now - job.submitted_at)
+
+    async def poll_due(self, now: ty.Optional[float] = None) -> int:
+        """
+        Poll one batch of the jobs that are due
+        :param now: current time, defaults to time.time()
+        :return: number of jobs polled
+        """
+        now = time.time() if now is None else now
+        due = [job for job in self.jobs.values() if job.next_poll <= now]
+        due.sort(key=lambda job: job.next_poll)
+        batch = due[: self.batch_size]
+        semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(*[self.poll_job(job, semaphore) for job in batch])
+        metrics.POLLED_JOBS.set(len(self.jobs))
+        return len(batch)
+
+    async def run(self) -> None:
+        while True:
+            if time.time() >= self.next_resume:
+                self.resume()
+            try:
+                polled = await self.poll_due()
+            except Exception as e:
+                logger.error(f"Error in status poller. Error: {e}")
+                polled = 0
+            if polled == self.batch_size:
+                # More jobs may be due, poll the next batch straight away
+                continue
+
+            self.wakeup.clear()
+            delay = self.max_interval
+            if self.jobs:
+                next_poll = min(job.next_poll for job in self.jobs.values())
+                delay = min(delay, max(0.0, next_poll - time.time()))
+            if self.registry is not None:
+                delay = min(delay, max(0.0, self.next_resume - time.time()))
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.task = None
@@ -0,0 +1,578 @@
+from __future__ import annotations
+
+import contextlib
+import json
+import os
+import socket
+import sqlite3
+import time
+import typing as ty
+import uuid
+
+JOB_REGISTRY_PATH = os.getenv(
+    "JOB_REGISTRY_PATH", "/tmp/rfam-batch-search/registry.sqlite3"
+)
+# Seconds a write waits for another worker's transaction. Registry calls run
+# on the event loop, so a long wait would stall every request of the worker.
+JOB_REGISTRY_BUSY_TIMEOUT = float(os.getenv("JOB_REGISTRY_BUSY_TIMEOUT", "0.5"))
+
+# Statuses after which a job cannot be reused by an identical submission
+FAILED_STATUSES = ("FAILURE", "ERROR", "NOT_FOUND")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    parent_id TEXT,
+    position INTEGER,
+    content_hash TEXT,
+    status TEXT,
+    error TEXT,
+    submitted_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_content_hash ON jobs (content_hash, submitted_at);
+CREATE INDEX IF NOT EXISTS jobs_parent_id ON jobs (parent_id, position);
+CREATE TABLE IF NOT EXISTS notifications (
+    job_id TEXT NOT NULL,
+    email_address TEXT NOT NULL,
+    submitted_at REAL NOT NULL,
+    notify_state TEXT NOT NULL,
+    lease_owner TEXT,
+    lease_until REAL,
+    PRIMARY KEY (job_id, email_address)
+);
+CREATE INDEX IF NOT EXISTS notifications_notify_state
+    ON notifications (notify_state, lease_until);
+CREATE TABLE IF NOT EXISTS transitions (
+    job_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transitions_job_id ON transitions (job_id, at);
+CREATE TABLE IF NOT EXISTS scheduled (
+    job_id TEXT PRIMARY KEY,
+    priority TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    enqueued_at REAL NOT NULL,
+    submitted TEXT,
+    lease_owner TEXT,
+    lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS scheduled_lease_until ON scheduled (lease_until);
+CREATE TABLE IF NOT EXISTS artifacts (
+    job_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    location TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    stored_at REAL NOT NULL,
+    PRIMARY KEY (job_id, kind)
+);
+CREATE TABLE IF NOT EXISTS rate_buckets (
+    client TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rate_buckets_updated ON rate_buckets (updated);
+CREATE TABLE IF NOT EXISTS upstream_slots (
+    slot_id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    lease_until REAL NOT NULL
+);
+"""
+
+
+def lease_owner(instance: str) -> str:
+    """
+    Name of the worker holding leases in the registry
+    :param instance: random ID of the object taking the leases, so it is unique
+    even if the object was created before gunicorn forked
+    :return: host, process and instance
+    """
+    return f"{socket.gethostname()}-{os.getpid()}-{instance}"
+
+
+class PendingNotification(ty.NamedTuple):
+    job_id: str
+    email_address: str
+    submitted_at: float
+
+
+class ScheduledSubmission(ty.NamedTuple):
+    job_id: str
+    priority: str
+    payload: bytes
+    enqueued_at: float
+    submitted: ty.Dict[int, str]
+
+
+class JobRegistry:
+    """
+    Jobs submitted through this service, kept in a SQLite database in WAL mode
+    shared by every gunicorn worker and surviving restarts: the content hash
+    and child jobs of each submission, its status transitions, where its
+    results are stored and, for each email address the results are sent to,
+    which worker polls the job to send the email. A job reused by identical
+    submissions is sent to every address it was submitted with.
+    Submissions not yet sent upstream are kept until they are, leased to the
+    worker that will send them. The token bucket of each client and the
+    submissions in flight upstream are counted here too, so their limits
+    hold across workers.
+    """
+
+    def __init__(
+        self, path: str, busy_timeout: float = JOB_REGISTRY_BUSY_TIMEOUT
+    ) -> None:
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._db: ty.Optional[sqlite3.Connection] = None
+        self._pid: ty.Optional[int] = None
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db.executescript(SCHEMA)
+
+    @classmethod
+    def from_env(cls) -> JobRegistry:
+        return cls(JOB_REGISTRY_PATH)
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        # Connections must not be shared with processes forked by gunicorn
+        if self._db is None or self._pid != os.getpid():
+            # The app is created in another thread than the event loop runs
+            # in under the test client, and sqlite3 serializes calls on a
+            # shared connection. Transactions are short, a write finding the
+            # database locked for longer fails with sqlite3.OperationalError.
+            db = sqlite3.connect(
+                self.path,
+                timeout=self.busy_timeout,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            db.execute("PRAGMA journal_mode=WAL")
+            # Safe in WAL mode, only the last transactions may be lost on a
+            # power failure
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._db, self._pid = db, os.getpid()
+        return self._db
+
+    @contextlib.contextmanager
+    def transaction(self) -> ty.Iterator[sqlite3.Connection]:
+        # Take the write lock from the start, a read upgraded to a write
+        # would fail straight away if another worker is writing
+        db = self.db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def register(
+        self,
+        job_id: str,
+        content_hash: ty.Optional[str] = None,
+        children: ty.Optional[ty.List[str]] = None,
+    ) -> None:
+        """
+        Record a submission
+        :param job_id: ID of the job, a parent job id if split
+        :param content_hash: content address of the submission
+        :param children: ids of the child jobs of a parent job, in order
+        """
+        with self.transaction() as db:
+            self._register(db, job_id, content_hash, children)
+
+    @staticmethod
+    def _register(
+        db: sqlite3.Connection,
+        job_id: str,
+        content_hash: ty.Optional[str],
+        children: ty.Optional[ty.List[str]],
+    ) -> None:
+        now = time.time()
+        rows = [(job_id, None, None, content_hash)]
+        rows += [(child, job_id, i, None) for i, child in enumerate(children or [])]
+        db.executemany(
+            "INSERT INTO jobs (job_id, parent_id, position, content_hash, "
+            "submitted_at, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (job_id) DO UPDATE SET "
+            "content_hash = coalesce(excluded.content_hash, content_hash)",
+            [row + (now, now) for row in rows],
+        )
+
+    def children(self, parent_id: str) -> ty.Optional[ty.List[str]]:
+        """
+        Child jobs of a parent job
+        :param parent_id: ID of the parent job
+        :return: ids of the child jobs, or None for an unknown parent
+        """
+        rows = self.db.execute(
+            "SELECT job_id FROM jobs WHERE parent_id = ? ORDER BY position",
+            (parent_id,),
+        ).fetchall()
+        return [row[0] for row in rows] or None
+
+    def reusable(self, content_hash: str, ttl: float) -> ty.Optional[str]:
+        """
+        Latest job that searched the same content, if recent and not failed
+        :param content_hash: content address of the submission
+        :param ttl: seconds during which a job can be reused
+        :return: ID of the job, or None
+        """
+        row = self.db.execute(
+            "SELECT job_id FROM jobs WHERE content_hash = ? AND submitted_at > ? "
+            f"AND coalesce(status, '') NOT IN ({','.join('?' * len(FAILED_STATUSES))}) "
+            "ORDER BY submitted_at DESC LIMIT 1",
+            (content_hash, time.time() - ttl, *FAILED_STATUSES),
+        ).fetchone()
+        return row[0] if row else None
+
+    def forget_content(self, content_hash: str) -> None:
+        # The jobs are kept, only their reuse is prevented
+        with self.transaction() as db:
+            db.execute(
+                "UPDATE jobs SET content_hash = NULL WHERE content_hash = ?",
+                (content_hash,),
+            )
+
+    def status(self, job_id: str) -> ty.Optional[str]:
+        row = self.db.execute(
+            "SELECT status FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def record_status(
+        self, job_id: str, status: str, error: ty.Optional[str] = None
+    ) -> bool:
+        """
+        Record the status of a registered job if it changed
+        :param job_id: ID of the job
+        :param status: latest status
+        :param error: why the job failed, e.g. Job Dispatcher rejecting it
+        :return: True if a transition was recorded
+        """
+        row = self.db.execute(
+            "SELECT status FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        # Reads do not wait for writers, so only changes take the write lock
+        if row is None or row[0] == status:
+            return False
+        now = time.time()
+        with self.transaction() as db:
+            cursor = db.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? "
+                "WHERE job_id = ? AND status IS NOT ?",
+                (status, error, now, job_id, status),
+            )
+            if cursor.rowcount == 0:
+                # Recorded by another worker in the meantime
+                return False
+            db.execute(
+                "INSERT INTO transitions (job_id, status, at) VALUES (?, ?, ?)",
+                (job_id, status, now),
+            )
+        return True
+
+    def record_artifact(self, job_id: str, kind: str, location: str, size: int) -> None:
+        with self.transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO artifacts "
+                "(job_id, kind, location, size, stored_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, kind, location, size, time.time()),
+            )
+
+    def job(self, job_id: str) -> ty.Optional[ty.Dict]:
+        """
+        Everything recorded about a job
+        :param job_id: ID of the job
+        :return: job, with its children, transitions, artifacts and emails, or
+        None
+        """
+        # Rows as dicts for this cursor only, the connection is shared
+        cursor = self.db.cursor()
+        cursor.row_factory = sqlite3.Row
+        row = cursor.execute(
+            "SELECT job_id, parent_id, content_hash, status, error, "
+            "submitted_at, updated_at FROM jobs WHERE job_id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["children"] = self.children(job_id) or []
+        job["transitions"] = [
+            dict(r)
+            for r in cursor.execute(
+                "SELECT status, at FROM transitions WHERE job_id = ? ORDER BY at",
+                (job_id,),
+            ).fetchall()
+        ]
+        job["artifacts"] = {
+            r["kind"]: {k: r[k] for k in ("location", "size", "stored_at")}
+            for r in cursor.execute(
+                "SELECT kind, location, size, stored_at FROM artifacts "
+                "WHERE job_id = ?",
+                (job_id,),
+            ).fetchall()
+        }
+        job["notifications"] = [
+            dict(r)
+            for r in cursor.execute(
+                "SELECT email_address, notify_state FROM notifications "
+                "WHERE job_id = ? ORDER BY submitted_at",
+                (job_id,),
+            ).fetchall()
+        ]
+        return job
+
+    def watch(self, job_id: str, email_address: str, owner: str, lease: float) -> None:
+        """
+        Record that the email of a job to an address is pending, polled by
+        owner
+        :param job_id: ID of the job
+        :param email_address: recipient of the email
+        :param owner: worker polling the job
+        :param lease: seconds before another worker may take the job over
+        """
+        now = time.time()
+        with self.transaction() as db:
+            db.execute(
+                "INSERT INTO jobs (job_id, submitted_at, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (job_id) DO NOTHING",
+                (job_id, now, now),
+            )
+            db.execute(
+                "INSERT INTO notifications (job_id, email_address, submitted_at, "
+                "notify_state, lease_owner, lease_until) "
+                "VALUES (?, ?, ?, 'pending', ?, ?) "
+                "ON CONFLICT (job_id, email_address) DO UPDATE SET "
+                "notify_state = 'pending', lease_owner = excluded.lease_owner, "
+                "lease_until = excluded.lease_until",
+                (job_id, email_address, now, owner, now + lease),
+            )
+
+    def claim(
+        self, owner: str, lease: float, limit: int
+    ) -> ty.List[PendingNotification]:
+        """
+        Take over pending emails whose polling worker went away
+        :param owner: worker claiming the emails
+        :param lease: seconds before another worker may take them over
+        :param limit: most emails claimed at once
+        :return: claimed emails
+        """
+        now = time.time()
+        # Other workers wait for the transaction, so an email is claimed once
+        with self.transaction() as db:
+            rows = db.execute(
+                "SELECT job_id, email_address, submitted_at FROM notifications "
+                "WHERE notify_state = 'pending' AND lease_until < ? LIMIT ?",
+                (now, limit),
+            ).fetchall()
+            db.executemany(
+                "UPDATE notifications SET lease_owner = ?, lease_until = ? "
+                "WHERE job_id = ? AND email_address = ?",
+                [(owner, now + lease, row[0], row[1]) for row in rows],
+            )
+        return [PendingNotification(*row) for row in rows]
+
+    def renew(self, owner: str, lease: float) -> None:
+        with self.transaction() as db:
+            db.execute(
+                "UPDATE notifications SET lease_until = ? "
+                "WHERE notify_state = 'pending' AND lease_owner = ?",
+                (time.time() + lease, owner),
+            )
+
+    def release(self, job_id: str, email_address: str, notify_state: str) -> None:
+        """
+        Record that the email of a job to an address is no longer pending
+        :param job_id: ID of the job
+        :param email_address: recipient of the email
+        :param notify_state: sent, failed or expired
+        """
+        with self.transaction() as db:
+            db.execute(
+                "UPDATE notifications SET notify_state = ?, lease_owner = NULL, "
+                "lease_until = NULL WHERE job_id = ? AND email_address = ?",
+                (notify_state, job_id, email_address),
+            )
+
+    def requeue(self, job_id: str, email_address: str) -> None:
+        """
+        Keep the email of a job to an address pending and let any worker take
+        it over at once, e.g. when it could not be sent yet
+        :param job_id: ID of the job
+        :param email_address: recipient of the email
+        """
+        with self.transaction() as db:
+            db.execute(
+                "UPDATE notifications SET lease_owner = NULL, lease_until = 0 "
+                "WHERE job_id = ? AND email_address = ? AND notify_state = 'pending'",
+                (job_id, email_address),
+            )
+
+    def schedule(
+        self, job_id: str, priority: str, payload: bytes, owner: str, lease: float
+    ) -> None:
+        """
+        Keep a submission until it is sent upstream
+        :param job_id: local ID of the job
+        :param priority: priority class of the submission
+        :param payload: search parameters and sequences
+        :param owner: worker that will send it
+        :param lease: seconds before another worker may take it over
+        """
+        now = time.time()
+        with self.transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO scheduled (job_id, priority, payload, "
+                "enqueued_at, lease_owner, lease_until) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, priority, payload, now, owner, now + lease),
+            )
+
+    def unschedule(self, job_id: str) -> None:
+        with self.transaction() as db:
+            db.execute("DELETE FROM scheduled WHERE job_id = ?", (job_id,))
+
+    def record_submitted(self, job_id: str, position: int, upstream_id: str) -> None:
+        """
+        Record a chunk of a scheduled submission sent upstream, so a worker
+        taking the submission over does not send it again
+        :param job_id: local ID of the job
+        :param position: position of the chunk in the submission
+        :param upstream_id: ID of the upstream job searching the chunk
+        """
+        with self.transaction() as db:
+            row = db.execute(
+                "SELECT submitted FROM scheduled WHERE job_id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return
+            submitted = json.loads(row[0] or "{}")
+            submitted[str(position)] = upstream_id
+            db.execute(
+                "UPDATE scheduled SET submitted = ? WHERE job_id = ?",
+                (json.dumps(submitted), job_id),
+            )
+
+    def finish_scheduled(self, job_id: str, children: ty.List[str]) -> None:
+        """
+        Map a scheduled submission to the upstream jobs it was sent as and
+        stop keeping it, at once so it is never sent again
+        :param job_id: local ID of the job
+        :param children: ids of the upstream jobs, in order
+        """
+        with self.transaction() as db:
+            self._register(db, job_id, None, children)
+            db.execute("DELETE FROM scheduled WHERE job_id = ?", (job_id,))
+
+    def claim_scheduled(
+        self, owner: str, lease: float, limit: int
+    ) -> ty.List[ScheduledSubmission]:
+        """
+        Take over submissions whose worker went away before sending them
+        :param owner: worker claiming the submissions
+        :param lease: seconds before another worker may take them over
+        :param limit: most submissions claimed at once
+        :return: claimed submissions, oldest first
+        """
+        now = time.time()
+        with self.transaction() as db:
+            rows = db.execute(
+                "SELECT job_id, priority, payload, enqueued_at, submitted "
+                "FROM scheduled WHERE lease_until < ? ORDER BY enqueued_at LIMIT ?",
+                (now, limit),
+            ).fetchall()
+            db.executemany(
+                "UPDATE scheduled SET lease_owner = ?, lease_until = ? "
+                "WHERE job_id = ?",
+                [(owner, now + lease, row[0]) for row in rows],
+            )
+        return [
+            ScheduledSubmission(
+                *row[:4],
+                {int(k): v for k, v in json.loads(row[4] or "{}").items()},
+            )
+            for row in rows
+        ]
+
+    def renew_scheduled(self, owner: str, lease: float) -> None:
+        with self.transaction() as db:
+            db.execute(
+                "UPDATE scheduled SET lease_until = ? WHERE lease_owner = ?",
+                (time.time() + lease, owner),
+            )
+
+    def take_token(
+        self, client: str, rate: float, burst: float, now: ty.Optional[float] = None
+    ) -> float:
+        """
+        Take a token from the bucket of a client, refilled at rate tokens per
+        second up to burst tokens
+        :param client: key of the client, e.g. its address
+        :param rate: tokens added per second
+        :param burst: most tokens in a bucket
+        :param now: current time, defaults to time.time()
+        :return: 0 if a token was taken, otherwise seconds until there is one
+        """
+        now = time.time() if now is None else now
+        with self.transaction() as db:
+            # A bucket left alone for burst / rate seconds is full again, the
+            # same as a missing one, so only those are dropped
+            db.execute(
+                "DELETE FROM rate_buckets WHERE updated < ?", (now - burst / rate,)
+            )
+            row = db.execute(
+                "SELECT tokens, updated FROM rate_buckets WHERE client = ?", (client,)
+            ).fetchone()
+            tokens = burst
+            if row is not None:
+                tokens = min(burst, row[0] + max(0.0, now - row[1]) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            db.execute(
+                "INSERT OR REPLACE INTO rate_buckets (client, tokens, updated) "
+                "VALUES (?, ?, ?)",
+                (client, tokens, now),
+            )
+        return wait
+
+    def acquire_slot(self, owner: str, limit: int, lease: float) -> ty.Optional[str]:
+        """
+        Take one of the limit slots shared by every worker
+        :param owner: worker taking the slot
+        :param limit: most slots taken at once
+        :param lease: seconds after which the slot of a worker that went away
+        is free again
+        :return: ID of the slot, or None if they are all taken
+        """
+        now = time.time()
+        with self.transaction() as db:
+            db.execute("DELETE FROM upstream_slots WHERE lease_until < ?", (now,))
+            (taken,) = db.execute("SELECT count(*) FROM upstream_slots").fetchone()
+            if taken >= limit:
+                return None
+            slot_id = uuid.uuid4().hex
+            db.execute(
+                "INSERT INTO upstream_slots (slot_id, owner, lease_until) "
+                "VALUES (?, ?, ?)",
+                (slot_id, owner, now + lease),
+            )
+        return slot_id
+
+    def release_slot(self, slot_id: str) -> None:
+        with self.transaction() as db:
+            db.execute("DELETE FROM upstream_slots WHERE slot_id = ?", (slot_id,))
+
+    def slots_taken(self) -> int:
+        (taken,) = self.db.execute(
+            "SELECT count(*) FROM upstream_slots WHERE lease_until >= ?",
+            (time.time(),),
+        ).fetchone()
+        return taken
@@ -0,0 +1,322 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import typing as ty
+import uuid
+
+from collections import deque
+from logger import logger
+from rfam_batch import metrics
+from rfam_batch.admission import too_many_requests
+from rfam_batch.job_dispatcher import Query
+from rfam_batch.registry import JobRegistry, lease_owner
+
+SUBMIT_CONCURRENCY = int(os.getenv("SUBMIT_CONCURRENCY", "8"))
+SUBMIT_QUEUE_SIZE = int(os.getenv("SUBMIT_QUEUE_SIZE", "1000"))
+SCHEDULER_INTERACTIVE_MAX_SEQUENCES = int(
+    os.getenv("SCHEDULER_INTERACTIVE_MAX_SEQUENCES", "1")
+)
+SCHEDULER_INTERACTIVE_WEIGHT = int(os.getenv("SCHEDULER_INTERACTIVE_WEIGHT", "4"))
+SCHEDULER_BULK_WEIGHT = int(os.getenv("SCHEDULER_BULK_WEIGHT", "1"))
+# Tasks of SUBMIT_CONCURRENCY only sending interactive submissions
+SCHEDULER_INTERACTIVE_TASKS = int(os.getenv("SCHEDULER_INTERACTIVE_TASKS", "2"))
+SCHEDULER_LEASE = float(os.getenv("SCHEDULER_LEASE", "60"))
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+
+def priority_class(
+    num_sequences: int,
+    email_address: ty.Optional[str],
+    interactive_max_sequences: int = SCHEDULER_INTERACTIVE_MAX_SEQUENCES,
+) -> str:
+    """
+    Priority class of a submission
+    :param num_sequences: number of sequences submitted
+    :param email_address: address the results are sent to, if any
+    :param interactive_max_sequences: most sequences of an interactive search
+    :return: interactive for small searches someone is waiting for, otherwise
+    bulk
+    """
+    if num_sequences <= interactive_max_sequences and not email_address:
+        return INTERACTIVE
+    return BULK
+
+
+class Submission:
+    def __init__(
+        self,
+        job_id: str,
+        priority: str,
+        query: Query,
+        sequences: ty.List[str],
+        enqueued_at: ty.Optional[float] = None,
+        submitted: ty.Optional[ty.Dict[int, str]] = None,
+    ) -> None:
+        self.job_id = job_id
+        self.priority = priority
+        self.query = query
+        self.sequences = sequences
+        self.enqueued_at = time.time() if enqueued_at is None else enqueued_at
+        # Upstream ids of the chunks already sent, by position
+        self.submitted = submitted or {}
+
+    def payload(self) -> bytes:
+        return json.dumps(
+            {
+                "id": self.query.id,
+                "email_address": self.query.email_address,
+                "threshold_model": self.query.threshold_model,
+                "sequences": self.sequences,
+            }
+        ).encode()
+
+    @classmethod
+    def from_payload(
+        cls,
+        job_id: str,
+        priority: str,
+        payload: bytes,
+        enqueued_at: float,
+        submitted: ty.Optional[ty.Dict[int, str]] = None,
+    ) -> Submission:
+        values = json.loads(payload)
+        query = Query()
+        query.id = values["id"]
+        query.email_address = values["email_address"]
+        query.threshold_model = values["threshold_model"]
+        query.sequences = "\n".join(values["sequences"])
+        return cls(job_id, priority, query, values["sequences"], enqueued_at, submitted)
+
+
+class WeightedQueues:
+    """
+    FIFO queue per priority class, dequeued by smooth weighted round robin:
+    while every class has work, a class of weight w gets w turns out of the
+    sum of the weights, evenly spread, and an idle class leaves its turns to
+    the others.
+    """
+
+    def __init__(self, weights: ty.Dict[str, int]) -> None:
+        self.weights = weights
+        self.queues: ty.Dict[str, ty.Deque[Submission]] = {
+            name: deque() for name in weights
+        }
+        self.current = {name: 0 for name in weights}
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    def push(self, submission: Submission) -> None:
+        self.queues[submission.priority].append(submission)
+
+    def pop(
+        self, classes: ty.Optional[ty.Collection[str]] = None
+    ) -> ty.Optional[Submission]:
+        """
+        Next submission in turn
+        :param classes: classes to take from, defaults to all of them
+        :return: submission, or None if none of these classes is queued
+        """
+        ready = [
+            name
+            for name, queue in self.queues.items()
+            if queue and (classes is None or name in classes)
+        ]
+        if not ready:
+            return None
+        for name in ready:
+            self.current[name] += self.weights[name]
+        chosen = max(ready, key=lambda name: self.current[name])
+        self.current[chosen] -= sum(self.weights[name] for name in ready)
+        return self.queues[chosen].popleft()
+
+
+class SubmissionScheduler:
+    """
+    Sends submissions upstream from a local queue, so clients get a job id
+    straight away. A fixed number of tasks per worker send them, taking
+    interactive and bulk submissions in weighted turns, and interactive_tasks
+    of them only send interactive submissions, so a bulk backlog waiting for
+    upstream slots cannot hold every task. Queued submissions are kept in
+    the JobRegistry, leased to this worker, and are sent by another worker
+    if this one stops before sending them. dispatch returns the upstream job
+    ids, recorded as the submission is removed from the registry, or None if
+    the submission was given up.
+    """
+
+    def __init__(
+        self,
+        dispatch: ty.Callable[[Submission], ty.Awaitable[ty.Optional[ty.List[str]]]],
+        registry: ty.Optional[JobRegistry] = None,
+        concurrency: int = SUBMIT_CONCURRENCY,
+        interactive_tasks: int = SCHEDULER_INTERACTIVE_TASKS,
+        queue_size: int = SUBMIT_QUEUE_SIZE,
+        weights: ty.Optional[ty.Dict[str, int]] = None,
+        lease: float = SCHEDULER_LEASE,
+    ) -> None:
+        self.dispatch = dispatch
+        self.registry = registry
+        self.concurrency = concurrency
+        self.interactive_tasks = min(interactive_tasks, concurrency - 1)
+        self.queue_size = queue_size
+        self.lease = lease
+        self.queues = WeightedQueues(
+            weights
+            or {INTERACTIVE: SCHEDULER_INTERACTIVE_WEIGHT, BULK: SCHEDULER_BULK_WEIGHT}
+        )
+        # Set when a submission is queued, to wake the idle tasks
+        self.pushed = asyncio.Event()
+        self.tasks: ty.List[asyncio.Task] = []
+        self.running = 0
+        self.dispatched = 0
+        self.rejected = 0
+        # Moving average of the time taken to send a submission upstream
+        self.duration = 1.0
+        self.instance = uuid.uuid4().hex[:8]
+
+    @property
+    def owner(self) -> str:
+        return lease_owner(self.instance)
+
+    def check(self, priority: str) -> None:
+        """
+        Make sure a submission of a priority class can be queued
+        :param priority: priority class of the submission
+        :raises HTTPException: 429 with Retry-After if its queue is full
+        """
+        queued = len(self.queues.queues[priority])
+        if queued >= self.queue_size:
+            self.rejected += 1
+            metrics.REJECTED_SUBMISSIONS.labels("queue_full").inc()
+            raise too_many_requests(
+                "Too many submissions waiting, please try again later",
+                self.duration * (queued + 1) / self.concurrency,
+            )
+
+    def submit(self, submission: Submission) -> None:
+        """
+        Queue a submission, to be sent upstream in its turn
+        :param submission: submission with its local job id
+        :raises HTTPException: 429 with Retry-After if its queue is full
+        """
+        self.check(submission.priority)
+        if self.registry is not None:
+            try:
+                self.registry.schedule(
+                    submission.job_id,
+                    submission.priority,
+                    submission.payload(),
+                    self.owner,
+                    self.lease,
+                )
+            except sqlite3.Error as e:
+                # Still sent, unless this worker stops first
+                logger.error(f"Error saving {submission.job_id}. Error: {e}")
+        self.push(submission)
+
+    def push(self, submission: Submission) -> None:
+        self.queues.push(submission)
+        metrics.SCHEDULED.labels(submission.priority).inc()
+        self.pushed.set()
+
+    def resume(self) -> int:
+        """
+        Renew the leases of the submissions queued here and take over the
+        submissions of workers that went away
+        :return: number of submissions taken over
+        """
+        if self.registry is None:
+            return 0
+        try:
+            self.registry.renew_scheduled(self.owner, self.lease)
+            claimed = self.registry.claim_scheduled(
+                self.owner, self.lease, self.queue_size
+            )
+        except sqlite3.Error as e:
+            logger.error(f"Error resuming scheduled submissions. Error: {e}")
+            return 0
+        for scheduled in claimed:
+            logger.info(f"Resumed submission of {scheduled.job_id}")
+            self.push(Submission.from_payload(*scheduled))
+        return len(claimed)
+
+    async def send(self, submission: Submission) -> None:
+        wait = time.time() - submission.enqueued_at
+        metrics.SCHEDULER_WAIT.labels(submission.priority).observe(wait)
+        self.running += 1
+        start = time.monotonic()
+        children = None
+        try:
+            children = await self.dispatch(submission)
+        except Exception as e:
+            logger.error(f"Error sending {submission.job_id}. Error: {e}")
+        finally:
+            self.running -= 1
+        # Not reached if cancelled, the submission is then sent after a
+        # restart, without the chunks recorded as sent
+        self.dispatched += 1
+        self.duration = 0.8 * self.duration + 0.2 * (time.monotonic() - start)
+        if self.registry is not None:
+            try:
+                if children is None:
+                    self.registry.unschedule(submission.job_id)
+                else:
+                    self.registry.finish_scheduled(submission.job_id, children)
+            except sqlite3.Error as e:
+                logger.error(f"Error unscheduling {submission.job_id}. Error: {e}")
+
+    async def worker(self, classes: ty.Optional[ty.Collection[str]] = None) -> None:
+        while True:
+            submission = self.queues.pop(classes)
+            if submission is None:
+                self.pushed.clear()
+                await self.pushed.wait()
+                continue
+            metrics.SCHEDULED.labels(submission.priority).dec()
+            await self.send(submission)
+
+    async def resume_periodically(self) -> None:
+        while True:
+            self.resume()
+            await asyncio.sleep(self.lease / 3)
+
+    async def start(self) -> None:
+        if not self.tasks:
+            shared = self.concurrency - self.interactive_tasks
+            self.tasks = [asyncio.create_task(self.worker()) for _ in range(shared)]
+            self.tasks += [
+                asyncio.create_task(self.worker([INTERACTIVE]))
+                for _ in range(self.interactive_tasks)
+            ]
+            self.tasks.append(asyncio.create_task(self.resume_periodically()))
+
+    async def stop(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        if self.registry is not None:
+            try:
+                # Expire the leases, so the next worker to start sends the
+                # submissions left here without waiting
+                self.registry.renew_scheduled(self.owner, 0)
+            except sqlite3.Error as e:
+                logger.error(f"Error releasing scheduled submissions. Error: {e}")
+
+    def stats(self) -> ty.Dict[str, ty.Union[int, float]]:
+        stats: ty.Dict[str, ty.Union[int, float]] = {
+            f"{name}_queued": len(queue) for name, queue in self.queues.queues.items()
+        }
+        stats.update(
+            running=self.running,
+            dispatched=self.dispatched,
+            rejected=self.rejected,
+            duration=round(self.duration, 3),
+        )
+        return stats
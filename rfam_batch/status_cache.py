@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import time
+import typing as ty
+
+from collections import OrderedDict
+from logger import logger
+from rfam_batch.job_dispatcher import SearchBackend
+from rfam_batch.registry import JobRegistry
+
+STATUS_CACHE_TTL = float(os.getenv("STATUS_CACHE_TTL", "5"))
+STATUS_CACHE_MAX_ITEMS = int(os.getenv("STATUS_CACHE_MAX_ITEMS", "100000"))
+
+# Statuses that never change once reached
+FINAL_STATUSES = {"FINISHED", "FAILURE", "ERROR"}
+KNOWN_STATUSES = FINAL_STATUSES | {"QUEUED", "RUNNING", "NOT_FOUND"}
+
+
+class StatusCache:
+    """
+    Status of each job, looked up upstream at most once every ttl seconds
+    per worker whatever the number of clients polling it. Concurrent lookups
+    of the same job share one upstream call. Final statuses are kept for good
+    in memory, and every change of status of a registered job is recorded in
+    the JobRegistry shared by all workers.
+    """
+
+    def __init__(
+        self,
+        fetch: ty.Callable[[str], ty.Awaitable[str]],
+        registry: ty.Optional[JobRegistry],
+        ttl: float = STATUS_CACHE_TTL,
+        max_items: int = STATUS_CACHE_MAX_ITEMS,
+    ) -> None:
+        self.fetch = fetch
+        self.registry = registry
+        self.ttl = ttl
+        self.max_items = max_items
+        self.hits = 0
+        self.misses = 0
+        # job id -> (time of the lookup, status)
+        self._entries: OrderedDict[str, ty.Tuple[float, str]] = OrderedDict()
+
+    @classmethod
+    def from_env(
+        cls, fetch: ty.Callable[[str], ty.Awaitable[str]], registry: JobRegistry
+    ) -> StatusCache:
+        return cls(fetch, registry)
+
+    def remember(self, job_id: str, status: str, now: float) -> None:
+        self._entries[job_id] = (now, status)
+        self._entries.move_to_end(job_id)
+        while len(self._entries) > self.max_items:
+            self._entries.popitem(last=False)
+
+    def cached(self, job_id: str) -> ty.Optional[str]:
+        """
+        Status of a job if it is known and recent enough
+        :param job_id: ID of the job
+        :return: status, or None if it must be looked up
+        """
+        now = time.monotonic()
+        entry = self._entries.get(job_id)
+        if entry is not None:
+            looked_up, status = entry
+            if status in FINAL_STATUSES or now - looked_up < self.ttl:
+                return status
+
+        if self.registry is not None:
+            # Another worker may have seen the job finish
+            try:
+                status = self.registry.status(job_id)
+            except sqlite3.Error as e:
+                logger.error(f"Error reading status of {job_id}. Error: {e}")
+                status = None
+            if status in FINAL_STATUSES:
+                self.remember(job_id, status, now)
+                return status
+        return None
+
+    async def get(self, job_id: str) -> str:
+        status = self.cached(job_id)
+        if status is not None:
+            self.hits += 1
+            return status
+        return await SearchBackend.coalesce(
+            f"status-cache:{job_id}", lambda: self.refresh(job_id)
+        )
+
+    async def refresh(self, job_id: str) -> str:
+        self.misses += 1
+        status = await self.fetch(job_id)
+        # Anything else is an upstream error page, not worth keeping
+        if status in KNOWN_STATUSES:
+            self.remember(job_id, status, time.monotonic())
+            if self.registry is not None:
+                try:
+                    self.registry.record_status(job_id, status)
+                except sqlite3.Error as e:
+                    logger.error(f"Error writing status of {job_id}. Error: {e}")
+        return status
+
+    def stats(self) -> ty.Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
@@ -0,0 +1,23 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import typing as ty
+
+SUBMISSION_REUSE_TTL = float(os.getenv("SUBMISSION_REUSE_TTL", str(24 * 3600)))
+
+
+def submission_key(sequences: ty.List[str], threshold_model: str) -> str:
+    """
+    Content address of a submission
+    :param sequences: validated sequences in FASTA format, as produced by
+    FastaParser, so case and line wrapping do not change the key
+    :param threshold_model: search parameter sent to Job Dispatcher
+    :return: hex digest identifying the search
+    """
+    digest = hashlib.sha256()
+    digest.update(threshold_model.encode())
+    for sequence in sequences:
+        digest.update(b"\0")
+        digest.update(sequence.encode())
+    return digest.hexdigest()
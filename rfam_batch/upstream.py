@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import aiohttp
+import asyncio
+import os
+import random
+import typing as ty
+
+from fastapi import HTTPException
+from logger import logger
+
+JD_POOL_LIMIT = int(os.getenv("JD_POOL_LIMIT", "100"))
+JD_POOL_LIMIT_PER_HOST = int(os.getenv("JD_POOL_LIMIT_PER_HOST", "25"))
+JD_KEEPALIVE_TIMEOUT = float(os.getenv("JD_KEEPALIVE_TIMEOUT", "30"))
+JD_CONNECT_TIMEOUT = float(os.getenv("JD_CONNECT_TIMEOUT", "10"))
+JD_READ_TIMEOUT = float(os.getenv("JD_READ_TIMEOUT", "60"))
+JD_RETRIES = int(os.getenv("JD_RETRIES", "3"))
+JD_RETRY_BACKOFF = float(os.getenv("JD_RETRY_BACKOFF", "0.5"))
+
+# Responses worth retrying, the request may succeed a moment later
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class UpstreamClient:
+    """
+    Pooled HTTP client used for all Job Dispatcher traffic. Connections are
+    kept alive and reused, and idempotent GET requests are retried with
+    jittered exponential backoff.
+    """
+
+    def __init__(
+        self,
+        limit: int = JD_POOL_LIMIT,
+        limit_per_host: int = JD_POOL_LIMIT_PER_HOST,
+        keepalive_timeout: float = JD_KEEPALIVE_TIMEOUT,
+        connect_timeout: float = JD_CONNECT_TIMEOUT,
+        read_timeout: float = JD_READ_TIMEOUT,
+        retries: int = JD_RETRIES,
+        retry_backoff: float = JD_RETRY_BACKOFF,
+    ) -> None:
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.session: ty.Optional[aiohttp.ClientSession] = None
+        self.requests = 0
+        self.retried = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def start(self) -> None:
+        if self.session is None:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            timeout = aiohttp.ClientTimeout(
+                connect=self.connect_timeout, sock_read=self.read_timeout
+            )
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    async def close(self) -> None:
+        if self.session:
+            await self.session.close()
+        self.session = None
+
+    async def _request(
+        self, method: str, url: str, **kwargs: ty.Any
+    ) -> ty.Tuple[int, str]:
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            async with self.session.request(method, url, **kwargs) as r:
+                return r.status, await r.text()
+        finally:
+            self.in_flight -= 1
+
+    async def request(
+        self, method: str, url: str, retry: bool = False, **kwargs: ty.Any
+    ) -> ty.Tuple[int, str]:
+        """
+        Send a request and read the whole response body
+        :param method: HTTP method
+        :param url: URL to request
+        :param retry: retry failed attempts, only for idempotent requests
+        :return: response status and body
+        """
+        attempts = self.retries + 1 if retry else 1
+        for attempt in range(attempts):
+            last_attempt = attempt == attempts - 1
+            try:
+                status, text = await self._request(method, url, **kwargs)
+                if status not in RETRY_STATUSES or last_attempt:
+                    return status, text
+                logger.warning(f"Retrying {url}, got status {status}")
+            except asyncio.TimeoutError:
+                if last_attempt:
+                    self.errors += 1
+                    raise HTTPException(
+                        status_code=504, detail=f"Request to {url!r} timed out."
+                    )
+                logger.warning(f"Retrying {url}, request timed out")
+            except aiohttp.ClientError as e:
+                if last_attempt:
+                    self.errors += 1
+                    raise HTTPException(
+                        status_code=500,
+                        detail=f"An error occurred while requesting {url!r}: {e}",
+                    )
+                logger.warning(f"Retrying {url}, error: {e}")
+
+            self.retried += 1
+            # Full jitter keeps the workers from retrying in lockstep
+            await asyncio.sleep(random.uniform(0, self.retry_backoff * 2**attempt))
+
+    async def get(self, url: str) -> ty.Tuple[int, str]:
+        return await self.request("GET", url, retry=True)
+
+    async def post(self, url: str, data: ty.Dict[str, str]) -> ty.Tuple[int, str]:
+        return await self.request("POST", url, data=data)
+
+    async def stream_lines(self, url: str) -> ty.AsyncIterator[str]:
+        """
+        GET a text response and yield its lines as they arrive. Streams are not
+        retried, as part of the body may already have been used.
+        :param url: URL to request
+        :return: lines without the line terminator
+        """
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            async with self.session.get(url) as r:
+                if r.status != 200:
+                    raise HTTPException(
+                        status_code=r.status,
+                        detail=f"Error {r.status} while requesting {url!r}",
+                    )
+                async for line in r.content:
+                    yield line.decode().rstrip("\r\n")
+        except asyncio.TimeoutError:
+            self.errors += 1
+            raise HTTPException(
+                status_code=504, detail=f"Request to {url!r} timed out."
+            )
+        except aiohttp.ClientError as e:
+            self.errors += 1
+            raise HTTPException(
+                status_code=500,
+                detail=f"An error occurred while requesting {url!r}: {e}",
+            )
+        finally:
+            self.in_flight -= 1
+
+    def stats(self) -> ty.Dict[str, ty.Union[int, float]]:
+        connector = self.session.connector if self.session else None
+        # Connections kept alive and waiting to be reused
+        idle = sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+        return {
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "idle_connections": idle,
+            "requests": self.requests,
+            "retries": self.retried,
+            "errors": self.errors,
+        }
@@ -0,0 +1,17 @@
+import pytest
+
+from rfam_batch.job_dispatcher import Query
+from rfam_batch.registry import JobRegistry
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return JobRegistry(str(tmp_path / "registry.sqlite3"))
+
+
+def make_query(sequences=">query\nACGU"):
+    query = Query()
+    query.id = None
+    query.email_address = "dummy@email.com"
+    query.sequences = sequences
+    return query
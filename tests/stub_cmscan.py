@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+"""
+Stands in for cmscan in tests: writes the example tblout file to the path
+given with --tblout and prints the example out file
+"""
+import os
+import shutil
+import sys
+
+EXAMPLE_FILES = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "example_files"
+)
+
+args = sys.argv[1:]
+if not os.path.exists(args[-1]):
+    sys.exit(f"Error: sequence file {args[-1]} not found")
+shutil.copyfile(os.path.join(EXAMPLE_FILES, "tblout"), args[args.index("--tblout") + 1])
+with open(os.path.join(EXAMPLE_FILES, "out")) as f:
+    sys.stdout.write(f.read())
@@ -0,0 +1,158 @@
+import asyncio
+import pytest
+
+from starlette.requests import Request
+from rfam_batch.admission import *
+from rfam_batch.registry import JobRegistry
+
+
+def make_request(forwarded=None, host="192.0.2.1"):
+    headers = []
+    if forwarded is not None:
+        headers.append((b"x-forwarded-for", forwarded.encode()))
+    return Request({"type": "http", "headers": headers, "client": (host, 12345)})
+
+
+def test_client_address():
+    assert client_address(make_request()) == "192.0.2.1"
+    assert client_address(make_request("203.0.113.7")) == "203.0.113.7"
+    # Entries sent by the client itself are not trusted
+    assert client_address(make_request("1.2.3.4, 203.0.113.7")) == "203.0.113.7"
+    assert client_address(make_request("1.2.3.4, 203.0.113.7, 10.0.0.1"), 2) == (
+        "203.0.113.7"
+    )
+    assert client_address(make_request("203.0.113.7"), hops=3) == "203.0.113.7"
+    assert client_address(make_request("203.0.113.7"), hops=0) == "192.0.2.1"
+
+
+def test_token_bucket(registry):
+    limiter = RateLimiter(registry, rate=2, burst=3)
+    for _ in range(3):
+        limiter.check("client", now=0)
+    with pytest.raises(HTTPException) as e:
+        limiter.check("client", now=0)
+    assert e.value.status_code == 429
+    assert e.value.headers["Retry-After"] == "1"
+
+    # Other clients have their own bucket
+    limiter.check("other", now=0)
+    # Tokens come back at rate per second
+    limiter.check("client", now=0.5)
+    with pytest.raises(HTTPException):
+        limiter.check("client", now=0.5)
+
+
+def test_rate_limit_shared_by_workers(registry):
+    limiter = RateLimiter(registry, rate=1, burst=2)
+    other_worker = RateLimiter(JobRegistry(registry.path), rate=1, burst=2)
+    limiter.check("client", now=0)
+    other_worker.check("client", now=0)
+    with pytest.raises(HTTPException):
+        limiter.check("client", now=0)
+
+
+def clients(registry):
+    rows = registry.db.execute("SELECT client FROM rate_buckets ORDER BY client")
+    return [row[0] for row in rows]
+
+
+def test_rate_limit_drops_full_buckets(registry):
+    limiter = RateLimiter(registry, rate=1, burst=2)
+    limiter.check("a", now=0)
+    limiter.check("b", now=1)
+    limiter.check("b", now=1)
+    with pytest.raises(HTTPException):
+        limiter.check("b", now=1.5)
+    assert clients(registry) == ["a", "b"]
+    # Only a bucket that has filled up again is forgotten, an empty one is
+    # kept so its client stays limited
+    limiter.check("c", now=2.5)
+    assert clients(registry) == ["b", "c"]
+
+
+def test_rate_limit_disabled(registry):
+    limiter = RateLimiter(registry, rate=0, burst=0)
+    for _ in range(100):
+        limiter.check("client")
+
+
+def test_upstream_limit(registry):
+    in_flight = []
+    peak = 0
+
+    async def submit(query):
+        nonlocal peak
+        in_flight.append(query)
+        peak = max(peak, len(in_flight))
+        await asyncio.sleep(0.02)
+        in_flight.remove(query)
+        return f"job-{query}"
+
+    async def run():
+        # Two workers sharing the registry
+        workers = [
+            UpstreamLimiter(
+                JobRegistry(registry.path),
+                limit=2,
+                interactive_slots=0,
+                poll_interval=0.01,
+            )
+            for _ in range(2)
+        ]
+        submits = [worker.bound(submit) for worker in workers]
+        return await asyncio.gather(*[submits[i % 2](i) for i in range(6)])
+
+    assert asyncio.run(run()) == [f"job-{i}" for i in range(6)]
+    assert peak == 2
+    assert registry.slots_taken() == 0
+
+
+def test_waiting_for_upstream_slot_only_reads(registry):
+    writes = []
+    acquire_slot = registry.acquire_slot
+
+    def counted(*args):
+        writes.append(args)
+        return acquire_slot(*args)
+
+    async def run():
+        other_worker = UpstreamLimiter(JobRegistry(registry.path), limit=1)
+        slot_id = await other_worker.acquire()
+        limiter = UpstreamLimiter(registry, limit=1, poll_interval=0.01)
+        registry.acquire_slot = counted
+        waiters = [asyncio.create_task(limiter.acquire()) for _ in range(3)]
+        await asyncio.sleep(0.1)
+        # All the slots are taken, waiting takes no write lock
+        assert writes == []
+        assert limiter.stats()["waiting"] == 3
+        other_worker.release(slot_id)
+        limiter.release(await waiters[0])
+        limiter.release(await waiters[1])
+        limiter.release(await waiters[2])
+
+    asyncio.run(run())
+    assert len(writes) == 3
+    assert registry.slots_taken() == 0
+
+
+def test_upstream_slots_reserved_for_interactive(registry):
+    async def run():
+        limiter = UpstreamLimiter(
+            registry, limit=3, interactive_slots=1, poll_interval=0.01
+        )
+        bulk = [await limiter.acquire() for _ in range(2)]
+        waiting = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0.05)
+        # The last slot is left to interactive submissions
+        assert not waiting.done()
+        interactive = await asyncio.wait_for(limiter.acquire(interactive=True), 1)
+        limiter.release(interactive)
+        await asyncio.sleep(0.05)
+        assert not waiting.done()
+        limiter.release(bulk[0])
+        bulk.append(await asyncio.wait_for(waiting, 1))
+        for slot_id in bulk[1:]:
+            limiter.release(slot_id)
+
+    asyncio.run(run())
+    assert registry.slots_taken() == 0
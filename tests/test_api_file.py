@@ -1,5 +1,8 @@
+import json
 import pytest
 
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 from rfam_batch.api import *
 
 
@@ -53,9 +56,30 @@ def test_sequence_invalid_characters():
         SubmittedRequest.validate_sequence("ACGTX")
 
 
+def test_sequence_invalid_characters_positions():
+    with pytest.raises(ValueError) as e:
+        SubmittedRequest.validate_residues("ACXGTXZ", record=2)
+    assert str(e.value).endswith(
+        "X (sequence 2, position 3), Z (sequence 2, position 7)"
+    )
+
+
+def test_sequence_invalid_characters_capped():
+    with pytest.raises(ValueError) as e:
+        SubmittedRequest.validate_residues("ACGT" + "EFIJLOPQXZ!?" * 100000)
+    message = str(e.value)
+    assert message.count("position") == 10
+    assert message.endswith("...")
+
+
+def test_sequence_non_ascii_characters():
+    with pytest.raises(ValueError, match="\u00e9 \\(position 3\\)"):
+        SubmittedRequest.validate_residues("AC\u00e9GT")
+
+
 def test_gap_characters_in_sequence():
     raw_sequence = "ACGT.U"
-    with pytest.raises(ValueError):
+    with pytest.raises(ValueError, match="Gap characters"):
         SubmittedRequest.parse(raw_sequence)
 
 
@@ -86,6 +110,50 @@ def test_mixed_case_sequence():
     assert request.sequences[0] == ">Header\nACGT"
 
 
+def test_fasta_parser_chunked_input():
+    parser = FastaParser()
+    for chunk in [b">head", b"er1\nAC", b"GT\r\nacgt\n>header2", b"\nTGCA\n"]:
+        parser.feed(chunk)
+    result = parser.close()
+    assert result.sequences == [">header1\nACGTACGT", ">header2\nTGCA"]
+
+
+def test_fasta_parser_multibyte_character_split_across_chunks():
+    parser = FastaParser()
+    header = ">h\u00e9ader\nACGT".encode()
+    parser.feed(header[:3])
+    parser.feed(header[3:])
+    assert parser.close().sequences == [">h\u00e9ader\nACGT"]
+
+
+def test_fasta_parser_rejects_first_invalid_record():
+    parser = FastaParser()
+    parser.feed(b">header1\nACGT\n>header2\nACXT\n")
+    with pytest.raises(ValueError, match="Invalid characters in sequence"):
+        parser.feed(b">header3\n")
+
+
+def test_fasta_parser_sequence_too_long():
+    parser = FastaParser()
+    parser.feed(b">header1\n" + b"A" * 7000 + b"\n")
+    with pytest.raises(ValueError, match="less than or equal to 7,000"):
+        parser.feed(b"A\n")
+
+
+def test_fasta_parser_upload_too_large():
+    parser = FastaParser(max_bytes=10)
+    parser.feed(b">header1\n")
+    with pytest.raises(UploadTooLarge):
+        parser.feed(b"ACGT\n")
+
+
+def test_fasta_parser_too_many_sequences():
+    parser = FastaParser(max_sequences=1)
+    parser.feed(b">header1\nACGT\n")
+    with pytest.raises(UploadTooLarge):
+        parser.feed(b">header2\nACGT\n>header3\n")
+
+
 def test_parse_cm_scan_result_instance(out_text, sequence, tblout_text):
     job_id = "test_job_id"
     result = parse_cm_scan_result(out_text, sequence, tblout_text, job_id)
@@ -141,6 +209,173 @@ def test_parse_cm_scan_result_hits(out_text, sequence, tblout_text):
     assert result.hits == hits
 
 
+def test_parse_tblout_line():
+    line = (
+        "5S_rRNA              RF00001   EMBOSS_001           -          cm"
+        "        1      119        1      119      +    no    1 0.49   0.0"
+        "  104.9   4.5e-24 !   5S ribosomal RNA"
+    )
+    assert parse_tblout_line(line) == {
+        "id": "5S_rRNA",
+        "acc": "RF00001",
+        "start": 1,
+        "end": 119,
+        "strand": "+",
+        "GC": 0.49,
+        "score": 104.9,
+        "E": 4.5e-24,
+    }
+    assert parse_tblout_line("#target name") is None
+    assert parse_tblout_line("   ") is None
+
+
+def test_iter_tblout_hits(tblout_text):
+    hits = iter_tblout_hits(tblout_text.splitlines())
+    assert next(hits)["id"] == "5S_rRNA"
+    assert next(hits, None) is None
+
+
+def test_parse_tblout_file(tblout_text):
+    date, hit_list = parse_tblout_file(tblout_text)
+    assert date == "2024-04-03 10:28:27"
+    assert hit_list == list(iter_tblout_hits(tblout_text.splitlines()))
+    # Both views of the same records
+    date, records = parse_tblout_records(tblout_text)
+    assert date == "2024-04-03 10:28:27"
+    assert [record.tblout_dict() for record in records] == hit_list
+
+
+def test_tblout_date():
+    assert tblout_date("") == ""
+    assert tblout_date("# Date:       Wed Apr  3 10:28:27 2024") == (
+        "2024-04-03 10:28:27"
+    )
+    # Only from a line of its own
+    assert tblout_date("x # Date: 1\n") == ""
+
+
+def test_parse_out_file(out_text):
+    num_hits, alignments = parse_out_file(out_text)
+    assert num_hits == 1
+    assert len(alignments) == 1
+    key, alignment = alignments[0]
+    assert key == (1, 119, 104.9, 4.5e-24)
+    assert alignment.user_seq.startswith("#SEQ 1 AGUUACGGCC")
+    assert alignment.pp.startswith("#PP                  *****")
+
+
+def test_parse_cm_scan_result_longer_header(out_text, sequence, tblout_text):
+    # The parser must not depend on the number of header lines
+    longer = out_text.replace("# - - -", "# extra option line\n# - - -", 1)
+    expected = parse_cm_scan_result(out_text, sequence, tblout_text, "job_id")
+    result = parse_cm_scan_result(longer, sequence, tblout_text, "job_id")
+    assert result.hits == expected.hits
+
+
+def test_parse_cm_scan_result_multiple_hits(out_text, sequence, tblout_text):
+    # Second hit of the same model on the reverse strand
+    block_start = out_text.index(">> 5S_rRNA")
+    block_end = out_text.index("Internal CM pipeline")
+    block = out_text[block_start:block_end]
+    second_block = (
+        block.replace("4.5e-24  104.9", "2.1e-05   30.2")
+        .replace("1         119 +", "200          82 -")
+        .replace("EMBOSS_001   1 ", "EMBOSS_001 200 ")
+    )
+    two_hits = out_text[:block_end] + second_block + out_text[block_end:]
+    second_row = (
+        "5S_rRNA              RF00001   EMBOSS_001           -          cm"
+        "        1      119      200       82      -    no    1 0.49   0.0"
+        "   30.2   2.1e-05 !   5S ribosomal RNA\n"
+    )
+    # List the second hit first in the tblout
+    header_end = tblout_text.index("5S_rRNA")
+    tblout_two_hits = tblout_text[:header_end] + second_row + tblout_text[header_end:]
+
+    result = parse_cm_scan_result(two_hits, sequence, tblout_two_hits, "job_id")
+    first, second = result.hits["5S_rRNA"]
+    assert (first.start, first.end, first.strand) == (200, 82, "-")
+    assert first.alignment.user_seq.startswith("#SEQ 200 AGUUACGGCC")
+    assert (second.start, second.end, second.strand) == (1, 119, "+")
+    assert second.alignment.user_seq.startswith("#SEQ 1 AGUUACGGCC")
+
+
+@pytest.fixture
+def two_queries(out_text, tblout_text):
+    # Job with a second query sequence, identical to the first one
+    section_start = out_text.index("Query:")
+    section_end = out_text.index("//") + 3
+    section = out_text[section_start:section_end]
+    out_two = out_text[:section_end] + section.replace("EMBOSS_001", "EMBOSS_002")
+    out_two += out_text[section_end:]
+    row_start = tblout_text.index("5S_rRNA")
+    row_end = tblout_text.index("\n", row_start) + 1
+    row = tblout_text[row_start:row_end]
+    tblout_two = (
+        tblout_text[:row_end]
+        + row.replace("EMBOSS_001", "EMBOSS_002")
+        + tblout_text[row_end:]
+    )
+    return out_two, tblout_two
+
+
+def test_index_out_file(two_queries):
+    out_two, _ = two_queries
+    sections = index_out_file(out_two)
+    assert [(s.query, s.length) for s in sections] == [
+        ("EMBOSS_001", 119),
+        ("EMBOSS_002", 119),
+    ]
+    for section in sections:
+        text = out_two[section.start : section.end]
+        assert text.startswith("Query:")
+        assert text.endswith("//")
+        assert text.count("\n>> ") == 1
+
+
+def test_index_out_file_without_queries():
+    assert index_out_file("") == []
+    assert index_out_file("# cmscan :: search sequence(s)\n") == []
+
+
+def test_parse_sequence_page(two_queries):
+    out_two, tblout_two = two_queries
+    page = parse_sequence_page(out_two, tblout_two, "job_id", offset=1, limit=10)
+    assert page.total == 2
+    assert page.opened == "2024-04-03 10:28:27"
+    assert len(page.sequences) == 1
+    result = page.sequences[0]
+    assert result.sequence == "EMBOSS_002"
+    assert result.numHits == 1
+    hit = result.hits["5S_rRNA"][0]
+    assert hit.alignment.user_seq.startswith("#SEQ 1 AGUUACGGCC")
+
+
+def test_sequence_index(two_queries):
+    out, tblout = (text.encode() for text in two_queries)
+    index = index_sequences(out, tblout)
+    assert len(index) == 2
+    assert index.opened == "2024-04-03 10:28:27"
+    section = index.section(1)
+    assert section.query == "EMBOSS_002"
+    assert out[section.start : section.end].startswith(b"Query:       EMBOSS_002")
+    ((start, end),) = index.row_spans(1)
+    assert b" EMBOSS_002 " in tblout[start:end]
+
+    # Read back from its cached form, a page only uses the index
+    cached = SequenceIndex.load(index.dump())
+    page = sequence_page_document(out, tblout, cached, "job_id", 1, 10)
+    assert page == sequence_page_document(out, tblout, index, "job_id", 1, 10)
+    assert page["sequences"][0]["numHits"] == 1
+
+
+def test_parse_sequence_page_out_of_range(two_queries):
+    out_two, tblout_two = two_queries
+    page = parse_sequence_page(out_two, tblout_two, "job_id", offset=5, limit=10)
+    assert page.total == 2
+    assert page.sequences == []
+
+
 def test_submission_response_build():
     job_id = "infernal_cmscan-R20240530-111350-0806-24133014-p1m"
     result_url = "https://batch.rfam.org/result/infernal_cmscan-R20240530-111350-0806-24133014-p1m/tblout"
@@ -200,3 +435,44 @@ def test_multiple_sequences_empty_hits():
     multiple_sequences = MultipleSequences(opened=opened, hits=hits)
     assert multiple_sequences.opened == opened
     assert len(multiple_sequences.hits) == 0
+
+
+def without_closed(body):
+    # Time the result was parsed, differs between calls
+    return body.replace(json.loads(body)["closed"].encode(), b"")
+
+
+def fastapi_body(result):
+    # What /result sent when it returned the model for FastAPI to serialise
+    return JSONResponse(jsonable_encoder(result)).body
+
+
+def test_cm_scan_result_json(out_text, sequence, tblout_text):
+    result = parse_cm_scan_result(out_text, sequence, tblout_text, "job_id")
+    body = cm_scan_result_json(out_text, sequence, tblout_text, "job_id")
+    assert without_closed(body) == without_closed(fastapi_body(result))
+
+
+def test_cm_scan_result_json_multiple_sequences(tblout_text):
+    sequences = ">seq1\nACGU\n>seq2\nACGU\n"
+    result = parse_cm_scan_result("", sequences, tblout_text, "job_id")
+    body = cm_scan_result_json("", sequences, tblout_text, "job_id")
+    assert body == fastapi_body(result)
+
+
+def test_result_float_format(out_text, sequence, tblout_text):
+    # Small E-values are written as FastAPI did, not as model_dump_json
+    # would (0.000019)
+    out_text = out_text.replace("4.5e-24", "1.9e-05")
+    tblout_text = tblout_text.replace("4.5e-24", "1.9e-05")
+    result = parse_cm_scan_result(out_text, sequence, tblout_text, "job_id")
+    body = cm_scan_result_json(out_text, sequence, tblout_text, "job_id")
+    assert b'"GC":0.49,"score":104.9,"E":1.9e-05,' in body
+    assert without_closed(body) == without_closed(fastapi_body(result))
+    body = cm_scan_result_json("", ">a\nACGU\n>b\nACGU\n", tblout_text, "job_id")
+    assert b'"E":1.9e-05}' in body
+
+
+def test_hit_without_alignment(sequence, tblout_text):
+    with pytest.raises(ValueError, match="No alignment found"):
+        cm_scan_result_json("", sequence, tblout_text, "job_id")
@@ -0,0 +1,13 @@
+import pytest
+
+from rfam_batch.backends import *
+
+
+def test_backend_selection():
+    assert isinstance(backend("ebi"), JobDispatcher)
+    assert isinstance(backend("local"), LocalCmscan)
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        backend("slurm")
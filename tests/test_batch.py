@@ -0,0 +1,95 @@
+import asyncio
+import pytest
+
+from rfam_batch.batch import *
+from tests.conftest import make_query
+
+
+def test_chunk():
+    assert chunk(["a", "b", "c", "d", "e"], 2) == [["a", "b"], ["c", "d"], ["e"]]
+    assert chunk([], 2) == []
+
+
+def test_parent_ids():
+    parent_id = new_parent_id()
+    assert is_parent(parent_id)
+    assert parent_id != new_parent_id()
+    assert not is_parent("infernal_cmscan-R20240403-102819-0433-11639394-p1m")
+
+
+def test_aggregate_status():
+    assert aggregate_status(["FINISHED", "FINISHED"]) == "FINISHED"
+    assert aggregate_status(["QUEUED", "QUEUED"]) == "QUEUED"
+    assert aggregate_status(["FINISHED", "QUEUED"]) == "RUNNING"
+    assert aggregate_status(["RUNNING", "QUEUED"]) == "RUNNING"
+    assert aggregate_status(["FINISHED", "FAILURE", "RUNNING"]) == "FAILURE"
+    assert aggregate_status(["ERROR", "FAILURE"]) == "ERROR"
+
+
+def test_join_artifacts():
+    assert join_artifacts(["a\n", "b", "c\n"]) == ("a\nb\nc\n", True)
+    # A child whose artifact could not be fetched leaves the parent incomplete
+    assert join_artifacts(["a\n", "", "c\n"]) == ("a\nc\n", False)
+
+
+def test_submit_chunks():
+    query = make_query()
+    submitted = []
+    running = []
+    peak = []
+
+    async def submit(chunk_query):
+        running.append(1)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.pop()
+        submitted.append(chunk_query.sequences)
+        return f"job{chunk_query.sequences[-1]}"
+
+    sequences = [f">s{i}\nACGU{i}" for i in range(7)]
+    children = asyncio.run(
+        submit_chunks(submit, query, sequences, chunk_size=2, concurrency=2)
+    )
+    assert children == ["job1", "job3", "job5", "job6"]
+    assert max(peak) == 2
+    assert ">s0\nACGU0\n>s1\nACGU1" in submitted
+
+
+def test_submit_chunks_resumed():
+    async def submit(chunk_query):
+        return f"job{chunk_query.sequences[-1]}"
+
+    recorded = {}
+    sequences = [f">s{i}\nACGU{i}" for i in range(5)]
+    children = asyncio.run(
+        submit_chunks(
+            submit,
+            make_query(),
+            sequences,
+            chunk_size=2,
+            submitted={0: "earlier"},
+            on_submitted=recorded.__setitem__,
+        )
+    )
+    # Chunks submitted before a restart are not submitted again
+    assert children == ["earlier", "job3", "job4"]
+    assert recorded == {1: "job3", 2: "job4"}
+
+
+def test_submit_chunks_failure():
+    async def submit(chunk_query):
+        if "s2" in chunk_query.sequences:
+            raise ValueError("upstream error")
+        return "job"
+
+    sequences = [f">s{i}\nACGU" for i in range(4)]
+    with pytest.raises(ValueError):
+        asyncio.run(submit_chunks(submit, make_query(), sequences, chunk_size=1))
+
+
+def test_gather_children():
+    async def fetch(job_id):
+        return job_id.upper()
+
+    result = asyncio.run(gather_children(fetch, ["a", "b", "c"], concurrency=1))
+    assert result == ["A", "B", "C"]
@@ -0,0 +1,38 @@
+from benchmarks import synthetic
+from benchmarks.parsers import regressions
+from rfam_batch.api import *
+
+
+def test_synthetic_outputs_agree():
+    hits = synthetic.hits(50)
+    result = parse_cm_scan_result(
+        synthetic.out(hits), synthetic.fasta(1), synthetic.tblout(hits), "job"
+    )
+    assert result.numHits == 50
+    assert all(hit.alignment for group in result.hits.values() for hit in group)
+
+
+def test_synthetic_outputs_with_several_queries():
+    hits = synthetic.hits(30, 10)
+    out, tblout = synthetic.out(hits, 12), synthetic.tblout(hits)
+    page = parse_sequence_page(out, tblout, "job", 0, 20)
+    assert page.total == 12
+    assert sum(sequence.numHits for sequence in page.sequences) == 30
+    assert page.sequences[-1].numHits == 0
+
+
+def test_synthetic_fasta_is_valid():
+    assert len(SubmittedRequest.parse(synthetic.fasta(25)).sequences) == 25
+
+
+def test_regressions():
+    baseline = {"parser": {"100": {"seconds": 1.0, "peak_bytes": 1000}}}
+    results = {
+        "parser": {
+            "100": {"seconds": 1.2, "peak_bytes": 1100},
+            "1000": {"seconds": 9.0, "peak_bytes": 9000},
+        }
+    }
+    assert regressions(results, baseline, 1.5, 1.2) == []
+    results["parser"]["100"] = {"seconds": 2.0, "peak_bytes": 2000}
+    assert len(regressions(results, baseline, 1.5, 1.2)) == 2
@@ -0,0 +1,47 @@
+import asyncio
+import pytest
+
+from rfam_batch.bulk import *
+
+
+def test_unique_job_ids():
+    assert unique_job_ids(["job2", "job1", "job2"]) == ["job2", "job1"]
+    with pytest.raises(HTTPException) as e:
+        unique_job_ids([])
+    assert e.value.status_code == 400
+    with pytest.raises(HTTPException) as e:
+        unique_job_ids(["job1", "job2", "job3"], max_jobs=2)
+    assert e.value.status_code == 400
+    assert unique_job_ids(["job1", "job1", "job2"], max_jobs=2) == ["job1", "job2"]
+
+
+def test_gather_isolated():
+    running = []
+    peak = []
+
+    async def fetch(job_id):
+        running.append(1)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.pop()
+        if job_id == "job3":
+            raise HTTPException(status_code=502, detail="Upstream error")
+        if job_id == "job5":
+            raise RuntimeError("boom")
+        return job_id.upper()
+
+    job_ids = [f"job{i}" for i in range(10)]
+    results, errors = asyncio.run(gather_isolated(fetch, job_ids, concurrency=3))
+    assert max(peak) == 3
+    assert errors == {"job3": "Upstream error", "job5": "boom"}
+    assert list(results) == [i for i in job_ids if i not in errors]
+    assert results["job0"] == "JOB0"
+
+
+def test_count_hits():
+    with open("tests/example_files/tblout") as f:
+        tblout = f.read()
+    hits = [line for line in tblout.splitlines() if not line.startswith("#")]
+    assert count_hits(tblout) == (len(hits), 1)
+    assert count_hits("") == (0, 0)
+    assert count_hits("# comment\n") == (0, 0)
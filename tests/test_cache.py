@@ -0,0 +1,110 @@
+import os
+
+from rfam_batch.cache import *
+
+
+def test_lru_get_put():
+    lru = LRUCache(max_items=2, max_bytes=100)
+    lru.put("a", b"1")
+    assert lru.get("a") == b"1"
+    assert lru.get("b") is None
+
+
+def test_lru_evicts_least_recently_used():
+    lru = LRUCache(max_items=2, max_bytes=100)
+    lru.put("a", b"1")
+    lru.put("b", b"2")
+    lru.get("a")
+    lru.put("c", b"3")
+    assert lru.get("a") == b"1"
+    assert lru.get("b") is None
+    assert lru.get("c") == b"3"
+    assert lru.evictions == 1
+
+
+def test_lru_evicts_by_size():
+    lru = LRUCache(max_items=10, max_bytes=10)
+    lru.put("a", b"x" * 6)
+    lru.put("b", b"x" * 6)
+    assert lru.get("a") is None
+    assert lru.size == 6
+
+
+def test_lru_skips_oversized_values():
+    lru = LRUCache(max_items=10, max_bytes=10)
+    lru.put("a", b"x" * 5)
+    lru.put("b", b"x" * 11)
+    assert lru.get("a") == b"x" * 5
+    assert lru.get("b") is None
+
+
+def test_disk_store_round_trip(tmp_path):
+    store = DiskStore(str(tmp_path), max_bytes=1000)
+    assert store.get("job/result") is None
+    store.put("job/result", b"{}")
+    assert store.get("job/result") == b"{}"
+    store.delete("job/result")
+    assert store.get("job/result") is None
+
+
+def test_disk_store_prunes_oldest(tmp_path):
+    store = DiskStore(str(tmp_path), max_bytes=10)
+    store.put("old", b"x" * 6)
+    store.pruner.join()
+    os.utime(store.path("old"), (0, 0))
+    store.put("new", b"x" * 6)
+    store.pruner.join()
+    assert store.get("old") is None
+    assert store.get("new") == b"x" * 6
+    assert store.size == 6
+
+
+def test_disk_store_counts_its_size(tmp_path, monkeypatch):
+    DiskStore(str(tmp_path), max_bytes=100).put("other", b"x" * 10)
+    store = DiskStore(str(tmp_path), max_bytes=100)
+    store.put("a", b"x" * 10)
+    store.pruner.join()
+    assert store.size == 20
+
+    scans = []
+    monkeypatch.setattr(store, "prune", lambda: scans.append(1))
+    # Counted without scanning the directory while under max_bytes
+    store.put("a", b"x" * 30)
+    store.put("b", b"x" * 40)
+    store.delete("b")
+    assert store.size == 40
+    assert scans == []
+    store.put("c", b"x" * 70)
+    store.pruner.join()
+    assert scans == [1]
+
+
+def test_result_cache_shared_through_disk(tmp_path):
+    first = ResultCache(LRUCache(10, 100), DiskStore(str(tmp_path), 1000))
+    second = ResultCache(LRUCache(10, 100), DiskStore(str(tmp_path), 1000))
+    first.put("job/result", b"{}")
+
+    assert second.get("job/result") == b"{}"
+    assert second.get("job/result") == b"{}"
+    assert second.get("other/result") is None
+    assert second.stats()["disk_hits"] == 1
+    assert second.stats()["hits"] == 1
+    assert second.stats()["misses"] == 1
+
+
+def test_result_cache_view(tmp_path):
+    first = ResultCache(LRUCache(10, 100), DiskStore(str(tmp_path), 1000))
+    second = ResultCache(LRUCache(10, 100), DiskStore(str(tmp_path), 1000))
+    first.put("job/out", b"Query: a\n//\n")
+    first.put("job/empty", b"")
+
+    with first.view("job/out") as value:
+        assert value == b"Query: a\n//\n"
+    # Mapped from the shared copy without keeping it in memory
+    with second.view("job/out") as value:
+        assert value[7:8] == b"a"
+    assert second.memory.get("job/out") is None
+    with second.view("job/empty") as value:
+        assert value == b""
+    with second.view("other/out") as value:
+        assert value is None
@@ -0,0 +1,75 @@
+import asyncio
+
+from rfam_batch.events import *
+
+
+class Job:
+    def __init__(self, *statuses):
+        self.statuses = list(statuses)
+        self.calls = 0
+
+    async def fetch(self, job_id):
+        self.calls += 1
+        return self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0]
+
+
+async def collect(subscription):
+    statuses = []
+    while (status := await subscription.get()) is not None:
+        statuses.append(status)
+    return statuses
+
+
+def test_subscribers_share_one_poll():
+    job = Job("QUEUED", "RUNNING", "RUNNING", "FINISHED")
+
+    async def run():
+        watcher = StatusWatcher(job.fetch, interval=0.01)
+        subscriptions = [watcher.subscribe("job") for _ in range(5)]
+        results = await asyncio.gather(*[collect(s) for s in subscriptions])
+        return results, watcher.watches
+
+    results, watches = asyncio.run(run())
+    assert results == [["QUEUED", "RUNNING", "FINISHED"]] * 5
+    assert job.calls == 4
+    assert watches == {}
+
+
+def test_late_subscriber_gets_current_status():
+    job = Job("RUNNING")
+
+    async def run():
+        watcher = StatusWatcher(job.fetch, interval=0.01)
+        first = watcher.subscribe("job")
+        assert await first.get() == "RUNNING"
+        late = watcher.subscribe("job")
+        status = await late.get()
+        await watcher.stop()
+        return status
+
+    assert asyncio.run(run()) == "RUNNING"
+
+
+def test_polling_stops_without_subscribers():
+    job = Job("RUNNING")
+
+    async def run():
+        watcher = StatusWatcher(job.fetch, interval=0.01)
+        subscription = watcher.subscribe("job")
+        await subscription.get()
+        task = subscription.watch.task
+        subscription.close()
+        await asyncio.sleep(0.02)
+        return task.cancelled(), watcher.watches
+
+    assert asyncio.run(run()) == (True, {})
+
+
+def test_errors_are_not_published():
+    job = Job("<html>Bad gateway</html>", "FINISHED")
+
+    async def run():
+        watcher = StatusWatcher(job.fetch, interval=0.01)
+        return await collect(watcher.subscribe("job"))
+
+    assert asyncio.run(run()) == ["FINISHED"]
@@ -0,0 +1,129 @@
+import asyncio
+import csv
+import json
+import pytest
+
+from rfam_batch.export import *
+
+FORWARD = (
+    "5S_rRNA              RF00001   EMBOSS_001           -          cm"
+    "        1      119        1      119      +    no    1 0.49   0.0"
+    "  104.9   4.5e-24 !   5S ribosomal RNA"
+)
+REVERSE = (
+    "tRNA                 RF00005   chr1;x=1             -          cm"
+    "        1       71      300      230      -    no    1 0.55   0.0"
+    "   60.3   2.1e-12 !   tRNA"
+)
+
+
+async def lines(*rows):
+    for row in rows:
+        yield row
+
+
+def export(name, *rows, chunk_size=EXPORT_CHUNK_SIZE):
+    async def run():
+        hits = aiter_export_hits(lines(*rows))
+        first = await anext(hits, None)
+        return [
+            chunk
+            async for chunk in export_chunks(
+                export_format(name), first, hits, chunk_size
+            )
+        ]
+
+    return asyncio.run(run())
+
+
+@pytest.fixture
+def tblout_text():
+    with open("./tests/example_files/tblout", "r") as file:
+        return file.read()
+
+
+def test_tblout_export_hit():
+    hit = tblout_export_hit(FORWARD)
+    assert hit.query == "EMBOSS_001"
+    assert hit.record.key == (1, 119, 104.9, 4.5e-24)
+    assert hit.description == "5S ribosomal RNA"
+    assert tblout_export_hit("#target name") is None
+
+
+def test_gff3():
+    document = "".join(export("gff3", FORWARD, REVERSE))
+    header, forward, reverse = document.splitlines()
+    assert header == "##gff-version 3"
+    assert forward.split("\t") == [
+        "EMBOSS_001",
+        "cmscan",
+        "ncRNA",
+        "1",
+        "119",
+        "104.9",
+        "+",
+        ".",
+        "Name=5S_rRNA;Alias=RF00001;evalue=4.5e-24;gc=0.49;Note=5S ribosomal RNA",
+    ]
+    columns = reverse.split("\t")
+    # Reserved characters are escaped, coordinates go from low to high
+    assert columns[0] == "chr1%3Bx%3D1"
+    assert columns[3:7] == ["230", "300", "60.3", "-"]
+
+
+def test_bed():
+    document = "".join(export("bed", FORWARD, REVERSE))
+    assert document.splitlines() == [
+        "EMBOSS_001\t0\t119\t5S_rRNA\t105\t+",
+        "chr1;x=1\t229\t300\ttRNA\t60\t-",
+    ]
+
+
+def test_csv():
+    document = "".join(export("csv", FORWARD, REVERSE))
+    rows = list(csv.DictReader(document.splitlines()))
+    assert list(rows[0]) == COLUMNS
+    assert rows[0]["query"] == "EMBOSS_001"
+    assert rows[0]["E"] == "4.5e-24"
+    assert rows[1]["start"] == "300"
+    assert rows[1]["description"] == "tRNA"
+
+
+def test_jsonl(tblout_text):
+    document = "".join(export("jsonl", *tblout_text.splitlines()))
+    hits = [json.loads(line) for line in document.splitlines()]
+    assert hits == [
+        {
+            "query": "EMBOSS_001",
+            "id": "5S_rRNA",
+            "acc": "RF00001",
+            "start": 1,
+            "end": 119,
+            "strand": "+",
+            "GC": 0.49,
+            "score": 104.9,
+            "E": 4.5e-24,
+            "description": "5S ribosomal RNA",
+        }
+    ]
+
+
+def test_export_chunks():
+    rows = [FORWARD] * 100
+    chunks = export("bed", *rows, chunk_size=200)
+    assert len(chunks) > 10
+    # Each chunk is sent once it reaches the chunk size
+    assert all(200 <= len(chunk) < 250 for chunk in chunks[:-1])
+    assert "".join(chunks).count("\n") == 100
+
+
+def test_export_without_hits():
+    assert export("bed") == []
+    assert export("gff3", "# comment") == ["##gff-version 3\n"]
+    assert export("csv") == [",".join(COLUMNS) + "\n"]
+
+
+def test_unknown_format():
+    with pytest.raises(HTTPException) as e:
+        export_format("xlsx")
+    assert e.value.status_code == 400
@@ -0,0 +1,80 @@
+import asyncio
+import gzip
+import pytest
+
+from fastapi import Request
+from rfam_batch import http_cache
+from rfam_batch.http_cache import *
+
+
+def make_request(**headers):
+    return Request(
+        {
+            "type": "http",
+            "headers": [
+                (name.replace("_", "-").encode(), value.encode())
+                for name, value in headers.items()
+            ],
+        }
+    )
+
+
+def test_if_none_match():
+    tag = etag(b"result")
+    assert if_none_match(tag, tag)
+    assert if_none_match(f'"other", W/{tag}', tag)
+    assert if_none_match(variant_etag(tag, "gzip"), tag)
+    assert if_none_match("*", tag)
+    assert not if_none_match('"other"', tag)
+    assert not if_none_match(None, tag)
+
+
+def test_accepted_encoding(monkeypatch):
+    monkeypatch.setattr(http_cache, "brotli", None)
+    assert accepted_encoding("gzip, deflate, br") == "gzip"
+    assert accepted_encoding("gzip;q=0, deflate") is None
+    assert accepted_encoding(None) is None
+
+
+def test_finished_response_is_cacheable_and_compressed():
+    body = b"row\n" * 1000
+    request = make_request(accept_encoding="gzip")
+    response = asyncio.run(cacheable_response(request, body, "text/plain", True))
+    assert response.status_code == 200
+    assert "immutable" in response.headers["cache-control"]
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"] == variant_etag(etag(body), "gzip")
+    assert gzip.decompress(response.body) == body
+
+
+def test_unfinished_response_is_not_stored():
+    request = make_request()
+    response = asyncio.run(cacheable_response(request, b"", "text/plain", False))
+    assert response.headers["cache-control"] == "no-store"
+    assert "content-encoding" not in response.headers
+
+
+def test_not_modified():
+    body = b"row\n" * 1000
+    request = make_request(if_none_match=etag(body))
+    response = asyncio.run(
+        cacheable_response(
+            request,
+            body,
+            "text/plain",
+            True,
+            headers={"Access-Control-Allow-Origin": "*"},
+        )
+    )
+    assert response.status_code == 304
+    assert response.body == b""
+    assert response.headers["access-control-allow-origin"] == "*"
+
+
+def test_brotli():
+    brotli = pytest.importorskip("brotli")
+    body = b"row\n" * 1000
+    request = make_request(accept_encoding="gzip, br")
+    response = asyncio.run(cacheable_response(request, body, "text/plain", True))
+    assert response.headers["content-encoding"] == "br"
+    assert brotli.decompress(response.body) == body
@@ -0,0 +1,79 @@
+import asyncio
+import pytest
+
+from rfam_batch.job_dispatcher import *
+
+
+def test_coalesce_merges_concurrent_calls():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "FINISHED"
+
+    async def run():
+        return await asyncio.gather(
+            *[JobDispatcher.coalesce("status:job", fetch) for _ in range(10)]
+        )
+
+    assert asyncio.run(run()) == ["FINISHED"] * 10
+    assert len(calls) == 1
+    assert JobDispatcher.inflight == {}
+
+
+def test_coalesce_shares_exceptions():
+    async def fetch():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream error")
+
+    async def run():
+        return await asyncio.gather(
+            *[JobDispatcher.coalesce("status:job", fetch) for _ in range(3)],
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_coalesce_runs_again_after_completion():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        return len(calls)
+
+    async def run():
+        first = await JobDispatcher.coalesce("status:job", fetch)
+        second = await JobDispatcher.coalesce("status:job", fetch)
+        return first, second
+
+    assert asyncio.run(run()) == (1, 2)
+
+
+def test_cmscan_artifacts_fetched_concurrently():
+    class Dispatcher(JobDispatcher):
+        async def fetch_text(self, url, call=None):
+            await asyncio.sleep(0.05)
+            return url.rsplit("/", 1)[1]
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        artifacts = await Dispatcher().cmscan_artifacts("job")
+        return artifacts, loop.time() - start
+
+    artifacts, elapsed = asyncio.run(run())
+    assert artifacts == ("out", "sequence", "tblout")
+    assert elapsed < 0.1
+
+
+def test_incomplete_backend():
+    class Backend(SearchBackend):
+        async def submit_cmscan_job(self, data):
+            return "job"
+
+    # Fails when created, not on its first request
+    with pytest.raises(TypeError):
+        asyncio.run(Backend.startup())
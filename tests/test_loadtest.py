@@ -0,0 +1,67 @@
+import asyncio
+import pytest
+
+from aiohttp.test_utils import TestServer
+from fastapi import HTTPException
+from loadtest.driver import percentile
+from loadtest.fake_jd import *
+from rfam_batch import job_dispatcher as jd
+from tests.conftest import make_query
+
+
+def run_with_fake(monkeypatch, test, **options):
+    async def run():
+        server = TestServer(FakeJobDispatcher(seed=0, **options).app())
+        await server.start_server()
+        monkeypatch.setattr(
+            jd, "INFERNAL_CMSCAN_BASE_URL", str(server.make_url("")).rstrip("/")
+        )
+        dispatcher = await jd.JobDispatcher.startup()
+        try:
+            return await test(dispatcher)
+        finally:
+            await jd.JobDispatcher.shutdown()
+            await server.close()
+
+    return asyncio.run(run())
+
+
+def test_fake_job_lifecycle(monkeypatch):
+    async def test(dispatcher):
+        job_id = await dispatcher.submit_cmscan_job(make_query())
+        running = await dispatcher.cmscan_status(job_id)
+        early = await dispatcher.cmscan_tblout(job_id)
+        await asyncio.sleep(0.2)
+        finished = await dispatcher.cmscan_status(job_id)
+        return running, early, finished, await dispatcher.cmscan_artifacts(job_id)
+
+    running, early, finished, artifacts = run_with_fake(
+        monkeypatch, test, job_duration=0.2
+    )
+    assert running in ("QUEUED", "RUNNING")
+    assert early == ""
+    assert finished == "FINISHED"
+    assert artifacts[2].startswith("#target name")
+
+
+def test_fake_unknown_job(monkeypatch):
+    async def test(dispatcher):
+        return await dispatcher.cmscan_status("infernal_cmscan-missing")
+
+    assert run_with_fake(monkeypatch, test) == "NOT_FOUND"
+
+
+def test_fake_errors(monkeypatch):
+    async def test(dispatcher):
+        await dispatcher.submit_cmscan_job(make_query())
+
+    with pytest.raises(HTTPException) as e:
+        run_with_fake(monkeypatch, test, error_rate=1.0)
+    assert e.value.status_code == 503
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([7], 95) == 7
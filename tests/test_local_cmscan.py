@@ -0,0 +1,135 @@
+import asyncio
+import os
+import pytest
+
+from fastapi import HTTPException
+from rfam_batch.api import parse_cm_scan_result
+from rfam_batch.local_cmscan import *
+from tests.conftest import make_query
+
+STUB_CMSCAN = os.path.join(os.path.dirname(__file__), "stub_cmscan.py")
+
+
+def example(name):
+    with open(os.path.join(os.path.dirname(__file__), "example_files", name)) as f:
+        return f.read()
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    monkeypatch.setattr(LocalCmscan, "binary", STUB_CMSCAN)
+    monkeypatch.setattr(LocalCmscan, "database", "Rfam.cm")
+    monkeypatch.setattr(LocalCmscan, "workdir", str(tmp_path))
+    return LocalCmscan
+
+
+async def wait_for(backend, job_id, timeout=5):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while (status := await backend().cmscan_status(job_id)) in ("QUEUED", "RUNNING"):
+        assert loop.time() < deadline
+        await asyncio.sleep(0.01)
+    return status
+
+
+def run(backend, test):
+    async def main():
+        await backend.startup()
+        try:
+            return await test()
+        finally:
+            await backend.shutdown()
+
+    return asyncio.run(main())
+
+
+def test_job_writes_artifacts(backend):
+    async def test():
+        job_id = await backend().submit_cmscan_job(
+            make_query(example("sequence").strip())
+        )
+        status = await wait_for(backend, job_id)
+        return status, await backend().cmscan_artifacts(job_id)
+
+    status, (out, sequence, tblout) = run(backend, test)
+    assert status == "FINISHED"
+    assert out == example("out")
+    assert tblout == example("tblout")
+    assert sequence.startswith(">EMBOSS_001\n")
+    result = parse_cm_scan_result(out, sequence, tblout, "job")
+    assert result.numHits == 1
+
+
+def test_failed_command(backend, monkeypatch):
+    monkeypatch.setattr(LocalCmscan, "binary", "false")
+
+    async def test():
+        job_id = await backend().submit_cmscan_job(make_query())
+        return await wait_for(backend, job_id), backend.stats()
+
+    status, stats = run(backend, test)
+    assert status == "FAILURE"
+    assert stats["failed"] >= 1
+
+
+def test_missing_command(backend, monkeypatch):
+    monkeypatch.setattr(LocalCmscan, "binary", "/nonexistent/cmscan")
+
+    async def test():
+        job_id = await backend().submit_cmscan_job(make_query())
+        return await wait_for(backend, job_id)
+
+    assert run(backend, test) == "ERROR"
+
+
+def test_jobs_run_concurrently_up_to_the_limit(backend, monkeypatch):
+    monkeypatch.setattr(LocalCmscan, "concurrency", 2)
+
+    async def run_job(job_id, threshold_model):
+        await asyncio.sleep(0.1)
+
+    monkeypatch.setattr(LocalCmscan, "run_job", run_job)
+
+    async def test():
+        for _ in range(3):
+            await backend().submit_cmscan_job(make_query())
+        await asyncio.sleep(0.01)
+        return backend.stats()
+
+    stats = run(backend, test)
+    assert stats["running"] == 2
+    assert stats["queued"] == 1
+
+
+def test_full_queue_rejects_submissions(backend, monkeypatch):
+    monkeypatch.setattr(LocalCmscan, "queue_size", 1)
+    monkeypatch.setattr(LocalCmscan, "concurrency", 0)
+
+    async def test():
+        await backend().submit_cmscan_job(make_query())
+        await backend().submit_cmscan_job(make_query())
+
+    with pytest.raises(HTTPException) as e:
+        run(backend, test)
+    assert e.value.status_code == 503
+
+
+def test_unknown_jobs(backend):
+    async def test():
+        return (
+            await backend().cmscan_status("local_cmscan-missing"),
+            await backend().cmscan_status("../etc"),
+            await backend().fetch_artifact("../etc", "passwd"),
+        )
+
+    assert run(backend, test) == ("NOT_FOUND", "NOT_FOUND", "")
+
+
+def test_queued_jobs_fail_on_shutdown(backend, monkeypatch):
+    monkeypatch.setattr(LocalCmscan, "concurrency", 0)
+
+    async def test():
+        return await backend().submit_cmscan_job(make_query())
+
+    job_id = run(backend, test)
+    assert asyncio.run(backend().cmscan_status(job_id)) == "ERROR"
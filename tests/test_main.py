@@ -0,0 +1,272 @@
+import asyncio
+import json
+import pytest
+import threading
+import time
+
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import main
+from rfam_batch import admission, events, poller, scheduler, status_cache
+from rfam_batch.cache import DiskStore, LRUCache, ResultCache
+from rfam_batch.job_dispatcher import SearchBackend
+from rfam_batch.notify import Notifier
+
+ARTIFACTS = {}
+for kind in ("out", "sequence", "tblout"):
+    with open(f"./tests/example_files/{kind}", "r") as file:
+        ARTIFACTS[kind] = file.read()
+
+
+class FakeBackend(SearchBackend):
+    """
+    Jobs finishing as soon as they are submitted, with the example files as
+    their results
+    """
+
+    def __init__(self) -> None:
+        self.jobs = {"fake-1": "FINISHED"}
+        self.fetched = []
+        # Cleared to hold submissions until it is set again
+        self.accepting = threading.Event()
+        self.accepting.set()
+        # Raised by submissions while set, as Job Dispatcher rejecting them
+        self.rejection = None
+
+    async def submit_cmscan_job(self, data):
+        while not self.accepting.is_set():
+            await asyncio.sleep(0.01)
+        if self.rejection is not None:
+            raise self.rejection
+        job_id = f"fake-{len(self.jobs) + 1}"
+        self.jobs[job_id] = "FINISHED"
+        return job_id
+
+    async def cmscan_status(self, job_id):
+        return self.jobs.get(job_id, "NOT_FOUND")
+
+    async def fetch_artifact(self, job_id, kind):
+        self.fetched.append((job_id, kind))
+        return ARTIFACTS[kind] if job_id in self.jobs else ""
+
+
+@pytest.fixture
+def backend():
+    return FakeBackend()
+
+
+@pytest.fixture
+def client(registry, tmp_path, monkeypatch, backend):
+    results = ResultCache(
+        LRUCache(100, 10**8), DiskStore(str(tmp_path / "results"), 10**9)
+    )
+    # Everything main.py builds from the backend and the registry
+    replaced = {
+        "search": backend,
+        "job_registry": registry,
+        "result_cache": results,
+        "job_statuses": status_cache.StatusCache(
+            backend.cmscan_status, registry, ttl=0.01
+        ),
+        "rate_limiter": admission.RateLimiter(registry),
+        "upstream_limiter": admission.UpstreamLimiter(registry, poll_interval=0.01),
+        "job_scheduler": scheduler.SubmissionScheduler(main.dispatch, registry),
+        "notifier": Notifier.from_env(registry=registry),
+        "status_watcher": events.StatusWatcher(main.job_status, interval=0.01),
+        "status_poller": poller.StatusPoller(
+            main.job_status, main.notify, registry=registry
+        ),
+    }
+    for name, value in replaced.items():
+        monkeypatch.setattr(main, name, value)
+    with TestClient(main.app) as client:
+        yield client
+
+
+def test_metrics(client):
+    client.get("/result/fake-1/tblout")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    # Requests are labelled by route, not by URL
+    assert 'route="/result/{job_id}/tblout"' in response.text
+    assert "fake-1" not in response.text
+
+
+def fetched(backend, kind):
+    return sum(1 for _, fetched_kind in backend.fetched if fetched_kind == kind)
+
+
+def test_result_etag(client, backend):
+    response = client.get("/result/fake-1")
+    assert response.status_code == 200
+    assert "immutable" in response.headers["cache-control"]
+    assert response.json()["numHits"] == 1
+    tag = response.headers["etag"]
+
+    response = client.get("/result/fake-1", headers={"If-None-Match": tag})
+    assert response.status_code == 304
+    assert response.content == b""
+    # Served from the result cache
+    assert fetched(backend, "out") == 1
+
+
+def test_result_encoding(client):
+    identity = client.get("/result/fake-1", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in identity.headers
+    response = client.get("/result/fake-1", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.headers["etag"] != identity.headers["etag"]
+    assert response.content == identity.content
+
+
+def test_unfinished_result_not_cached(client, backend):
+    backend.jobs["fake-1"] = "RUNNING"
+    response = client.get("/result/fake-1/tblout")
+    assert response.headers["cache-control"] == "no-store"
+
+
+def test_status_events(client, backend):
+    backend.jobs["fake-running"] = "RUNNING"
+
+    def finish():
+        time.sleep(0.1)
+        backend.jobs["fake-running"] = "FINISHED"
+
+    threading.Thread(target=finish).start()
+    with client.stream("GET", "/status/fake-running/events") as response:
+        assert response.headers["content-type"].startswith("text/event-stream")
+        body = "".join(response.iter_text())
+    # Every change of status, ending with the terminal one
+    assert body.startswith("event: status\ndata: RUNNING\n\n")
+    assert body.endswith("event: status\ndata: FINISHED\n\n")
+
+
+def test_bulk_routes(client):
+    job_ids = ["fake-1", "fake-1", "rfam_batch-unknown"]
+    response = client.post("/status", json={"jobIds": job_ids})
+    assert response.json() == {
+        "statuses": {"fake-1": "FINISHED", "rfam_batch-unknown": "NOT_FOUND"},
+        "errors": {},
+    }
+
+    response = client.post("/result/summary", json={"jobIds": ["fake-1"]})
+    summary = response.json()["summaries"]["fake-1"]
+    assert summary == {"status": "FINISHED", "numHits": 1, "numSequences": 1}
+
+
+def test_unknown_job_not_found(client):
+    for route in ("hits.ndjson", "export"):
+        response = client.get(f"/result/rfam_batch-unknown/{route}")
+        assert response.status_code == 404
+
+
+def test_submission_rate_limited(client, monkeypatch):
+    monkeypatch.setattr(main.rate_limiter, "burst", 1)
+    files = {"sequence_file": ("query.fa", ARTIFACTS["sequence"], "text/plain")}
+    assert client.post("/submit-job", files=files).status_code == 200
+    response = client.post("/submit-job", files=files)
+    assert response.status_code == 429
+    assert "retry-after" in response.headers
+
+
+def wait_for_status(client, job_id, status):
+    deadline = time.monotonic() + 5
+    while client.get(f"/status/{job_id}").text != status:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_submission_queued(client, backend):
+    backend.accepting.clear()
+    files = {"sequence_file": ("query.fa", ARTIFACTS["sequence"], "text/plain")}
+    response = client.post("/submit-job", files=files, data={"reuse": "false"})
+    assert response.status_code == 200
+    job_id = response.json()["jobId"]
+    # A local id, QUEUED until the scheduler sends the search upstream
+    assert job_id.startswith("rfam_batch-")
+    assert client.get(f"/status/{job_id}").text == "QUEUED"
+    # No hits yet, without caching the empty answer
+    for route in ("hits.ndjson", "export"):
+        response = client.get(f"/result/{job_id}/{route}", params={"format": "bed"})
+        assert response.status_code == 200
+        assert response.text == ""
+        assert response.headers["cache-control"] == "no-store"
+
+    backend.accepting.set()
+    wait_for_status(client, job_id, "FINISHED")
+    assert client.get(f"/jobs/{job_id}").json()["children"] == ["fake-2"]
+    assert client.get(f"/result/{job_id}").json()["numHits"] == 1
+
+
+def test_submission_rejected(client, backend):
+    backend.rejection = HTTPException(400, "Please enter a valid email address")
+    files = {"sequence_file": ("query.fa", ARTIFACTS["sequence"], "text/plain")}
+    response = client.post("/submit-job", files=files, data={"reuse": "false"})
+    job_id = response.json()["jobId"]
+    wait_for_status(client, job_id, "ERROR")
+    job = client.get(f"/jobs/{job_id}").json()
+    assert job["error"] == "Please enter a valid email address"
+
+
+def test_sequences(client, backend):
+    response = client.get("/result/fake-1/sequences")
+    assert response.json()["total"] == 1
+    assert response.json()["sequences"][0]["numHits"] == 1
+    # Later pages read the cached index and artifacts
+    assert client.get("/result/fake-1/sequences").json() == response.json()
+    assert fetched(backend, "out") == 1
+
+
+def test_hits_ndjson(client, backend):
+    response = client.get("/result/fake-1/hits.ndjson")
+    hits = [json.loads(line) for line in response.text.splitlines()]
+    assert response.headers["access-control-allow-origin"] == "*"
+    assert [hit["id"] for hit in hits] == ["5S_rRNA"]
+    # Read from the result cache once the tblout is there
+    client.get("/result/fake-1/tblout")
+    client.get("/result/fake-1/hits.ndjson")
+    assert fetched(backend, "tblout") == 2
+
+
+def test_export(client, backend):
+    response = client.get("/result/fake-1/export", params={"format": "bed"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/x-bed")
+    assert 'filename="fake-1.bed"' in response.headers["content-disposition"]
+    assert response.text == "EMBOSS_001\t0\t119\t5S_rRNA\t105\t+\n"
+
+    response = client.get("/result/fake-1/export", params={"format": "xlsx"})
+    assert response.status_code == 400
+
+
+def test_export_cached_tblout(client, backend):
+    client.get("/result/fake-1/tblout")
+    client.get("/result/fake-1/export", params={"format": "csv"})
+    assert fetched(backend, "tblout") == 1
+
+
+def test_reused_submission_keeps_every_email(client):
+    files = {"sequence_file": ("query.fa", ARTIFACTS["sequence"], "text/plain")}
+    job_ids = [
+        client.post("/submit-job", files=files, data={"email_address": address}).json()[
+            "jobId"
+        ]
+        for address in ("a@example.org", "b@example.org")
+    ]
+    assert job_ids[0] == job_ids[1]
+    # Both emails are pending, without showing the addresses
+    job = client.get(f"/jobs/{job_ids[0]}").json()
+    assert job["notifications"] == ["pending", "pending"]
+    assert "example.org" not in json.dumps(job)
+
+
+def test_job_hides_server_details(client):
+    files = {"sequence_file": ("query.fa", ARTIFACTS["sequence"], "text/plain")}
+    job_id = client.post("/submit-job", files=files).json()["jobId"]
+    wait_for_status(client, job_id, "FINISHED")
+    client.get(f"/result/{job_id}/tblout")
+    job = client.get(f"/jobs/{job_id}").json()
+    assert "content_hash" not in job
+    assert set(job["artifacts"]["tblout"]) == {"size", "stored_at"}
@@ -0,0 +1,54 @@
+import os
+import pytest
+import subprocess
+import sys
+
+from rfam_batch.metrics import *
+
+
+def sample(name, labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_upstream_call_records_duration_and_errors():
+    count = sample("rfam_batch_upstream_duration_seconds_count", {"call": "test"})
+    errors = sample("rfam_batch_upstream_errors_total", {"call": "test"})
+
+    with upstream_call("test"):
+        pass
+    with pytest.raises(ValueError):
+        with upstream_call("test"):
+            raise ValueError("upstream error")
+
+    assert (
+        sample("rfam_batch_upstream_duration_seconds_count", {"call": "test"})
+        == count + 2
+    )
+    assert sample("rfam_batch_upstream_errors_total", {"call": "test"}) == errors + 1
+
+
+def test_render():
+    content, media_type = render()
+    assert b"rfam_batch_requests_total" in content
+    assert media_type.startswith("text/plain")
+
+
+def test_metrics_are_summed_over_processes(tmp_path):
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path))
+    worker = (
+        "from rfam_batch import metrics;"
+        "metrics.EMAILS.labels('sent').inc(2);"
+        "metrics.POLLED_JOBS.set(3)"
+    )
+    for _ in range(2):
+        subprocess.run([sys.executable, "-c", worker], env=env, check=True)
+
+    scrape = "from rfam_batch import metrics; print(metrics.render()[0].decode())"
+    output = subprocess.run(
+        [sys.executable, "-c", scrape],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    assert 'rfam_batch_emails_total{outcome="sent"} 4.0' in output
@@ -0,0 +1,205 @@
+import asyncio
+import gzip
+import json
+import pytest
+
+from rfam_batch import notify
+from rfam_batch.notify import *
+
+
+class FakeSMTP:
+    """
+    Stands in for aiosmtplib.SMTP, failing the first sends if asked to
+    """
+
+    connections = []
+    failures = []
+    sent = []
+
+    def __init__(self, hostname, port):
+        self.is_connected = False
+
+    async def connect(self):
+        self.is_connected = True
+        FakeSMTP.connections.append(self)
+
+    async def send_message(self, message):
+        if FakeSMTP.failures:
+            self.is_connected = False
+            raise FakeSMTP.failures.pop(0)
+        FakeSMTP.sent.append(message)
+
+    async def quit(self):
+        self.is_connected = False
+
+    def close(self):
+        self.is_connected = False
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    monkeypatch.setattr(notify.aiosmtplib, "SMTP", FakeSMTP)
+    FakeSMTP.connections = []
+    FakeSMTP.failures = []
+    FakeSMTP.sent = []
+    return FakeSMTP
+
+
+def make_notifier(tmp_path, **kwargs):
+    options = dict(retry_backoff=0.001, dead_letter_file=str(tmp_path / "dead.jsonl"))
+    options.update(kwargs)
+    return Notifier("rfam@example.org", "localhost", 25, **options)
+
+
+def dead_letters(tmp_path):
+    path = tmp_path / "dead.jsonl"
+    if not path.exists():
+        return []
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+async def drain(notifier):
+    await notifier.start()
+    while not notifier.queue.empty():
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.01)
+    await notifier.stop()
+
+
+def test_message_attachments(tmp_path):
+    notifier = make_notifier(tmp_path, inline_max_bytes=100)
+
+    msg = notifier.message("job1", "a@example.org", "FINISHED", "small tblout")
+    assert msg["Subject"] == "Results for batch search job job1"
+    assert msg.get_payload()[0].get_payload() == "small tblout"
+
+    tblout = "x" * 1000
+    msg = notifier.message("job1", "a@example.org", "FINISHED", tblout)
+    attachment = msg.get_payload()[1]
+    assert attachment.get_filename() == "job1.tblout.gz"
+    assert gzip.decompress(attachment.get_payload(decode=True)).decode() == tblout
+
+    notifier = make_notifier(tmp_path, inline_max_bytes=100, attachment_max_bytes=10)
+    msg = notifier.message("job1", "a@example.org", "FINISHED", tblout)
+    assert len(msg.get_payload()) == 1
+    assert "/result/job1/tblout" in msg.get_payload()[0].get_payload()
+
+    msg = notifier.message("job1", "a@example.org", "FAILURE", "")
+    assert msg["Subject"] == "Error in batch search job job1"
+
+
+def test_connection_is_reused(tmp_path, smtp):
+    notifier = make_notifier(tmp_path)
+
+    async def run():
+        for i in range(20):
+            assert await notifier.enqueue(f"job{i}", "a@example.org", "FINISHED", "x")
+        await drain(notifier)
+
+    asyncio.run(run())
+    assert len(smtp.sent) == 20
+    assert len(smtp.connections) == 1
+    assert notifier.stats()["sent"] == 20
+
+
+def test_failed_sends_are_retried(tmp_path, smtp):
+    notifier = make_notifier(tmp_path, retries=2)
+    smtp.failures = [aiosmtplib.SMTPServerDisconnected("gone"), OSError("refused")]
+
+    async def run():
+        await notifier.enqueue("job1", "a@example.org", "FINISHED", "x")
+        await drain(notifier)
+
+    asyncio.run(run())
+    assert len(smtp.sent) == 1
+    assert len(smtp.connections) == 3
+    assert dead_letters(tmp_path) == []
+
+
+def test_undeliverable_emails_are_dead_lettered(tmp_path, smtp):
+    notifier = make_notifier(tmp_path, retries=3)
+    smtp.failures = [
+        aiosmtplib.SMTPRecipientsRefused(
+            [aiosmtplib.SMTPRecipientRefused(550, "no such user", "b@example.org")]
+        )
+    ]
+
+    async def run():
+        await notifier.enqueue("job1", "b@example.org", "ERROR")
+        await notifier.enqueue("job2", "a@example.org", "FINISHED", "x")
+        await drain(notifier)
+
+    asyncio.run(run())
+    # Permanent errors are not retried
+    assert [m["To"] for m in smtp.sent] == ["a@example.org"]
+    letters = dead_letters(tmp_path)
+    assert [(d["job_id"], d["email_address"]) for d in letters] == [
+        ("job1", "b@example.org")
+    ]
+    assert notifier.stats()["failed"] == 1
+
+
+def test_full_queue_and_shutdown_are_dead_lettered(tmp_path, smtp):
+    notifier = make_notifier(tmp_path, queue_size=1)
+
+    async def run():
+        assert await notifier.enqueue("job1", "a@example.org", "FINISHED", "x")
+        assert not await notifier.enqueue("job2", "a@example.org", "FINISHED", "x")
+        await notifier.stop()
+
+    asyncio.run(run())
+    assert smtp.sent == []
+    letters = dead_letters(tmp_path)
+    assert [(d["job_id"], d["reason"]) for d in letters] == [
+        ("job2", "queue full"),
+        ("job1", "shutdown"),
+    ]
+
+
+def notify_state(registry, job_id):
+    (notification,) = registry.job(job_id)["notifications"]
+    return notification["notify_state"]
+
+
+def test_registry_records_sent_emails_only(registry, tmp_path, smtp):
+    for job_id in ("job1", "job2", "job3", "job4"):
+        registry.watch(job_id, "a@example.org", "worker1", lease=60)
+    notifier = make_notifier(tmp_path, queue_size=2, retries=0, registry=registry)
+    smtp.failures = [
+        aiosmtplib.SMTPRecipientsRefused(
+            [aiosmtplib.SMTPRecipientRefused(550, "no such user", "a@example.org")]
+        ),
+        OSError("refused"),
+    ]
+
+    async def run():
+        assert await notifier.enqueue("job1", "a@example.org", "ERROR")
+        assert await notifier.enqueue("job2", "a@example.org", "FINISHED", "x")
+        assert not await notifier.enqueue("job3", "a@example.org", "FINISHED", "x")
+        await drain(notifier)
+        assert await notifier.enqueue("job4", "a@example.org", "FINISHED", "x")
+        await drain(notifier)
+
+    asyncio.run(run())
+    states = {j: notify_state(registry, j) for j in ("job1", "job2", "job4")}
+    assert states == {"job1": "failed", "job2": "pending", "job4": "sent"}
+    # Emails not sent yet are taken over by the next worker resuming jobs
+    claimed = registry.claim("worker2", lease=60, limit=10)
+    assert sorted(job.job_id for job in claimed) == ["job2", "job3"]
+    # Only the permanent failure is dead-lettered
+    assert [d["job_id"] for d in dead_letters(tmp_path)] == ["job1"]
+    assert notifier.stats()["deferred"] == 2
+
+
+def test_shutdown_leaves_emails_pending(registry, tmp_path, smtp):
+    registry.watch("job1", "a@example.org", "worker1", lease=60)
+    notifier = make_notifier(tmp_path, registry=registry)
+
+    async def run():
+        assert await notifier.enqueue("job1", "a@example.org", "FINISHED", "x")
+        await notifier.stop()
+
+    asyncio.run(run())
+    assert notify_state(registry, "job1") == "pending"
+    assert [j.job_id for j in registry.claim("worker2", 60, 10)] == ["job1"]
+    assert dead_letters(tmp_path) == []
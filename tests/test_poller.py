@@ -0,0 +1,170 @@
+import asyncio
+import pytest
+import time
+
+from rfam_batch.poller import *
+
+
+def make_poller(statuses, done, **kwargs):
+    async def fetch_status(job_id):
+        return statuses[job_id]
+
+    async def on_done(job, status):
+        done.append((job.job_id, job.email_address, status))
+        return True
+
+    return StatusPoller(fetch_status, on_done, **kwargs)
+
+
+def test_interval_grows_with_age():
+    poller = make_poller({}, [], interval=10, max_interval=300, backoff=0.1)
+    assert poller.interval_for(0) == 10
+    assert poller.interval_for(600) == 60
+    assert poller.interval_for(86400) == 300
+
+
+def test_finished_jobs_are_handed_over():
+    statuses = {"job1": "RUNNING", "job2": "FINISHED"}
+    done = []
+
+    async def run():
+        poller = make_poller(statuses, done)
+        poller.add("job1", "a@example.org")
+        poller.add("job2", "b@example.org")
+        polled = await poller.poll_due(now=time.time() + poller.interval)
+        return poller, polled
+
+    poller, polled = asyncio.run(run())
+    assert polled == 2
+    assert done == [("job2", "b@example.org", "FINISHED")]
+    assert list(poller.jobs) == [("job1", "a@example.org")]
+
+
+def test_every_recipient_is_handed_over():
+    done = []
+
+    async def run():
+        # A job reused by identical submissions with their own addresses
+        poller = make_poller({"job1": "FINISHED"}, done)
+        poller.add("job1", "a@example.org")
+        poller.add("job1", "b@example.org")
+        await poller.poll_due(now=time.time() + poller.interval)
+
+    asyncio.run(run())
+    assert done == [
+        ("job1", "a@example.org", "FINISHED"),
+        ("job1", "b@example.org", "FINISHED"),
+    ]
+
+
+def test_jobs_not_due_are_skipped():
+    done = []
+
+    async def run():
+        poller = make_poller({"job1": "FINISHED"}, done)
+        poller.add("job1", "a@example.org")
+        return await poller.poll_due()
+
+    assert asyncio.run(run()) == 0
+    assert done == []
+
+
+def test_jobs_expire_after_max_lifetime():
+    done = []
+
+    async def run():
+        poller = make_poller({"job1": "RUNNING"}, done, max_lifetime=-1)
+        poller.add("job1", "a@example.org")
+        await poller.poll_due(now=time.time() + poller.interval)
+        return poller
+
+    assert asyncio.run(run()).jobs == {}
+    assert done == []
+
+
+def test_polls_are_batched_with_bounded_concurrency():
+    running = []
+    peak = []
+
+    async def fetch_status(job_id):
+        running.append(job_id)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(job_id)
+        return "RUNNING"
+
+    async def on_done(job, status):
+        pass
+
+    async def run():
+        poller = StatusPoller(fetch_status, on_done, concurrency=3, batch_size=5)
+        for i in range(8):
+            poller.add(f"job{i}", "a@example.org")
+        return await poller.poll_due(now=time.time() + poller.interval)
+
+    assert asyncio.run(run()) == 5
+    assert max(peak) == 3
+
+
+def test_status_errors_keep_the_job_pending():
+    async def fetch_status(job_id):
+        raise ValueError("upstream error")
+
+    async def on_done(job, status):
+        pass
+
+    async def run():
+        poller = StatusPoller(fetch_status, on_done)
+        poller.add("job1", "a@example.org")
+        await poller.poll_due(now=time.time() + poller.interval)
+        return poller
+
+    assert list(asyncio.run(run()).jobs) == [("job1", "a@example.org")]
+
+
+def test_pending_jobs_resume_after_restart(registry):
+    statuses = {"job1": "RUNNING", "job2": "FINISHED"}
+    done = []
+
+    async def run():
+        # The first worker stops without renewing its leases
+        stopped = make_poller(statuses, done, registry=registry, lease=-1)
+        stopped.add("job1", "a@example.org")
+        stopped.add("job2", "b@example.org")
+
+        poller = make_poller(statuses, done, registry=registry, lease=60)
+        assert poller.resume() == 2
+        assert poller.resume() == 0
+        await poller.poll_due()
+        return poller
+
+    poller = asyncio.run(run())
+    assert done == [("job2", "b@example.org", "FINISHED")]
+    assert list(poller.jobs) == [("job1", "a@example.org")]
+    # Released by on_done once the email is sent
+    assert registry.job("job2")["notifications"][0]["notify_state"] == "pending"
+    # Taken over by nobody else while the lease is renewed
+    assert registry.claim("other", lease=60, limit=10) == []
+
+
+def test_jobs_not_taken_over_stay_pending(registry):
+    async def fetch_status(job_id):
+        return "FINISHED"
+
+    async def on_done(job, status):
+        if job.job_id == "job2":
+            raise ValueError("artifact unavailable")
+        return False
+
+    async def run():
+        poller = StatusPoller(fetch_status, on_done, registry=registry, lease=60)
+        poller.add("job1", "a@example.org")
+        poller.add("job2", "b@example.org")
+        await poller.poll_due(now=time.time() + poller.interval)
+        return poller
+
+    assert asyncio.run(run()).jobs == {}
+    # Any worker tries again when it next resumes jobs
+    claimed = registry.claim("other", lease=60, limit=10)
+    assert sorted(job.job_id for job in claimed) == ["job1", "job2"]
+    assert registry.job("job1")["notifications"][0]["notify_state"] == "pending"
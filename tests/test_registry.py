@@ -0,0 +1,144 @@
+import pytest
+import time
+
+from rfam_batch.registry import *
+
+
+def test_children(registry):
+    assert registry.children("rfam_batch-1") is None
+    registry.register("rfam_batch-1", "hash", ["job2", "job1", "job3"])
+    assert registry.children("rfam_batch-1") == ["job2", "job1", "job3"]
+    assert registry.children("job1") is None
+
+
+def test_reusable(registry):
+    assert registry.reusable("hash", ttl=60) is None
+    registry.register("job1", "hash")
+    registry.register("job2", "hash")
+    assert registry.reusable("hash", ttl=60) == "job2"
+    assert registry.reusable("hash", ttl=-1) is None
+
+    registry.record_status("job2", "ERROR")
+    assert registry.reusable("hash", ttl=60) == "job1"
+    registry.forget_content("hash")
+    assert registry.reusable("hash", ttl=60) is None
+
+
+def test_status_transitions(registry):
+    registry.register("job1")
+    assert registry.status("job1") is None
+    assert registry.record_status("job1", "QUEUED")
+    assert not registry.record_status("job1", "QUEUED")
+    assert registry.record_status("job1", "FINISHED")
+    assert registry.status("job1") == "FINISHED"
+    # Only jobs submitted here are recorded
+    assert not registry.record_status("other", "FINISHED")
+    assert registry.status("other") is None
+    assert registry.job("job1")["error"] is None
+
+    job = registry.job("job1")
+    assert [t["status"] for t in job["transitions"]] == ["QUEUED", "FINISHED"]
+
+
+def test_status_error(registry):
+    registry.register("job1")
+    assert registry.record_status("job1", "ERROR", "Please enter a valid email")
+    assert registry.job("job1")["error"] == "Please enter a valid email"
+
+
+def test_job(registry):
+    assert registry.job("rfam_batch-1") is None
+    registry.register("rfam_batch-1", "hash", ["job1", "job2"])
+    registry.record_artifact("rfam_batch-1", "tblout", "/results/ab/abc", 123)
+    job = registry.job("rfam_batch-1")
+    assert job["content_hash"] == "hash"
+    assert job["children"] == ["job1", "job2"]
+    assert job["artifacts"]["tblout"]["location"] == "/results/ab/abc"
+    assert job["artifacts"]["tblout"]["size"] == 123
+    assert registry.job("job1")["parent_id"] == "rfam_batch-1"
+
+
+def test_leases(registry):
+    registry.register("job1")
+    registry.watch("job1", "a@example.org", "worker1", lease=60)
+    registry.watch("job2", "b@example.org", "worker1", lease=-1)
+
+    # Only the job whose lease expired is taken over, and only once
+    claimed = registry.claim("worker2", lease=60, limit=10)
+    assert [(j.job_id, j.email_address) for j in claimed] == [("job2", "b@example.org")]
+    assert registry.claim("worker3", lease=60, limit=10) == []
+
+    registry.renew("worker2", lease=-1)
+    assert [j.job_id for j in registry.claim("worker3", 60, 10)] == ["job2"]
+
+    registry.release("job2", "b@example.org", "sent")
+    registry.renew("worker3", lease=-1)
+    assert registry.claim("worker4", lease=60, limit=10) == []
+    assert registry.job("job2")["notifications"] == [
+        {"email_address": "b@example.org", "notify_state": "sent"}
+    ]
+
+
+def test_emails_per_recipient(registry):
+    # A job reused by a second submission is sent to both addresses
+    registry.watch("job1", "a@example.org", "worker1", lease=-1)
+    registry.watch("job1", "b@example.org", "worker1", lease=-1)
+    registry.release("job1", "a@example.org", "sent")
+
+    claimed = registry.claim("worker2", lease=60, limit=10)
+    assert [(j.job_id, j.email_address) for j in claimed] == [("job1", "b@example.org")]
+    states = {
+        n["email_address"]: n["notify_state"]
+        for n in registry.job("job1")["notifications"]
+    }
+    assert states == {"a@example.org": "sent", "b@example.org": "pending"}
+
+
+def test_shared_between_connections(tmp_path):
+    path = str(tmp_path / "registry.sqlite3")
+    first, second = JobRegistry(path), JobRegistry(path)
+    first.register("rfam_batch-1", "hash", ["job1"])
+    assert second.children("rfam_batch-1") == ["job1"]
+    assert second.db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_scheduled(registry):
+    registry.schedule("rfam_batch-1", "bulk", b"payload", "worker1", lease=60)
+    registry.schedule("rfam_batch-2", "interactive", b"other", "worker1", lease=-1)
+
+    claimed = registry.claim_scheduled("worker2", lease=60, limit=10)
+    assert [(s.job_id, s.priority, s.payload) for s in claimed] == [
+        ("rfam_batch-2", "interactive", b"other")
+    ]
+    assert registry.claim_scheduled("worker3", lease=60, limit=10) == []
+
+    registry.renew_scheduled("worker1", lease=-1)
+    registry.unschedule("rfam_batch-2")
+    claimed = registry.claim_scheduled("worker3", lease=60, limit=10)
+    assert [s.job_id for s in claimed] == ["rfam_batch-1"]
+
+
+def test_finish_scheduled(registry):
+    registry.schedule("rfam_batch-1", "bulk", b"payload", "worker1", lease=-1)
+    registry.record_submitted("rfam_batch-1", 1, "job2")
+    registry.record_submitted("rfam_batch-1", 0, "job1")
+    (claimed,) = registry.claim_scheduled("worker2", lease=60, limit=10)
+    # Chunks sent before the worker went away are taken over with it
+    assert claimed.submitted == {0: "job1", 1: "job2"}
+
+    registry.finish_scheduled("rfam_batch-1", ["job1", "job2", "job3"])
+    assert registry.children("rfam_batch-1") == ["job1", "job2", "job3"]
+    registry.renew_scheduled("worker2", lease=-1)
+    assert registry.claim_scheduled("worker3", lease=60, limit=10) == []
+
+
+def test_upstream_slots(registry):
+    first = registry.acquire_slot("worker1", limit=2, lease=60)
+    assert registry.acquire_slot("worker2", limit=2, lease=60) is not None
+    assert registry.acquire_slot("worker2", limit=2, lease=60) is None
+    registry.release_slot(first)
+    assert registry.slots_taken() == 1
+    # Slots of a worker that went away are freed once their lease expires
+    assert registry.acquire_slot("worker2", limit=2, lease=-1) is not None
+    assert registry.acquire_slot("worker2", limit=2, lease=60) is not None
+    assert registry.slots_taken() == 2
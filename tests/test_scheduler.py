@@ -0,0 +1,168 @@
+import asyncio
+import pytest
+
+from fastapi import HTTPException
+from rfam_batch.scheduler import *
+from tests.conftest import make_query
+
+
+def make_submission(job_id, priority=INTERACTIVE):
+    query = make_query(">seq\nACGU")
+    query.id = job_id
+    return Submission(job_id, priority, query, [">seq\nACGU"])
+
+
+def test_priority_class():
+    assert priority_class(1, None) == INTERACTIVE
+    assert priority_class(1, "a@example.org") == BULK
+    assert priority_class(2, None) == BULK
+    assert priority_class(5, None, interactive_max_sequences=5) == INTERACTIVE
+
+
+def test_payload_round_trip():
+    submission = make_submission("rfam_batch-1", BULK)
+    restored = Submission.from_payload(
+        "rfam_batch-1", BULK, submission.payload(), submission.enqueued_at, {0: "job1"}
+    )
+    assert restored.sequences == submission.sequences
+    assert restored.query.sequences == submission.query.sequences
+    assert restored.query.id == "rfam_batch-1"
+    assert restored.query.email_address == "dummy@email.com"
+    assert restored.enqueued_at == submission.enqueued_at
+    assert restored.submitted == {0: "job1"}
+
+
+def test_weighted_turns():
+    queues = WeightedQueues({INTERACTIVE: 4, BULK: 1})
+    for i in range(10):
+        queues.push(make_submission(f"i{i}", INTERACTIVE))
+        queues.push(make_submission(f"b{i}", BULK))
+
+    order = [queues.pop().priority for _ in range(10)]
+    assert order.count(INTERACTIVE) == 8
+    assert order.count(BULK) == 2
+    # Bulk submissions are not starved while interactive ones are queued
+    assert BULK in order[:5]
+
+    # An idle class leaves its turns to the others
+    rest = [queues.pop().job_id for _ in range(10)]
+    assert rest[-6:] == [f"b{i}" for i in range(4, 10)]
+    assert queues.pop() is None
+    assert len(queues) == 0
+
+
+def test_pop_classes():
+    queues = WeightedQueues({INTERACTIVE: 4, BULK: 1})
+    queues.push(make_submission("b0", BULK))
+    assert queues.pop([INTERACTIVE]) is None
+    queues.push(make_submission("i0", INTERACTIVE))
+    assert queues.pop([INTERACTIVE]).job_id == "i0"
+    assert queues.pop().job_id == "b0"
+
+
+def test_queue_full():
+    async def dispatch(submission):
+        pass
+
+    scheduler = SubmissionScheduler(dispatch, queue_size=2)
+    scheduler.submit(make_submission("rfam_batch-1"))
+    scheduler.submit(make_submission("rfam_batch-2"))
+    with pytest.raises(HTTPException) as e:
+        scheduler.check(INTERACTIVE)
+    assert e.value.status_code == 429
+    assert "Retry-After" in e.value.headers
+    # Each class has its own queue
+    scheduler.check(BULK)
+    assert scheduler.stats()["rejected"] == 1
+
+
+def test_dispatch_errors():
+    sent = []
+
+    async def dispatch(submission):
+        sent.append(submission.job_id)
+        if submission.job_id == "rfam_batch-1":
+            raise RuntimeError("upstream down")
+
+    async def run():
+        scheduler = SubmissionScheduler(dispatch, concurrency=1)
+        await scheduler.start()
+        for i in range(1, 4):
+            scheduler.submit(make_submission(f"rfam_batch-{i}"))
+        while scheduler.stats()["dispatched"] < 3:
+            await asyncio.sleep(0.01)
+        await scheduler.stop()
+
+    asyncio.run(run())
+    assert sent == ["rfam_batch-1", "rfam_batch-2", "rfam_batch-3"]
+
+
+def test_resume(registry):
+    sent = []
+
+    async def dispatch(submission):
+        sent.append(submission.job_id)
+
+    async def run():
+        # Queued by a worker that stopped before sending them
+        stopped = SubmissionScheduler(dispatch, registry=registry)
+        stopped.submit(make_submission("rfam_batch-1", BULK))
+        stopped.submit(make_submission("rfam_batch-2"))
+        await stopped.stop()
+
+        scheduler = SubmissionScheduler(dispatch, registry=registry)
+        await scheduler.start()
+        while len(sent) < 2:
+            await asyncio.sleep(0.01)
+        await scheduler.stop()
+
+    asyncio.run(run())
+    assert sorted(sent) == ["rfam_batch-1", "rfam_batch-2"]
+    # Sent submissions are not resumed again
+    assert registry.claim_scheduled("worker", lease=60, limit=10) == []
+
+
+def test_sent_submissions_map_to_upstream_jobs(registry):
+    async def dispatch(submission):
+        return [f"job{position}" for position in range(2)]
+
+    async def run():
+        scheduler = SubmissionScheduler(dispatch, registry=registry)
+        await scheduler.start()
+        scheduler.submit(make_submission("rfam_batch-1"))
+        while scheduler.stats()["dispatched"] < 1:
+            await asyncio.sleep(0.01)
+        await scheduler.stop()
+
+    asyncio.run(run())
+    assert registry.children("rfam_batch-1") == ["job0", "job1"]
+    assert registry.claim_scheduled("worker", lease=60, limit=10) == []
+
+
+def test_tasks_reserved_for_interactive():
+    sent = []
+    upstream = asyncio.Event()
+
+    async def dispatch(submission):
+        sent.append(submission.job_id)
+        if submission.priority == BULK:
+            # Bulk submissions wait for upstream slots
+            await upstream.wait()
+
+    async def run():
+        scheduler = SubmissionScheduler(dispatch, concurrency=3, interactive_tasks=1)
+        await scheduler.start()
+        for i in range(5):
+            scheduler.submit(make_submission(f"rfam_batch-b{i}", BULK))
+        await asyncio.sleep(0.05)
+        scheduler.submit(make_submission("rfam_batch-i0"))
+        await asyncio.sleep(0.05)
+        # Sent while every other task waits on a bulk submission
+        assert sent == ["rfam_batch-b0", "rfam_batch-b1", "rfam_batch-i0"]
+        upstream.set()
+        while scheduler.stats()["dispatched"] < 6:
+            await asyncio.sleep(0.01)
+        await scheduler.stop()
+
+    asyncio.run(run())
+    assert len(sent) == 6
@@ -0,0 +1,83 @@
+import asyncio
+import pytest
+
+from rfam_batch.status_cache import *
+
+
+class Upstream:
+    def __init__(self, *statuses):
+        self.statuses = list(statuses)
+        self.calls = 0
+
+    async def fetch(self, job_id):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0]
+
+
+@pytest.fixture
+def registry(registry):
+    registry.register("job")
+    return registry
+
+
+def test_concurrent_lookups_share_one_call(registry):
+    upstream = Upstream("RUNNING")
+    statuses = StatusCache(upstream.fetch, registry, ttl=60)
+
+    async def run():
+        return await asyncio.gather(*[statuses.get("job") for _ in range(20)])
+
+    assert asyncio.run(run()) == ["RUNNING"] * 20
+    assert upstream.calls == 1
+
+
+def test_status_expires_after_ttl(registry):
+    upstream = Upstream("RUNNING", "FINISHED")
+    statuses = StatusCache(upstream.fetch, registry, ttl=0.05)
+
+    async def run():
+        first = await statuses.get("job")
+        cached = await statuses.get("job")
+        await asyncio.sleep(0.06)
+        return first, cached, await statuses.get("job")
+
+    assert asyncio.run(run()) == ("RUNNING", "RUNNING", "FINISHED")
+    assert upstream.calls == 2
+
+
+def test_final_status_is_kept_and_shared(registry):
+    upstream = Upstream("FINISHED")
+    statuses = StatusCache(upstream.fetch, registry, ttl=0)
+
+    async def run(cache):
+        return [await cache.get("job") for _ in range(3)]
+
+    assert asyncio.run(run(statuses)) == ["FINISHED"] * 3
+    # Another worker reads it from the shared registry
+    other = StatusCache(Upstream("RUNNING").fetch, registry, ttl=0)
+    assert asyncio.run(run(other)) == ["FINISHED"] * 3
+    assert upstream.calls == 1
+
+
+def test_unknown_responses_are_not_cached(registry):
+    upstream = Upstream("<html>Bad gateway</html>", "RUNNING")
+    statuses = StatusCache(upstream.fetch, registry, ttl=60)
+
+    async def run():
+        return await statuses.get("job"), await statuses.get("job")
+
+    assert asyncio.run(run()) == ("<html>Bad gateway</html>", "RUNNING")
+    assert upstream.calls == 2
+
+
+def test_status_changes_are_recorded(registry):
+    upstream = Upstream("QUEUED", "QUEUED", "RUNNING", "<html></html>", "FINISHED")
+    statuses = StatusCache(upstream.fetch, registry, ttl=0)
+
+    async def run():
+        return [await statuses.get("job") for _ in range(5)]
+
+    asyncio.run(run())
+    transitions = registry.job("job")["transitions"]
+    assert [t["status"] for t in transitions] == ["QUEUED", "RUNNING", "FINISHED"]
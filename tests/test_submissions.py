@@ -0,0 +1,19 @@
+import pytest
+
+from rfam_batch.api import SubmittedRequest
+from rfam_batch.submissions import *
+
+
+def test_submission_key_ignores_case_and_wrapping():
+    first = SubmittedRequest.parse(">seq1\nACGU\nACGU").sequences
+    second = SubmittedRequest.parse(">seq1\nacguACGU\n").sequences
+    assert submission_key(first, "cut_ga") == submission_key(second, "cut_ga")
+
+
+def test_submission_key_depends_on_content_and_parameters():
+    sequences = [">seq1\nACGU"]
+    key = submission_key(sequences, "cut_ga")
+    assert key != submission_key([">seq1\nACGA"], "cut_ga")
+    assert key != submission_key([">seq2\nACGU"], "cut_ga")
+    assert key != submission_key(sequences, "cut_tc")
+    assert key != submission_key([">seq1", "ACGU"], "cut_ga")
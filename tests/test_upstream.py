@@ -0,0 +1,122 @@
+import asyncio
+import pytest
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from fastapi import HTTPException
+from rfam_batch.upstream import *
+
+
+def run_with_server(handler, test):
+    async def run():
+        app = web.Application()
+        app.router.add_route("*", "/{tail:.*}", handler)
+        server = TestServer(app)
+        await server.start_server()
+        client = UpstreamClient(retries=2, retry_backoff=0)
+        await client.start()
+        try:
+            return await test(client, str(server.make_url("/")))
+        finally:
+            await client.close()
+            await server.close()
+
+    return asyncio.run(run())
+
+
+def test_get_retries_unavailable_upstream():
+    attempts = []
+
+    async def handler(request):
+        attempts.append(1)
+        if len(attempts) < 3:
+            return web.Response(status=503)
+        return web.Response(text="FINISHED")
+
+    async def test(client, url):
+        return await client.get(url), client.stats()
+
+    (status, text), stats = run_with_server(handler, test)
+    assert (status, text) == (200, "FINISHED")
+    assert stats["retries"] == 2
+    assert stats["requests"] == 3
+
+
+def test_get_returns_last_response_when_retries_exhausted():
+    async def handler(request):
+        return web.Response(status=503, text="unavailable")
+
+    async def test(client, url):
+        return await client.get(url)
+
+    assert run_with_server(handler, test) == (503, "unavailable")
+
+
+def test_post_is_not_retried():
+    attempts = []
+
+    async def handler(request):
+        attempts.append(await request.post())
+        return web.Response(status=503)
+
+    async def test(client, url):
+        return await client.post(url, data={"sequence": "ACGU"})
+
+    assert run_with_server(handler, test) == (503, "")
+    assert len(attempts) == 1
+    assert attempts[0]["sequence"] == "ACGU"
+
+
+def test_connection_errors_raise_http_exception():
+    async def test():
+        client = UpstreamClient(retries=1, retry_backoff=0)
+        await client.start()
+        try:
+            # Nothing listens on port 9 of localhost
+            await client.get("http://127.0.0.1:9/status/job")
+        finally:
+            await client.close()
+
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(test())
+    assert e.value.status_code == 500
+
+
+def test_connections_are_reused():
+    async def handler(request):
+        return web.Response(text="RUNNING")
+
+    async def test(client, url):
+        for _ in range(5):
+            await client.get(url)
+        return client.stats()
+
+    stats = run_with_server(handler, test)
+    assert stats["idle_connections"] == 1
+    assert stats["in_flight"] == 0
+
+
+def test_stream_lines():
+    async def handler(request):
+        response = web.StreamResponse()
+        await response.prepare(request)
+        await response.write(b"# header\nrow 1\nro")
+        await response.write(b"w 2\r\nrow 3")
+        return response
+
+    async def test(client, url):
+        return [line async for line in client.stream_lines(url)]
+
+    assert run_with_server(handler, test) == ["# header", "row 1", "row 2", "row 3"]
+
+
+def test_stream_lines_error_status():
+    async def handler(request):
+        return web.Response(status=404)
+
+    async def test(client, url):
+        return [line async for line in client.stream_lines(url)]
+
+    with pytest.raises(HTTPException) as e:
+        run_with_server(handler, test)
+    assert e.value.status_code == 404